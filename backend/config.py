@@ -22,7 +22,14 @@ FAL_KLING_VIDEO_MODEL = os.getenv("FAL_KLING_VIDEO_MODEL", "fal-ai/kling-video/v
 FAL_LIPSYNC_MODEL = os.getenv("FAL_LIPSYNC_MODEL", "fal-ai/latentsync")
 FAL_REQUEST_TIMEOUT_SECONDS = int(os.getenv("FAL_REQUEST_TIMEOUT_SECONDS", "900"))
 FAL_POLL_INTERVAL_SECONDS = float(os.getenv("FAL_POLL_INTERVAL_SECONDS", "5"))
-FAL_KLING_MAX_WORKERS = int(os.getenv("FAL_KLING_MAX_WORKERS", "1"))
+FAL_KLING_MAX_WORKERS = int(os.getenv("FAL_KLING_MAX_WORKERS", "1"))  # limite inicial (adaptativo)
+FAL_KLING_MAX_CONCURRENCY = int(os.getenv("FAL_KLING_MAX_CONCURRENCY", "8"))
+FAL_LIPSYNC_MAX_WORKERS = int(os.getenv("FAL_LIPSYNC_MAX_WORKERS", "1"))  # limite inicial (adaptativo)
+FAL_LIPSYNC_MAX_CONCURRENCY = int(os.getenv("FAL_LIPSYNC_MAX_CONCURRENCY", "4"))
+FAL_QUEUE_WAIT_TARGET_SECONDS = float(os.getenv("FAL_QUEUE_WAIT_TARGET_SECONDS", "60"))
+FAL_QUEUE_POSITION_TARGET = int(os.getenv("FAL_QUEUE_POSITION_TARGET", "3"))
+FAL_INFLIGHT_MAX_AGE_SECONDS = int(os.getenv("FAL_INFLIGHT_MAX_AGE_SECONDS", str(6 * 3600)))
+FAL_IMAGE_MAX_WORKERS = int(os.getenv("FAL_IMAGE_MAX_WORKERS", "1"))
 FAL_LIPSYNC_GUIDANCE_SCALE = float(os.getenv("FAL_LIPSYNC_GUIDANCE_SCALE", "1.0"))
 FAL_LIPSYNC_LOOP_MODE = os.getenv("FAL_LIPSYNC_LOOP_MODE", "pingpong")
 
@@ -37,6 +44,57 @@ R2_PUBLIC_URL = os.getenv("R2_PUBLIC_URL", "").rstrip("/")
 UPLOAD_DIR = os.getenv("UPLOAD_DIR", "/tmp/clipvox_uploads")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+# ─── Face Swap (PiAPI) ────────────────────────────────────────
+FACE_SWAP_MAX_WORKERS = int(os.getenv("FACE_SWAP_MAX_WORKERS", "4"))
+FACE_SWAP_POLL_SECONDS = float(os.getenv("FACE_SWAP_POLL_SECONDS", "2"))
+
+# ─── Reference Images ─────────────────────────────────────────
+REF_IMAGE_MAX_SIDE = int(os.getenv("REF_IMAGE_MAX_SIDE", "1536"))
+REF_IMAGE_JPEG_QUALITY = int(os.getenv("REF_IMAGE_JPEG_QUALITY", "85"))
+
+# ─── Lip Sync: detecção de voz ────────────────────────────────
+# cenas sem canto (intro, solo, breakdown) não vão para o lip sync
+LIPSYNC_SKIP_INSTRUMENTAL = os.getenv("LIPSYNC_SKIP_INSTRUMENTAL", "true").lower() in ("1", "true", "yes")
+VOCAL_MIN_ACTIVE_RATIO = float(os.getenv("VOCAL_MIN_ACTIVE_RATIO", "0.2"))
+VOCAL_RMS_RELATIVE_THRESHOLD = float(os.getenv("VOCAL_RMS_RELATIVE_THRESHOLD", "0.12"))
+# pré-checagem local de rosto (OpenCV) antes de enviar o clipe ao lip sync: por
+# padrão só marca o clipe (face_check) e envia; _SKIP=true deixa de enviar os "no_face"
+LIPSYNC_FACE_PRECHECK = os.getenv("LIPSYNC_FACE_PRECHECK", "true").lower() in ("1", "true", "yes")
+LIPSYNC_FACE_PRECHECK_SKIP = os.getenv("LIPSYNC_FACE_PRECHECK_SKIP", "false").lower() in ("1", "true", "yes")
+FACE_PRECHECK_SAMPLES = int(os.getenv("FACE_PRECHECK_SAMPLES", "6"))
+# janelas de lip sync: cenas vocais adjacentes vão juntas numa única requisição
+LIPSYNC_WINDOW_BATCHING = os.getenv("LIPSYNC_WINDOW_BATCHING", "false").lower() in ("1", "true", "yes")
+LIPSYNC_WINDOW_MAX_SECONDS = float(os.getenv("LIPSYNC_WINDOW_MAX_SECONDS", "10"))
+
+# ─── Separação de vocals ──────────────────────────────────────
+# ordem de preferência; o próximo provedor entra em paralelo (hedge) se o
+# anterior passar do seu p90 de latência — o primeiro resultado vence
+VOCAL_SEPARATION_PROVIDERS = [
+    p.strip() for p in os.getenv("VOCAL_SEPARATION_PROVIDERS", "demucs,stemsplit,lalal").split(",") if p.strip()
+]
+VOCAL_HEDGE_DEFAULT_SECONDS = float(os.getenv("VOCAL_HEDGE_DEFAULT_SECONDS", "120"))
+VOCAL_SEPARATION_POLL_SECONDS = float(os.getenv("VOCAL_SEPARATION_POLL_SECONDS", "3"))
+# separação local (CPU, sem rede): "local" entra no fim da cadeia de hedge como
+# fallback; VOCAL_SEPARATION_QUALITY=draft usa só ela (rascunho rápido)
+VOCAL_LOCAL_FALLBACK = os.getenv("VOCAL_LOCAL_FALLBACK", "true").lower() in ("1", "true", "yes")
+VOCAL_SEPARATION_QUALITY = os.getenv("VOCAL_SEPARATION_QUALITY", "best")
+
+# ─── Merge ────────────────────────────────────────────────────
+MERGE_FETCH_MAX_WORKERS = int(os.getenv("MERGE_FETCH_MAX_WORKERS", "8"))
+MERGE_FETCH_RETRIES = int(os.getenv("MERGE_FETCH_RETRIES", "3"))
+# corta cada clipe na duration_seconds da cena (só o GOP da borda é recodificado)
+MERGE_TIMELINE_TRIM = os.getenv("MERGE_TIMELINE_TRIM", "true").lower() in ("1", "true", "yes")
+# cenas renderizadas em paralelo no merge (0 = um por núcleo)
+MERGE_RENDER_WORKERS = int(os.getenv("MERGE_RENDER_WORKERS", "0"))
+# cache de pedaços do merge por job: os menos usados saem primeiro (final_<job>.mp4 fica)
+MERGE_CACHE_MAX_GB = float(os.getenv("MERGE_CACHE_MAX_GB", "5"))
+MERGE_CACHE_MAX_AGE_HOURS = float(os.getenv("MERGE_CACHE_MAX_AGE_HOURS", "72"))
+# conform: clipes fora do perfil canônico do job são normalizados em background
+CONFORM_MAX_WORKERS = int(os.getenv("CONFORM_MAX_WORKERS", "2"))
+CONFORM_WAIT_SECONDS = float(os.getenv("CONFORM_WAIT_SECONDS", "300"))
+# HLS (fMP4, 360p/720p/source) depois do merge — padrão do /merge; o form pode pedir
+MERGE_HLS = os.getenv("MERGE_HLS", "false").lower() in ("1", "true", "yes")
+
 # ─── Credits System ───────────────────────────────────────────
 FREE_CREDITS_ON_SIGNUP = 500
 CREDITS_PER_VIDEO = 100
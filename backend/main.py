@@ -6,6 +6,8 @@ import os
 from config import UPLOAD_DIR
 from database import init_db
 from routes import videos
+from services.concurrency import limiters_snapshot
+from services.vocal_separation import separation_stats
 
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
@@ -59,6 +61,11 @@ async def health_api():
     return {"status": "ok", "message": "ClipVox API running"}
 
 
+@app.get("/api/metrics")
+async def metrics():
+    return {"concurrency": limiters_snapshot(), "vocal_separation": separation_stats()}
+
+
 @app.get("/api/files/{filename}")
 async def serve_file(filename: str):
     file_path = os.path.join(UPLOAD_DIR, filename)
@@ -70,6 +77,7 @@ async def serve_file(filename: str):
 @app.on_event("startup")
 async def startup_event():
     init_db()
+    videos.resume_inflight_requests()
     print("🚀 ClipVox Backend started!")
     print(f"📁 Upload directory: {UPLOAD_DIR}")
     print("🎬 Ready to generate videos!")
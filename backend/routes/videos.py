@@ -4,18 +4,31 @@ from typing import Optional
 import os
 import uuid
 import time
+import threading
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from config import UPLOAD_DIR, CREDITS_PER_VIDEO
-from services.audio_analysis import analyze_audio_cinematic
+from config import (
+    UPLOAD_DIR, CREDITS_PER_VIDEO, LIPSYNC_SKIP_INSTRUMENTAL, LIPSYNC_WINDOW_BATCHING,
+    VOCAL_SEPARATION_QUALITY, MERGE_TIMELINE_TRIM, MERGE_HLS,
+)
+from services.audio_analysis import analyze_audio_cinematic, detect_vocal_activity
 from services.scene_calculator import calculate_cinematic_scenes, get_scene_summary
 from services.ai_concept import generate_creative_concept_with_prompts
 from services.video_generation import generate_scenes_batch
-from services.kling_video import generate_videos_batch
+from services.reference_images import ingest_reference_images
+from services import inflight_requests
+from services.kling_video import generate_videos_batch, VideoClipStream
+from services.face_swap import FaceSwapStream
 from services.merge_video import merge_clips_with_audio, MERGE_OUTPUT_DIR
+from services.clip_conform import conform_clips, wait_conform, clip_identity
+from services.hls_packager import package_hls
 # ✅ MUDANÇA 1: kling_lipsync substituído por synclabs_lipsync
 # Sync Labs (fal-ai/sync-lipsync) é especializado em lip sync para música/canto,
 # aceita o áudio COMPLETO sem precisar extrair vocals (elimina StemSplit.io).
-from services.synclabs_lipsync import generate_lipsync
+from services.synclabs_lipsync import (
+    generate_lipsync, get_lipsync_limiter, plan_lipsync_windows, generate_lipsync_window,
+)
+from services.vocal_stems import get_vocal_stem
+from services.audio_slicer import scene_windows, slice_scene_audio
 
 router  = APIRouter()
 
@@ -35,6 +48,7 @@ except Exception as _e:
 try:
     from services.video_generation import set_jobs_cache
     set_jobs_cache(jobs_db)
+    inflight_requests.bind_jobs(jobs_db)
 except Exception as _e:
     print(f"⚠️ set_jobs_cache error: {_e}")
 
@@ -59,6 +73,9 @@ async def generate_video(
     ref_image:    Optional[UploadFile] = File(None),
     ref_image_2:  Optional[UploadFile] = File(None),
     ref_image_3:  Optional[UploadFile] = File(None),
+    auto_clips:   bool            = Form(False),
+    clip_mode:    str             = Form("std"),
+    face_swap:    bool            = Form(False),
     background_tasks: BackgroundTasks = None
 ):
     ALLOWED_AUDIO = ["audio/", "application/octet-stream", "video/mp4", "application/mp3", "application/mpeg"]
@@ -93,6 +110,8 @@ async def generate_video(
         "created_at": time.time(), "video_clips": None, "videos_status": "pending",
         "lipsync_status": None, "lipsync_url": None, "lipsync_clips": None,
         "vocals_path": None, "merge_status": None, "merge_url": None,
+        "ref_image_urls": None, "auto_clips": auto_clips, "clip_mode": clip_mode,
+        "face_swap": bool(face_swap and ref_image_paths),
     }
     background_tasks.add_task(process_video_pipeline, job_id)
     try:
@@ -104,7 +123,8 @@ async def generate_video(
         "job_id": job_id, "status": "processing", "message": "Video generation started",
         "config": {"duration": duration, "aspect_ratio": aspect_ratio,
                    "resolution": resolution, "style": style,
-                   "has_reference_image": ref_image is not None}
+                   "has_reference_image": ref_image is not None,
+                   "auto_clips": auto_clips, "face_swap": bool(face_swap and ref_image_paths)}
     }
 
 
@@ -127,11 +147,14 @@ async def get_job_status(job_id: str):
         "videos_status": job.get("videos_status"), "lipsync_status": job.get("lipsync_status"),
         "lipsync_url": job.get("lipsync_url"), "lipsync_clips": job.get("lipsync_clips"),
         "merge_status": job.get("merge_status"), "merge_url": job.get("merge_url"),
+        "merge_missing_scenes": job.get("merge_missing_scenes"),
+        "hls_status": job.get("hls_status"), "hls_url": job.get("hls_url"),
         "cancelled": job.get("cancelled", False),
         "config": {
             "duration": job.get("duration"), "aspect_ratio": job.get("aspect_ratio"),
             "resolution": job.get("resolution"), "style": job.get("style"),
             "has_reference_image": job.get("ref_image_path") is not None,
+            "auto_clips": job.get("auto_clips", False),
         }
     }
 
@@ -254,7 +277,7 @@ async def regen_lipsync_clip(
 
 
 @router.post("/cancel/{job_id}")
-async def cancel_job(job_id: str):
+async def cancel_job(job_id: str, background_tasks: BackgroundTasks):
     if job_id not in jobs_db:
         recovered = load_job(job_id)
         if recovered:
@@ -262,8 +285,12 @@ async def cancel_job(job_id: str):
         else:
             raise HTTPException(404, "Job not found")
     jobs_db[job_id]["cancelled"] = True
+    # foto das requisições em voo ANTES de acordar os pollers; a foto é cancelada na fal.ai
+    in_flight = inflight_requests.signal_cancel(job_id)
+    background_tasks.add_task(inflight_requests.cancel_remote_requests, job_id, in_flight)
     update_job(job_id, cancelled=True)
-    return {"job_id": job_id, "status": "cancelled", "message": "Job cancelado"}
+    return {"job_id": job_id, "status": "cancelled", "message": "Job cancelado",
+            "inflight_requests_cancelled": len(in_flight)}
 
 
 @router.post("/retry-clips/{job_id}")
@@ -298,6 +325,8 @@ async def generate_lipsync_video(
     face_image: Optional[UploadFile] = File(None),
     audio:      Optional[UploadFile] = File(None),
     face_url:   str = Form(""), model: str = Form("sync"),
+    batch_windows: Optional[bool] = Form(None),
+    vocals_quality: str = Form(""),
 ):
     if job_id not in jobs_db:
         recovered = load_job(job_id)
@@ -344,6 +373,9 @@ async def generate_lipsync_video(
     jobs_db[job_id]["lipsync_status"] = "processing"
     jobs_db[job_id]["lipsync_url"]    = None
     jobs_db[job_id]["lipsync_clips"]  = None
+    jobs_db[job_id]["lipsync_windows"] = LIPSYNC_WINDOW_BATCHING if batch_windows is None else batch_windows
+    if vocals_quality in ("best", "draft"):
+        jobs_db[job_id]["vocals_quality"] = vocals_quality
     # ✅ MUDANCA 2: _run_lipsync (sem _preextract_vocals — Sync Labs nao precisa)
     background_tasks.add_task(_run_lipsync, job_id=job_id,
                                face_source=face_source, audio_path=audio_path, model=model)
@@ -353,7 +385,8 @@ async def generate_lipsync_video(
 
 
 @router.post("/merge/{job_id}")
-async def merge_final_video(job_id: str, background_tasks: BackgroundTasks):
+async def merge_final_video(job_id: str, background_tasks: BackgroundTasks,
+                            hls: Optional[bool] = Form(None)):
     if job_id not in jobs_db:
         recovered = load_job(job_id)
         if recovered:
@@ -373,6 +406,7 @@ async def merge_final_video(job_id: str, background_tasks: BackgroundTasks):
         return {"message": "Merge ja em andamento", "job_id": job_id}
     jobs_db[job_id]["merge_status"] = "processing"
     jobs_db[job_id]["merge_url"]    = None
+    jobs_db[job_id]["hls"]          = MERGE_HLS if hls is None else hls
     background_tasks.add_task(process_merge, job_id)
     return {"job_id": job_id, "status": "processing",
             "message": f"Merge de {len(successful)} clipes iniciado"}
@@ -394,8 +428,24 @@ async def download_merged_video(job_id: str):
 
 # BACKGROUND TASKS
 
+def _ensure_reference_urls(job_id: str) -> list:
+    """Ingest único das referências: otimiza, publica no R2 e guarda as URLs no job."""
+    job = jobs_db.get(job_id, {})
+    if job.get("ref_image_urls"):
+        return job["ref_image_urls"]
+    ref_paths = job.get("ref_image_paths") or ([job["ref_image_path"]] if job.get("ref_image_path") else [])
+    if not ref_paths:
+        return []
+    ingested = ingest_reference_images(ref_paths, job_id)
+    update_job(job_id, ref_image_urls=ingested["urls"],
+               ref_image_prepared_paths=ingested["paths"])
+    return ingested["urls"]
+
+
 def process_video_pipeline(job_id: str):
     job = jobs_db[job_id]
+    clip_stream = None
+    face_stream = None
     try:
         update_job(job_id, status="processing", progress=5, current_step="plan")
         time.sleep(1)
@@ -411,6 +461,13 @@ def process_video_pipeline(job_id: str):
         update_job(job_id, progress=22, current_step="calculating_scenes")
         scene_structure     = calculate_cinematic_scenes(audio_metadata, job["description"])
         job["total_scenes"] = scene_structure["total_scenes"]
+        # start_time de cada cena — o lip sync fatia o áudio por essas janelas;
+        # duração + transição guiam a timeline do merge
+        job["scene_plan"] = [
+            {"scene_number": sc["scene_number"], "start_time": sc["start_time"],
+             "duration_seconds": sc["duration_seconds"], "transition": sc.get("transition", "cut")}
+            for sc in scene_structure["scenes"]
+        ]
         update_job(job_id, progress=28)
         update_job(job_id, progress=30, current_step="creative")
         # ✅ MUDANCA 3: removido _preextract_vocals — Sync Labs nao precisa
@@ -421,12 +478,36 @@ def process_video_pipeline(job_id: str):
         update_job(job_id, progress=58)
         time.sleep(2)
         update_job(job_id, progress=60, current_step="scenes")
+        ref_urls = _ensure_reference_urls(job_id)
+        if job.get("auto_clips"):
+            # modo auto: imagem → Kling por cena, sem esperar o lote inteiro
+            clip_stream = VideoClipStream(
+                aspect_ratio=job.get("aspect_ratio", "16:9"), mode=job.get("clip_mode", "std"),
+                job_id=job_id, bpm=job.get("audio_bpm", 120), version="2.1",
+                on_clip_done=lambda r: _store_clip_result(job_id, r),
+            )
+            update_job(job_id, videos_status="processing", video_clips=[])
+        on_scene_ready = (lambda r: _submit_auto_clip(job_id, clip_stream, r)) if clip_stream else None
+        if job.get("face_swap"):
+            # face swap em streaming: imagem → troca de rosto → (modo auto) Kling
+            prepared = job.get("ref_image_prepared_paths") or job.get("ref_image_paths") or []
+            face_stream = FaceSwapStream(
+                reference_face_path=prepared[0], job_id=job_id,
+                source_face_url=(ref_urls or [None])[0], on_swapped=on_scene_ready,
+            )
+            on_scene_ready = face_stream.submit
         scenes_with_images = generate_scenes_batch(
             creative_concept["scenes"],
             style=job["style"], aspect_ratio=job["aspect_ratio"],
             resolution=job["resolution"], reference_image_path=job.get("ref_image_path"),
             reference_image_paths=job.get("ref_image_paths") or [], job_id=job_id,
+            reference_image_urls=ref_urls,
+            on_scene_ready=on_scene_ready,
         )
+        if face_stream:
+            swapped = face_stream.wait()
+            face_stream = None
+            scenes_with_images = [swapped.get(sc.get("scene_number"), sc) for sc in scenes_with_images]
         job["scenes"] = scenes_with_images
         jobs_db[job_id]["scenes"] = scenes_with_images
         for scene in jobs_db[job_id]["scenes"]:
@@ -450,11 +531,58 @@ def process_video_pipeline(job_id: str):
         update_job(job_id, progress=95)
         time.sleep(1)
         update_job(job_id, status="completed", progress=100, current_step="done",
-                   output_file=f"video_{job_id}.mp4", videos_status="ready")
+                   output_file=f"video_{job_id}.mp4",
+                   videos_status="processing" if clip_stream else "ready")
+        if clip_stream:
+            _finish_auto_clips(job_id, clip_stream)
     except Exception as e:
         print(f"Erro no job {job_id}: {e}")
         import traceback; traceback.print_exc()
         update_job(job_id, status="failed", error_message=str(e))
+        if face_stream:
+            face_stream.wait()
+        if clip_stream:
+            _finish_auto_clips(job_id, clip_stream)
+
+
+_clips_lock = threading.Lock()
+
+
+def _submit_auto_clip(job_id: str, clip_stream: VideoClipStream, scene: dict):
+    if jobs_db.get(job_id, {}).get("cancelled"):
+        return
+    if not scene.get("prompt"):
+        scene["prompt"] = scene.get("prompt_used") or ""
+    clip_stream.submit(scene)
+
+
+def _store_clip_result(job_id: str, result: dict):
+    """Publica cada clipe no job assim que fica pronto (modo auto)."""
+    with _clips_lock:
+        clips = {c["scene_number"]: c for c in (jobs_db[job_id].get("video_clips") or [])}
+        clips[result["scene_number"]] = result
+        jobs_db[job_id]["video_clips"] = sorted(clips.values(), key=lambda x: x.get("scene_number", 0))
+        save_job(job_id, jobs_db[job_id])
+
+
+def _finish_auto_clips(job_id: str, clip_stream: VideoClipStream):
+    try:
+        results = clip_stream.wait()
+        with _clips_lock:
+            jobs_db[job_id]["video_clips"] = results
+            jobs_db[job_id]["videos_status"] = (
+                "cancelled" if jobs_db[job_id].get("cancelled") else "completed"
+            )
+            save_job(job_id, jobs_db[job_id])
+        _conform_job_clips(job_id, "video_clips")
+        save_job(job_id, jobs_db[job_id])
+        ok = sum(1 for r in results if r.get("success"))
+        print(f"✅ Modo auto: {ok}/{len(results)} clipes gerados")
+    except Exception as e:
+        import traceback; traceback.print_exc()
+        jobs_db[job_id]["videos_status"] = "failed"
+        jobs_db[job_id]["videos_error"]  = str(e)
+        save_job(job_id, jobs_db[job_id])
 
 
 def process_video_clips(job_id: str, mode: str = "std"):
@@ -473,6 +601,7 @@ def process_video_clips(job_id: str, mode: str = "std"):
         )
         jobs_db[job_id]["video_clips"]   = video_results
         jobs_db[job_id]["videos_status"] = "completed"
+        _conform_job_clips(job_id, "video_clips")
         save_job(job_id, jobs_db[job_id])
     except Exception as e:
         import traceback; traceback.print_exc()
@@ -497,6 +626,7 @@ def process_retry_clips(job_id: str, failed_scenes: list, mode: str = "std"):
         merged = sorted(existing.values(), key=lambda x: x.get("scene_number", 0))
         jobs_db[job_id]["video_clips"]   = merged
         jobs_db[job_id]["videos_status"] = "completed"
+        _conform_job_clips(job_id, "video_clips")
         save_job(job_id, jobs_db[job_id])
     except Exception as e:
         import traceback; traceback.print_exc()
@@ -514,10 +644,12 @@ def process_regen_scene(job_id: str, scene_number: int, prompt: str):
             if s.get("scene_number") == scene_number: s["regenerating"] = True
         jobs_db[job_id]["scenes"] = scenes
         save_job(job_id, jobs_db[job_id])
+        ref_urls = _ensure_reference_urls(job_id)
         result = generate_scene_image(
             prompt=prompt, scene_number=scene_number,
             style=job.get("style", "realistic"), aspect_ratio=job.get("aspect_ratio", "16:9"),
-            resolution=job.get("resolution", "720p"), reference_imgbb_url=None, job_id=job_id,
+            resolution=job.get("resolution", "720p"), reference_imgbb_urls=ref_urls or None,
+            job_id=job_id,
         )
         scenes = jobs_db[job_id].get("scenes") or []
         for i, s in enumerate(scenes):
@@ -555,6 +687,7 @@ def process_regen_video(job_id: str, scene_number: int, scene: dict, mode: str):
         if not found:
             result["regenerating"] = False; clips.append(result)
         jobs_db[job_id]["video_clips"] = sorted(clips, key=lambda x: x.get("scene_number", 0))
+        _conform_job_clips(job_id, "video_clips")
         save_job(job_id, jobs_db[job_id])
     except Exception as e:
         import traceback; traceback.print_exc()
@@ -564,21 +697,88 @@ def process_regen_video(job_id: str, scene_number: int, scene: dict, mode: str):
         save_job(job_id, jobs_db[job_id])
 
 
+def _ensure_vocal_stem(job_id: str, audio_path: str) -> Optional[str]:
+    """Separação única de vocals por job (cache por hash do áudio); guarda o stem no job."""
+    job = jobs_db.get(job_id, {})
+    quality = job.get("vocals_quality") or VOCAL_SEPARATION_QUALITY
+    if (job.get("vocals_path") and os.path.exists(job["vocals_path"])
+            and job.get("vocals_stem_quality", "best") == quality):
+        return job["vocals_path"]
+    stem = get_vocal_stem(audio_path, cancel_job_id=job_id, quality=quality)
+    if not stem:
+        return None
+    update_job(job_id, vocals_path=stem["local_path"], vocals_hash=stem["hash"],
+               vocals_url=stem.get("url"), vocals_source=stem["source"],
+               vocals_stem_quality=stem.get("quality", quality))
+    return stem["local_path"]
+
+
+def _asset_fields(source: dict) -> dict:
+    """Cópia local registrada (asset_resolver) que acompanha o clipe até o merge."""
+    return {k: source[k] for k in ("video_path", "video_size", "video_sha256", "conformed_url")
+            if source.get(k)}
+
+
+def _conform_job_clips(job_id: str, key: str):
+    """📐 Clipes fora do perfil canônico do job são normalizados em background."""
+    job = jobs_db.get(job_id) or {}
+
+    def _apply(scene_number: int, identity: str, fields: dict):
+        # aplica sob o mesmo lock das threads que trocam as listas de clipes,
+        # e só se a cena ainda tiver o clipe que foi conformado (não um regen)
+        with _clips_lock:
+            clips = jobs_db.get(job_id, {}).get(key) or []
+            idx = next((i for i, c in enumerate(clips) if c.get("scene_number") == scene_number), None)
+            if idx is None or clip_identity(clips[idx]) != identity:
+                print(f"   ⏭️ Conform da cena {scene_number} descartado (clipe substituído)")
+                return
+            # troca o item por um dict novo — nada é mutado sob um save_job concorrente
+            clips[idx] = dict(clips[idx], **fields)
+            save_job(job_id, jobs_db[job_id])
+
+    # foto da lista sob o lock; a sondagem (ffprobe, às vezes via HTTP) roda sem
+    # ele — o lock é global e seguraria os clipes de todos os jobs
+    with _clips_lock:
+        clips = list(job.get(key) or [])
+    stage = "lipsync" if key == "lipsync_clips" else "video"
+    profile = conform_clips(job_id, clips, stage,
+                            profile=job.get("conform_profile"), on_done=_apply)
+    if profile:
+        jobs_db[job_id]["conform_profile"] = profile
+
+
+def _clip_windows(job_id: str, clips: list) -> list:
+    """Janela de áudio de cada clipe: start_time da cena + duração do clipe."""
+    job = jobs_db.get(job_id, {})
+    return scene_windows(job.get("scene_plan") or job.get("scenes") or [], clips)
+
+
+def _slice_clip_audio(job_id: str, clips: list, source_path: str) -> dict:
+    """Fatias de áudio por cena numa passada de ffmpeg."""
+    return slice_scene_audio(source_path, _clip_windows(job_id, clips), job_id)
+
+
 def process_regen_lipsync(job_id: str, scene_number: int, clip: dict, audio_path: str, model: str):
     """Sync Labs: refaz lip sync de 1 cena usando audio original, sem StemSplit."""
     try:
-        face_video_url = clip.get("kling_url") or clip.get("video_url")
+        face_video_url = clip.get("video_url") or clip.get("kling_url")
         origin_task_id = clip.get("task_id", "")
         clip_job_id    = f"{job_id}_scene{scene_number:03d}"
         print(f"🎤 Sync Labs regen cena {scene_number}...")
+        vocals_path = _ensure_vocal_stem(job_id, audio_path)
+        slices      = _slice_clip_audio(job_id, [clip], vocals_path or audio_path)
         result = generate_lipsync(
             face_source=face_video_url, audio_source=audio_path,
             job_id=clip_job_id, model=model, origin_task_id=origin_task_id,
+            preextracted_vocals=vocals_path, audio_slice=slices.get(scene_number),
+            parent_job_id=job_id, scene_number=scene_number,
+            face_precheck=False,  # regen manual: o usuário pode discordar da pré-checagem
         )
         if result["success"]:
             new_clip = {"success": True, "scene_number": scene_number,
                         "video_url": result["video_url"], "original_url": face_video_url,
-                        "lipsync_regenerating": False, "lipsync_error": None, "lipsync_error_type": None}
+                        "lipsync_regenerating": False, "lipsync_error": None, "lipsync_error_type": None,
+                        **_asset_fields(result)}
             print(f"   ✅ Cena {scene_number} OK")
         else:
             raw = result.get("error", "") or ""
@@ -592,7 +792,8 @@ def process_regen_lipsync(job_id: str, scene_number: int, clip: dict, audio_path
                 msg, etype = "Falha no lip sync", "unknown"
             new_clip = {"success": True, "scene_number": scene_number,
                         "video_url": clip.get("video_url"), "original_url": face_video_url,
-                        "lipsync_error": msg, "lipsync_error_type": etype, "lipsync_regenerating": False}
+                        "lipsync_error": msg, "lipsync_error_type": etype, "lipsync_regenerating": False,
+                        **_asset_fields(clip)}
         lipsync_clips = list(jobs_db[job_id].get("lipsync_clips") or [])
         updated = False
         for i, c in enumerate(lipsync_clips):
@@ -600,6 +801,7 @@ def process_regen_lipsync(job_id: str, scene_number: int, clip: dict, audio_path
                 lipsync_clips[i] = new_clip; updated = True; break
         if not updated: lipsync_clips.append(new_clip)
         jobs_db[job_id]["lipsync_clips"] = sorted(lipsync_clips, key=lambda x: x.get("scene_number", 0))
+        _conform_job_clips(job_id, "lipsync_clips")
         save_job(job_id, jobs_db[job_id])
     except Exception as e:
         import traceback; traceback.print_exc()
@@ -632,24 +834,44 @@ def process_lipsync(job_id: str, face_source: str, audio_path: str, model: str):
         jobs_db[job_id]["lipsync_status"] = "cancelled"
         save_job(job_id, jobs_db[job_id]); return
     total = len(successful_clips)
-    print(f"🎤 Sync Labs: {total} clipes, audio original (sem StemSplit)...")
+    print(f"🎤 Sync Labs: {total} clipes — separando vocals uma vez para o job...")
+    vocals_path = _ensure_vocal_stem(job_id, audio_path)
+    windows     = _clip_windows(job_id, successful_clips)
+
+    # cenas instrumentais (intro, solo, breakdown) passam direto, sem lip sync
+    instrumental = set()
+    if LIPSYNC_SKIP_INSTRUMENTAL:
+        activity = detect_vocal_activity(windows, vocals_path=vocals_path, mix_path=audio_path)
+        instrumental = {n for n, a in activity.items() if not a["vocal"]}
+        update_job(job_id, vocal_activity={str(n): a["active_ratio"] for n, a in activity.items()})
+        if instrumental:
+            print(f"   ⏭️ {len(instrumental)} cena(s) sem voz — mantidas sem lip sync")
+    slices = slice_scene_audio(vocals_path or audio_path,
+                               [w for w in windows if w["scene_number"] not in instrumental], job_id)
 
     def _process_clip(args):
         i, clip = args
         scene_num      = clip.get("scene_number", i + 1)
-        face_video_url = clip.get("kling_url") or clip.get("video_url")
+        face_video_url = clip.get("video_url") or clip.get("kling_url")
         clip_job_id    = f"{job_id}_scene{scene_num:03d}"
         if jobs_db.get(job_id, {}).get("cancelled"):
             return {"success": False, "scene_number": scene_num,
                     "video_url": clip.get("video_url"), "lipsync_error": "cancelled"}
+        if scene_num in instrumental:
+            return {"success": True, "scene_number": scene_num,
+                    "video_url": clip.get("video_url"), "original_url": face_video_url,
+                    "lipsync_skipped": "instrumental", **_asset_fields(clip)}
         print(f"🎤 Sync Labs clipe {scene_num}/{total}...")
         result = generate_lipsync(
             face_source=face_video_url, audio_source=audio_path,
             job_id=clip_job_id, model=model, origin_task_id=clip.get("task_id", ""),
+            preextracted_vocals=vocals_path, audio_slice=slices.get(scene_num),
+            parent_job_id=job_id, scene_number=scene_num,
         )
         if result["success"]:
             return {"success": True, "scene_number": scene_num,
-                    "video_url": result["video_url"], "original_url": face_video_url}
+                    "video_url": result["video_url"], "original_url": face_video_url,
+                    "face_check": result.get("face_check"), **_asset_fields(result)}
         raw = result.get("error", "") or ""
         if "no face" in raw.lower() or "609" in raw:    msg, etype = "Sem rosto detectado", "no_face"
         elif "proxy" in raw.lower():                     msg, etype = "Erro de conexao", "proxy"
@@ -658,21 +880,52 @@ def process_lipsync(job_id: str, face_source: str, audio_path: str, model: str):
         else:                                            msg, etype = "Falha no lip sync", "unknown"
         return {"success": True, "scene_number": scene_num,
                 "video_url": clip.get("video_url"), "original_url": face_video_url,
-                "lipsync_error": msg, "lipsync_error_type": etype}
+                "lipsync_error": msg, "lipsync_error_type": etype,
+                "face_check": result.get("face_check"), **_asset_fields(clip)}
+
+    # modo janela: cenas vocais adjacentes vão juntas numa requisição só
+    sync_windows = []
+    if jobs_db[job_id].get("lipsync_windows", LIPSYNC_WINDOW_BATCHING):
+        vocal_clips  = [c for c in successful_clips if c.get("scene_number") not in instrumental]
+        sync_windows = [w for w in plan_lipsync_windows(vocal_clips) if len(w) > 1]
+        if sync_windows:
+            print(f"   🪟 {len(sync_windows)} janela(s) cobrindo {sum(len(w) for w in sync_windows)} cenas")
+    in_window = {c.get("scene_number") for w in sync_windows for c in w}
+
+    def _process_window(window_clips):
+        if jobs_db.get(job_id, {}).get("cancelled"):
+            return [_process_clip((c["scene_number"] - 1, c)) for c in window_clips]
+        synced = generate_lipsync_window(window_clips, slices, parent_job_id=job_id, model=model)
+        if not synced:
+            return [_process_clip((c["scene_number"] - 1, c)) for c in window_clips]
+        return [{"success": True, "scene_number": c["scene_number"],
+                 "video_url": synced[c["scene_number"]]["video_url"],
+                 "original_url": c.get("video_url") or c.get("kling_url"),
+                 "lipsync_window": synced[c["scene_number"]]["window"],
+                 **_asset_fields(synced[c["scene_number"]])} for c in window_clips]
 
     results_map = {}
-    with ThreadPoolExecutor(max_workers=1) as executor:
-        futures = {executor.submit(_process_clip, (i, c)): i for i, c in enumerate(successful_clips)}
+    # o pool comporta o teto; o limiter adaptativo decide quantos ficam em voo
+    max_workers = max(1, min(get_lipsync_limiter().maximum, total))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_process_clip, (i, c)) for i, c in enumerate(successful_clips)
+                   if c.get("scene_number", i + 1) not in in_window]
+        futures += [executor.submit(_process_window, w) for w in sync_windows]
         for future in as_completed(futures):
-            r = future.result(); results_map[r["scene_number"]] = r
+            r = future.result()
+            for item in (r if isinstance(r, list) else [r]):
+                results_map[item["scene_number"]] = item
 
     lipsync_clips = [results_map[k] for k in sorted(results_map)]
-    success_count = sum(1 for c in lipsync_clips if not c.get("lipsync_error"))
+    success_count = sum(1 for c in lipsync_clips
+                        if not c.get("lipsync_error") and not c.get("lipsync_skipped"))
     jobs_db[job_id]["lipsync_clips"]  = lipsync_clips
     jobs_db[job_id]["lipsync_status"] = "completed"
+    _conform_job_clips(job_id, "lipsync_clips")
     first_ok = next((c for c in lipsync_clips if c.get("success")), None)
     if first_ok: jobs_db[job_id]["lipsync_url"] = first_ok["video_url"]
-    print(f"✅ Sync Labs: {success_count}/{total} clipes sincronizados")
+    print(f"✅ Sync Labs: {success_count}/{total - len(instrumental)} clipes sincronizados"
+          f" ({len(instrumental)} instrumentais mantidos)")
     save_job(job_id, jobs_db[job_id])
 
 
@@ -680,13 +933,18 @@ def process_merge(job_id: str):
     job = jobs_db.get(job_id)
     if not job: return
     try:
+        # conform já roda desde a ingestão; aqui só espera o que faltar terminar
+        wait_conform(job_id)
         clips   = job.get("lipsync_clips") or job.get("video_clips", [])
-        success = sorted([c for c in clips if c.get("success") and c.get("video_url")],
+        success = sorted([dict(c, video_url=c.get("conformed_url") or c["video_url"])
+                          for c in clips if c.get("success") and c.get("video_url")],
                          key=lambda x: x.get("scene_number", 0))
         result  = merge_clips_with_audio(
             video_urls=[c["video_url"] for c in success],
-            audio_path=job.get("audio_path"), job_id=job_id
+            audio_path=job.get("audio_path"), job_id=job_id, clips=success,
+            scene_plan=job.get("scene_plan") if MERGE_TIMELINE_TRIM else None,
         )
+        jobs_db[job_id]["merge_missing_scenes"] = result.get("missing_scenes") or []
         if result["success"]:
             jobs_db[job_id]["merge_status"] = "completed"
             jobs_db[job_id]["merge_url"] = result.get("output_url") or \
@@ -695,12 +953,206 @@ def process_merge(job_id: str):
             jobs_db[job_id]["merge_status"] = "failed"
             jobs_db[job_id]["merge_error"]  = result.get("error")
         save_job(job_id, jobs_db[job_id])
+        if result["success"]:
+            _merge_hls(job_id, result)
     except Exception as e:
         import traceback; traceback.print_exc()
         jobs_db[job_id]["merge_status"] = "failed"
         jobs_db[job_id]["merge_error"]  = str(e)
 
 
+def _merge_hls(job_id: str, result: dict):
+    """
+    HLS depois do merge. Saída reaproveitada do cache (nada mudou) mantém a
+    escada já publicada; senão a anterior fica obsoleta e, com hls ligado,
+    empacota da cópia local — ou da URL no R2, se a cópia local já saiu do disco.
+    """
+    job = jobs_db[job_id]
+    if result.get("cached") and job.get("hls_status") == "completed" and job.get("hls_url"):
+        print(f"   ♻️ HLS reaproveitado: {job['hls_url']}")
+        return
+    job.update(hls_status=None, hls_url=None, hls_error=None)
+    if job.get("hls"):
+        local_path = result.get("local_path") or ""
+        source = local_path if os.path.exists(local_path) else result.get("output_url")
+        if source:
+            _package_merge_hls(job_id, source)
+            return
+        job.update(hls_status="failed", hls_error="vídeo final sem cópia local nem URL no R2")
+        print(f"   ⚠️ HLS não gerado: vídeo final sem cópia local nem URL no R2")
+    save_job(job_id, job)
+
+
+def _package_merge_hls(job_id: str, source: str):
+    """📺 Escada HLS do vídeo final — o MP4 já está disponível enquanto isso roda."""
+    jobs_db[job_id]["hls_status"] = "processing"
+    save_job(job_id, jobs_db[job_id])
+    hls = package_hls(source, job_id)
+    if hls["success"]:
+        jobs_db[job_id]["hls_status"] = "completed"
+        jobs_db[job_id]["hls_url"]    = hls["playlist_url"]
+    else:
+        jobs_db[job_id]["hls_status"] = "failed"
+        jobs_db[job_id]["hls_error"]  = hls.get("error")
+    save_job(job_id, jobs_db[job_id])
+
+
+def resume_inflight_requests():
+    """
+    Startup: retoma as requisições fal que estavam em voo antes do restart.
+    Cada etapa reanexa ao request_id salvo (submit_or_reattach) em vez de pagar de novo.
+    """
+    by_job: dict = {}
+    for job_id, entry in inflight_requests.pending():
+        by_job.setdefault(job_id, []).append(entry)
+    for job_id, entries in by_job.items():
+        if jobs_db.get(job_id, {}).get("cancelled"):
+            threading.Thread(target=inflight_requests.cancel_remote_requests,
+                             args=(job_id,), daemon=True).start()
+            continue
+        print(f"🔁 Job {job_id[:8]}: retomando {len(entries)} requisição(ões) em voo")
+        threading.Thread(target=_resume_job_requests, args=(job_id, entries), daemon=True).start()
+
+
+def _resume_job_requests(job_id: str, entries: list):
+    job = jobs_db.get(job_id) or {}
+    for entry in entries:
+        stage, scene_number = entry.get("stage"), entry.get("scene_number")
+        try:
+            if stage == "image":
+                _resume_scene_image(job_id, scene_number)
+            elif stage == "video":
+                # modo auto com o pipeline interrompido: job["scenes"] ainda não
+                # existe — a imagem enviada ao Kling está em scene_images
+                scene = next((s for s in (job.get("scenes") or []) + (job.get("scene_images") or [])
+                              if s.get("scene_number") == scene_number), None)
+                if scene and scene.get("image_url"):
+                    process_regen_video(job_id, scene_number, scene, job.get("clip_mode", "std"))
+            elif stage == "lipsync":
+                clip = next((c for c in job.get("video_clips") or []
+                             if c.get("scene_number") == scene_number), None)
+                if clip and clip.get("video_url") and job.get("audio_path"):
+                    process_regen_lipsync(job_id, scene_number, clip, job["audio_path"], "sync")
+            elif stage == "lipsync_window" and job.get("audio_path"):
+                _resume_lipsync_window(job_id, scene_number[0], scene_number[-1])
+        except Exception as e:
+            print(f"⚠️ Resume {stage} cena {scene_number} falhou: {e}")
+    _settle_resumed_stages(job_id, {entry.get("stage") for entry in entries})
+
+
+def _settle_resumed_stages(job_id: str, stages: set):
+    """
+    O lote que estava rodando morreu no restart: só as cenas em voo foram
+    retomadas. Fecha o status da etapa (senão os guards de "em andamento"
+    bloqueiam para sempre) e marca as cenas que nem chegaram a ser enviadas
+    como falha — o /retry e o regen por cena as refazem.
+    """
+    _settle_interrupted_pipeline(job_id)
+    job = jobs_db.get(job_id) or {}
+    planned = sorted(s["scene_number"] for s in job.get("scenes") or job.get("scene_images") or []
+                     if s.get("success") and s.get("image_url"))
+    # modo auto: o lote de clipes morreu com o pipeline, mesmo sem cena em voo
+    if ("video" in stages or job.get("auto_clips")) \
+            and job.get("videos_status") in ("processing", "retrying"):
+        with _clips_lock:
+            clips = {c["scene_number"]: c for c in jobs_db[job_id].get("video_clips") or []}
+            for n in planned:
+                clips.setdefault(n, {"success": False, "scene_number": n, "video_url": None,
+                                     "error": "Interrompido por restart do servidor"})
+            ok = any(c.get("success") for c in clips.values())
+            jobs_db[job_id]["video_clips"]   = [clips[k] for k in sorted(clips)]
+            jobs_db[job_id]["videos_status"] = "completed" if ok else "failed"
+            save_job(job_id, jobs_db[job_id])
+    if stages & {"lipsync", "lipsync_window"} and job.get("lipsync_status") == "processing":
+        synced = {c["scene_number"]: c for c in jobs_db[job_id].get("lipsync_clips") or []}
+        for c in jobs_db[job_id].get("video_clips") or []:
+            if c.get("success") and c.get("video_url") and c["scene_number"] not in synced:
+                synced[c["scene_number"]] = {
+                    "success": True, "scene_number": c["scene_number"],
+                    "video_url": c["video_url"], "original_url": c["video_url"],
+                    "lipsync_error": "Interrompido", "lipsync_error_type": "interrupted",
+                    **_asset_fields(c)}
+        jobs_db[job_id]["lipsync_clips"]  = [synced[k] for k in sorted(synced)]
+        jobs_db[job_id]["lipsync_status"] = "completed" if synced else "failed"
+        save_job(job_id, jobs_db[job_id])
+
+
+def _settle_interrupted_pipeline(job_id: str):
+    """
+    Pipeline (plano → imagens) morto no restart com o job ainda "processing":
+    com todas as imagens em scene_images (inclusive as retomadas) o job é
+    concluído a partir delas; senão vira "failed" para poder ser refeito.
+    Face swap não é refeito aqui — job com face swap incompleto falha.
+    """
+    job = jobs_db.get(job_id) or {}
+    if job.get("status") not in ("pending", "processing") or job.get("cancelled"):
+        return
+    planned = [s["scene_number"] for s in (job.get("creative_concept") or {}).get("scenes") or []]
+    images  = {s.get("scene_number"): s for s in job.get("scene_images") or []}
+    if planned and not job.get("face_swap") and all((images.get(n) or {}).get("success") for n in planned):
+        scenes = [dict(images[n], prompt=images[n].get("prompt") or images[n].get("prompt_used") or "")
+                  for n in planned]
+        update_job(job_id, scenes=scenes, status="completed", progress=100, current_step="done",
+                   output_file=f"video_{job_id}.mp4",
+                   videos_status=job.get("videos_status") if job.get("auto_clips") else "ready")
+        print(f"🔁 Job {job_id[:8]}: pipeline concluído a partir de scene_images")
+        return
+    update_job(job_id, status="failed",
+               error_message="Pipeline interrompido por restart do servidor — gere o vídeo novamente")
+    print(f"⚠️ Job {job_id[:8]}: pipeline interrompido — marcado como failed")
+
+
+def _resume_lipsync_window(job_id: str, first: int, last: int):
+    """Reanexa à requisição da janela (mesmos clipes → mesmo input) e aplica por cena."""
+    job = jobs_db.get(job_id) or {}
+    clips = sorted([c for c in job.get("video_clips") or []
+                    if first <= c.get("scene_number", 0) <= last
+                    and c.get("success") and c.get("video_url")],
+                   key=lambda c: c["scene_number"])
+    if not clips:
+        return
+    vocals_path = _ensure_vocal_stem(job_id, job["audio_path"])
+    slices = _slice_clip_audio(job_id, clips, vocals_path or job["audio_path"])
+    synced = generate_lipsync_window(clips, slices, parent_job_id=job_id, model="sync")
+    if not synced:
+        for c in clips:
+            process_regen_lipsync(job_id, c["scene_number"], c, job["audio_path"], "sync")
+        return
+    by_scene = {c.get("scene_number"): c for c in jobs_db[job_id].get("lipsync_clips") or []}
+    for c in clips:
+        n = c["scene_number"]
+        by_scene[n] = {"success": True, "scene_number": n,
+                       "video_url": synced[n]["video_url"],
+                       "original_url": c.get("video_url") or c.get("kling_url"),
+                       "lipsync_window": synced[n]["window"], **_asset_fields(synced[n])}
+    jobs_db[job_id]["lipsync_clips"] = [by_scene[k] for k in sorted(by_scene)]
+    _conform_job_clips(job_id, "lipsync_clips")
+    save_job(job_id, jobs_db[job_id])
+
+
+def _resume_scene_image(job_id: str, scene_number: int):
+    job = jobs_db.get(job_id) or {}
+    scene = next((s for s in job.get("scenes") or [] if s.get("scene_number") == scene_number), None)
+    if scene:
+        process_regen_scene(job_id, scene_number, scene.get("prompt", ""))
+        return
+    # pipeline interrompido no meio do lote: guarda o resultado em scene_images
+    from services.video_generation import generate_scene_image
+    planned = next((s for s in (job.get("creative_concept") or {}).get("scenes") or []
+                    if s.get("scene_number") == scene_number), None)
+    if not planned:
+        return
+    result = generate_scene_image(
+        prompt=planned["prompt"], scene_number=scene_number,
+        style=job.get("style", "realistic"), aspect_ratio=job.get("aspect_ratio", "16:9"),
+        resolution=job.get("resolution", "720p"),
+        reference_imgbb_urls=job.get("ref_image_urls") or None, job_id=job_id,
+    )
+    images = {s["scene_number"]: s for s in job.get("scene_images") or []}
+    images[scene_number] = result
+    update_job(job_id, scene_images=sorted(images.values(), key=lambda x: x.get("scene_number", 0)))
+
+
 def update_job(job_id: str, **kwargs):
     if job_id in jobs_db:
         jobs_db[job_id].update(kwargs)
@@ -0,0 +1,101 @@
+"""
+🗂️ ClipVox - Resolvedor de assets local-first
+
+O Kling já salva cada clipe em UPLOAD_DIR e o lip sync também grava a saída
+em disco; mesmo assim merge e lip sync baixavam tudo de novo pela URL.
+Aqui cada artefato de cena é mapeado para a cópia local quando ela existe e
+é válida (mesmo tamanho + mesmo sha256 registrados na criação); senão, URL.
+
+Registro em dois lugares:
+  - no próprio clipe (video_path / video_size / video_sha256) → sobrevive no job
+  - em memória por URL → clipes repassados (ex: cena instrumental no lip sync)
+    que só carregam a video_url original também resolvem para o disco
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Any
+
+# LRU: processo longo registra clipes de muitos jobs — os mais antigos saem
+MAX_ENTRIES = 4096
+
+_digests: "OrderedDict[tuple, str]" = OrderedDict()
+_by_url: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def file_digest(path: str) -> str:
+    """sha256 do arquivo — memorizado por (caminho, mtime, tamanho)."""
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+    with _lock:
+        if key in _digests:
+            _digests.move_to_end(key)
+            return _digests[key]
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+    with _lock:
+        _digests[key] = digest
+        _digests.move_to_end(key)
+        while len(_digests) > MAX_ENTRIES:
+            _digests.popitem(last=False)
+    return digest
+
+
+def register_asset(path: str, *urls: Optional[str]) -> Dict[str, Any]:
+    """
+    Registra um arquivo local recém-criado e as URLs que apontam para ele.
+
+    Returns:
+        {"video_path", "video_size", "video_sha256"} para gravar no clipe
+    """
+    if not path or not os.path.exists(path):
+        return {}
+    record = {"path": path, "size": os.path.getsize(path), "sha256": file_digest(path)}
+    with _lock:
+        for url in urls:
+            if url:
+                _by_url[url] = record
+                _by_url.move_to_end(url)
+        while len(_by_url) > MAX_ENTRIES:
+            _by_url.popitem(last=False)
+    return {"video_path": path, "video_size": record["size"], "video_sha256": record["sha256"]}
+
+
+def _valid(path: Optional[str], size: Optional[int], sha256: Optional[str]) -> bool:
+    if not path or not os.path.exists(path):
+        return False
+    if size is not None and os.path.getsize(path) != size:
+        return False
+    if sha256 and file_digest(path) != sha256:
+        return False
+    return True
+
+
+def local_copy(source: str, path: Optional[str] = None, size: Optional[int] = None,
+               sha256: Optional[str] = None) -> Optional[str]:
+    """Cópia local válida de `source` (URL ou caminho), ou None."""
+    if _valid(path, size, sha256):
+        return path
+    if source and not source.startswith(("http://", "https://")) and os.path.exists(source):
+        return source
+    with _lock:
+        record = _by_url.get(source)
+        if record is not None:
+            _by_url.move_to_end(source)
+    if record and _valid(record["path"], record["size"], record["sha256"]):
+        return record["path"]
+    return None
+
+
+def resolve(clip: Dict[str, Any], url_key: str = "video_url") -> Optional[str]:
+    """Caminho local do artefato da cena se houver cópia válida; senão a URL."""
+    url = clip.get(url_key)
+    path = clip.get("video_path") if url_key == "video_url" else None
+    local = local_copy(url, path=path, size=clip.get("video_size"), sha256=clip.get("video_sha256"))
+    return local or url
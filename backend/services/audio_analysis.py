@@ -6,6 +6,12 @@ para calcular scenes dinamicamente
 ⚡ MODIFICADO: Aceita duration_override para Trim Virtual
 """
 import numpy as np
+from typing import Dict, List, Optional
+
+from config import VOCAL_MIN_ACTIVE_RATIO, VOCAL_RMS_RELATIVE_THRESHOLD
+
+VAD_SAMPLE_RATE = 16000
+VAD_HOP_LENGTH = 512
 
 def analyze_audio_cinematic(audio_path: str, duration_override: int = None) -> dict:
     """
@@ -167,3 +173,75 @@ def _get_mock_audio_data(duration_override: int = None):
         },
         "dynamic_range": 0.85
     }
+
+
+def detect_vocal_activity(windows: List[dict], vocals_path: Optional[str] = None,
+                          mix_path: Optional[str] = None) -> Dict[int, dict]:
+    """
+    Detecção local (CPU) de canto por janela de cena
+
+    Com o stem vocal (Demucs) basta o RMS: frame ativo = energia acima de uma
+    fração do percentil 95 do próprio stem (o vazamento dos outros instrumentos
+    fica abaixo disso). Sem stem, usa o mix: componente harmônica (HPSS) com
+    energia concentrada na banda de voz (300–3400 Hz).
+
+    Args:
+        windows: [{"scene_number", "start", "duration"}] (audio_slicer.scene_windows)
+        vocals_path: stem vocal já separado (preferido)
+        mix_path: música completa, usada só sem stem
+
+    Returns:
+        {scene_number: {"vocal": bool, "active_ratio": float, "source": "stem"|"mix"}}
+        — vazio se não der para analisar (o chamador deve processar tudo)
+    """
+    source_path = vocals_path or mix_path
+    if not windows or not source_path:
+        return {}
+    try:
+        import librosa
+
+        y, sr = librosa.load(source_path, sr=VAD_SAMPLE_RATE, mono=True)
+        if vocals_path:
+            source = "stem"
+            rms = librosa.feature.rms(y=y, frame_length=1024, hop_length=VAD_HOP_LENGTH)[0]
+            band_ok = np.ones_like(rms, dtype=bool)
+        else:
+            source = "mix"
+            y = librosa.effects.harmonic(y)
+            spec = np.abs(librosa.stft(y, n_fft=1024, hop_length=VAD_HOP_LENGTH)) ** 2
+            freqs = librosa.fft_frequencies(sr=sr, n_fft=1024)
+            band = (freqs >= 300) & (freqs <= 3400)
+            band_ratio = spec[band].sum(axis=0) / (spec.sum(axis=0) + 1e-10)
+            band_ok = band_ratio > 0.6
+            rms = np.sqrt(spec.mean(axis=0))
+
+        voiced = rms[rms > 0]
+        if voiced.size == 0:
+            return {w["scene_number"]: {"vocal": False, "active_ratio": 0.0, "source": source}
+                    for w in windows}
+        threshold = float(np.percentile(voiced, 95)) * VOCAL_RMS_RELATIVE_THRESHOLD
+        active = (rms > threshold) & band_ok
+
+        frames_per_second = sr / VAD_HOP_LENGTH
+        result = {}
+        for w in windows:
+            a = int(w["start"] * frames_per_second)
+            b = int((w["start"] + w["duration"]) * frames_per_second)
+            chunk = active[a:max(b, a + 1)]
+            ratio = float(chunk.mean()) if chunk.size else 0.0
+            result[w["scene_number"]] = {
+                "vocal": ratio >= VOCAL_MIN_ACTIVE_RATIO,
+                "active_ratio": round(ratio, 3),
+                "source": source,
+            }
+
+        vocal_count = sum(1 for r in result.values() if r["vocal"])
+        print(f"🎙️ Voz detectada em {vocal_count}/{len(result)} cena(s) ({source})")
+        return result
+
+    except ImportError:
+        print("⚠️ librosa not available, skipping vocal activity detection")
+        return {}
+    except Exception as e:
+        print(f"❌ Vocal activity detection error: {e}")
+        return {}
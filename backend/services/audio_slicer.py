@@ -0,0 +1,106 @@
+"""
+✂️ ClipVox - Fatiador de áudio por cena (uma única passada de ffmpeg)
+
+Cada clipe de lip sync precisa do trecho da música que toca durante a SUA
+cena: começa no start_time da cena e dura o mesmo que o clipe Kling (5s/10s).
+Em vez de um ffmpeg por clipe (sempre a partir do segundo 0), o stem é
+decodificado uma vez e dividido num filter graph com várias saídas:
+
+    [0:a]asplit=N[s0][s1]...;
+    [s0]atrim=start=S0:duration=D0,asetpts=PTS-STARTPTS[o0]; ...
+
+O segment muxer não serve aqui: as janelas seguem a duração do clipe, não a
+da cena, então podem se sobrepor ou deixar buracos entre si.
+"""
+
+import os
+import subprocess
+from typing import Dict, List, Optional
+
+from config import UPLOAD_DIR
+from services.media_probe import media_duration, register_media
+
+DEFAULT_CLIP_SECONDS = 5.0
+MIN_SLICE_BYTES = 1024
+
+
+def scene_windows(scene_plan: List[dict], clips: List[dict],
+                  default_duration: float = DEFAULT_CLIP_SECONDS) -> List[dict]:
+    """
+    Janela de áudio de cada clipe: início da cena no plano + duração do clipe.
+    Planos sem start_time (jobs antigos) usam a soma das durações anteriores.
+    """
+    starts: Dict[int, float] = {}
+    cursor = 0.0
+    for scene in sorted(scene_plan or [], key=lambda s: s.get("scene_number", 0)):
+        start = scene.get("start_time")
+        start = float(start) if start is not None else cursor
+        starts[scene.get("scene_number")] = start
+        cursor = start + float(scene.get("duration_seconds") or 0)
+
+    windows = []
+    for clip in clips:
+        scene_number = clip.get("scene_number")
+        if scene_number not in starts:
+            continue
+        duration = clip.get("duration") or default_duration
+        windows.append({
+            "scene_number": scene_number,
+            "start": round(starts[scene_number], 3),
+            "duration": round(float(duration), 3),
+        })
+    return windows
+
+
+def slice_scene_audio(audio_path: str, windows: List[dict], job_id: str,
+                      out_dir: Optional[str] = None) -> Dict[int, str]:
+    """
+    Gera todas as fatias (MP3 mono 44100 Hz, prontas para lip sync) em uma
+    única invocação de ffmpeg.
+
+    Returns:
+        {scene_number: caminho_local} — janelas que falharem ficam de fora
+    """
+    if not audio_path or not os.path.exists(audio_path) or not windows:
+        return {}
+    out_dir = out_dir or UPLOAD_DIR
+    os.makedirs(out_dir, exist_ok=True)
+
+    n = len(windows)
+    graph = [f"[0:a]asplit={n}" + "".join(f"[s{i}]" for i in range(n)) if n > 1 else "[0:a]anull[s0]"]
+    output_args = []
+    outputs = {}
+    for i, w in enumerate(windows):
+        graph.append(
+            f"[s{i}]atrim=start={w['start']:.3f}:duration={w['duration']:.3f},"
+            f"asetpts=PTS-STARTPTS[o{i}]"
+        )
+        out = os.path.join(out_dir, f"{job_id}_scene{w['scene_number']:03d}_audio.mp3")
+        outputs[w["scene_number"]] = out
+        output_args += ["-map", f"[o{i}]", "-ar", "44100", "-ac", "1",
+                        "-c:a", "libmp3lame", "-b:a", "128k", out]
+    cmd = ["ffmpeg", "-y", "-v", "error", "-i", audio_path,
+           "-filter_complex", ";".join(graph)] + output_args
+
+    print(f"✂️ Fatiando áudio em {n} trecho(s) numa única passada...")
+    try:
+        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    except subprocess.CalledProcessError as e:
+        print(f"   ❌ ffmpeg slicer falhou: {(e.stderr or b'').decode(errors='ignore')[-300:]}")
+        return {}
+
+    slices = {
+        num: path for num, path in outputs.items()
+        if os.path.exists(path) and os.path.getsize(path) >= MIN_SLICE_BYTES
+    }
+    # duração das fatias é conhecida — registra no cache em vez de sondar cada uma
+    source_duration = media_duration(audio_path)
+    for w in windows:
+        path = slices.get(w["scene_number"])
+        if path and source_duration:
+            register_media(path, max(0.0, min(w["duration"], source_duration - w["start"])),
+                           audio={"codec": "mp3", "sample_rate": 44100, "channels": 1},
+                           format_name="mp3")
+    if len(slices) < n:
+        print(f"   ⚠️ {n - len(slices)} trecho(s) vazio(s) — fora da duração do áudio?")
+    return slices
@@ -0,0 +1,184 @@
+"""
+📐 ClipVox - Conform de clipes na ingestão
+
+O concat -c copy do merge quebra (ou gera vídeo corrompido) quando os clipes
+diferem em fps, resolução, timebase ou perfil — versões do Kling, saídas de
+lip sync e fallbacks. Aqui cada clipe é sondado assim que entra no job e só
+os que fogem do perfil canônico do job são normalizados, em background:
+
+  perfil canônico → o mais comum entre os clipes do primeiro lote (travado no job)
+  só timebase diferente → remux (-c copy), sem recodificar
+  resto              → libx264 no perfil canônico (scale+pad, fps, pix_fmt)
+
+O clipe conformado vira a cópia local registrada (asset_resolver) e ganha
+conformed_url no R2; o merge só espera o que ainda estiver em andamento.
+"""
+
+import hashlib
+import os
+import subprocess
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, Future, wait
+from typing import List, Dict, Any, Optional, Callable
+
+from config import (
+    UPLOAD_DIR,
+    R2_BUCKET_NAME,
+    R2_PUBLIC_URL,
+    CONFORM_MAX_WORKERS,
+    CONFORM_WAIT_SECONDS,
+    get_r2_client,
+)
+from services.asset_resolver import local_copy, register_asset
+from services.media_probe import probe_media
+from services.timeline_render import encoder_args
+
+PROFILE_KEYS = ("codec", "width", "height", "fps", "pix_fmt", "profile", "time_base")
+
+_executor = ThreadPoolExecutor(max_workers=max(1, CONFORM_MAX_WORKERS))
+_pending: Dict[str, Dict[tuple, Future]] = {}
+_lock = threading.Lock()
+
+
+def _source(clip: Dict[str, Any]) -> Optional[str]:
+    url = clip.get("conformed_url") or clip.get("video_url")
+    return local_copy(url, path=clip.get("video_path"), size=clip.get("video_size"),
+                      sha256=clip.get("video_sha256")) or url
+
+
+def _profile_of(source: str) -> Optional[Dict[str, Any]]:
+    info  = probe_media(source)
+    video = (info or {}).get("video")
+    if not video:
+        return None
+    profile = {k: video.get(k) for k in PROFILE_KEYS}
+    profile["profile"] = (profile["profile"] or "").lower() or None
+    return profile
+
+
+def canonical_profile(profiles: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Perfil mais comum do lote; fora de H.264/yuv420p vira H.264 high/yuv420p."""
+    if not profiles:
+        return None
+    counts = Counter(tuple(p[k] for k in PROFILE_KEYS) for p in profiles)
+    canonical = dict(zip(PROFILE_KEYS, counts.most_common(1)[0][0]))
+    if canonical["codec"] != "h264" or canonical["pix_fmt"] != "yuv420p":
+        canonical.update(codec="h264", pix_fmt="yuv420p", profile="high")
+    return canonical
+
+
+def clip_identity(clip: Dict[str, Any]) -> str:
+    """Identidade do conteúdo do clipe: sha256 registrado ou URL + task_id."""
+    return clip.get("video_sha256") or f"{clip.get('video_url')}#{clip.get('task_id', '')}"
+
+
+def _conform(job_id: str, stage: str, scene_number: int, identity: str, source: str,
+             current: Dict[str, Any], canonical: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Gera o clipe conformado. O nome vem da etapa + hash da fonte: vídeo e lip
+    sync da mesma cena, ou um clipe antigo e o regenerado, nunca se sobrescrevem.
+
+    Returns:
+        campos a aplicar no clipe (video_path/size/sha256, conformed_url, conformed)
+    """
+    tag = hashlib.sha256(identity.encode()).hexdigest()[:16]
+    out = os.path.join(UPLOAD_DIR, f"job_{job_id}_{stage}_scene{scene_number:03d}_{tag}_conformed.mp4")
+    tmp = out + ".part.mp4"
+    diff = [k for k in PROFILE_KEYS if current.get(k) != canonical.get(k)]
+    cmd  = ["ffmpeg", "-y", "-v", "error", "-i", source, "-map", "0:v:0", "-map", "0:a?"]
+    if diff == ["time_base"]:
+        cmd += ["-c", "copy"]
+        if (canonical.get("time_base") or "").startswith("1/"):
+            cmd += ["-video_track_timescale", canonical["time_base"][2:]]
+    else:
+        w, h = canonical["width"], canonical["height"]
+        cmd += ["-vf", f"scale={w}:{h}:force_original_aspect_ratio=decrease,"
+                       f"pad={w}:{h}:(ow-iw)/2:(oh-ih)/2,setsar=1"]
+        cmd += encoder_args(canonical, (os.cpu_count() or 1) // max(1, CONFORM_MAX_WORKERS)) + ["-c:a", "copy"]
+        if (canonical.get("time_base") or "").startswith("1/"):
+            cmd += ["-video_track_timescale", canonical["time_base"][2:]]
+    subprocess.run(cmd + [tmp], check=True, stdout=subprocess.DEVNULL,
+                   stderr=subprocess.PIPE, timeout=600)
+    os.replace(tmp, out)
+
+    url = None
+    r2  = get_r2_client()
+    if r2:
+        key = f"jobs/{job_id}/conformed/{stage}_scene{scene_number:03d}_{tag}.mp4"
+        with open(out, "rb") as f:
+            r2.put_object(Bucket=R2_BUCKET_NAME, Key=key, Body=f, ContentType="video/mp4")
+        url = f"{R2_PUBLIC_URL}/{key}" if R2_PUBLIC_URL else None
+    print(f"   📐 Cena {scene_number} ({stage}): conformada ({', '.join(diff)})")
+    return dict(register_asset(out, url), conformed_url=url, conformed=diff)
+
+
+def conform_clips(
+    job_id: str,
+    clips: List[Dict[str, Any]],
+    stage: str,
+    profile: Optional[Dict[str, Any]] = None,
+    on_done: Optional[Callable[[int, str, Dict[str, Any]], None]] = None,
+) -> Optional[Dict[str, Any]]:
+    """
+    Sonda os clipes e agenda em background o conform dos que fogem do perfil.
+    Os dicts dos clipes NÃO são tocados pela thread do pool: o resultado vai
+    para on_done, que aplica no job só se o clipe ainda for o mesmo.
+
+    Args:
+        stage:   "video" ou "lipsync" — separa as saídas das duas etapas
+        profile: perfil canônico já travado no job (None = escolher por este lote)
+        on_done: on_done(scene_number, identity, campos) após cada clipe conformado
+
+    Returns:
+        o perfil canônico do job
+    """
+    probed = []
+    for clip in clips:
+        if not clip.get("success") or not clip.get("video_url"):
+            continue
+        source = _source(clip)
+        current = _profile_of(source) if source else None
+        if current:
+            probed.append((clip.get("scene_number", 0), clip_identity(clip), source, current))
+    canonical = profile or canonical_profile([p for *_, p in probed])
+    if not canonical:
+        return profile
+
+    def _run(scene_number, identity, source, current):
+        try:
+            fields = _conform(job_id, stage, scene_number, identity, source, current, canonical)
+            if on_done:
+                on_done(scene_number, identity, fields)
+        except Exception as e:
+            detail = getattr(e, "stderr", None) or e
+            print(f"   ⚠️ Conform cena {scene_number} ({stage}) falhou: {str(detail)[-200:]}")
+
+    mismatched = [item for item in probed
+                  if any(item[3].get(k) != canonical.get(k) for k in PROFILE_KEYS)]
+    if mismatched:
+        print(f"📐 Job {job_id[:8]}: {len(mismatched)}/{len(probed)} clipe(s) {stage} fora do perfil "
+              f"{canonical['width']}x{canonical['height']}@{canonical['fps']} — conform em background")
+        with _lock:
+            jobs = _pending.setdefault(job_id, {})
+            for item in mismatched:
+                # conform ainda na fila de um clipe substituído (regen) é descartado
+                previous = jobs.get((stage, item[0]))
+                if previous is not None:
+                    previous.cancel()
+                jobs[(stage, item[0])] = _executor.submit(_run, *item)
+    return canonical
+
+
+def wait_conform(job_id: str, timeout: float = CONFORM_WAIT_SECONDS) -> bool:
+    """Espera o conform pendente do job (antes do merge). False se estourou o timeout."""
+    with _lock:
+        jobs = _pending.get(job_id) or {}
+        futures = [f for f in jobs.values() if not f.done()]
+        if not futures:
+            _pending.pop(job_id, None)
+    if not futures:
+        return True
+    print(f"   ⏳ Aguardando conform de {len(futures)} clipe(s)...")
+    _, not_done = wait(futures, timeout=timeout)
+    return not not_done
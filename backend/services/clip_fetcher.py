@@ -0,0 +1,113 @@
+"""
+📥 ClipVox - Download concorrente de clipes para o merge
+
+Pool limitado + requests.Session compartilhada (keep-alive); cada clipe vai
+em streaming direto para o workspace do merge (sem segurar o MP4 inteiro em
+memória). Retentativas com backoff para rede/5xx/429. A ordem de entrada é
+preservada e o que não puder ser baixado volta como falha por cena.
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import UPLOAD_DIR, MERGE_FETCH_MAX_WORKERS, MERGE_FETCH_RETRIES
+from services.asset_resolver import local_copy
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def _local_source(url: str) -> Optional[str]:
+    """Arquivo já no disco: caminho direto ou /api/files/<nome> servido do UPLOAD_DIR."""
+    if os.path.exists(url):
+        return url
+    if url.startswith("/api/files/"):
+        path = os.path.join(UPLOAD_DIR, os.path.basename(url))
+        return path if os.path.exists(path) else None
+    return None
+
+
+def _fetch_one(session: requests.Session, url: str, out_path: str, retries: int) -> Optional[str]:
+    """Baixa em streaming; devolve None em sucesso ou a mensagem do último erro."""
+    error = "sem tentativas"
+    for attempt in range(1, retries + 1):
+        try:
+            with session.get(url, stream=True, timeout=(10, 120)) as resp:
+                if resp.status_code != 200:
+                    error = f"HTTP {resp.status_code}"
+                    if resp.status_code < 500 and resp.status_code != 429:
+                        return error  # 4xx não melhora tentando de novo
+                else:
+                    tmp = out_path + ".part"
+                    with open(tmp, "wb") as f:
+                        for chunk in resp.iter_content(chunk_size=CHUNK_SIZE):
+                            if chunk:
+                                f.write(chunk)
+                    os.replace(tmp, out_path)
+                    return None
+        except Exception as e:
+            error = str(e)
+        if attempt < retries:
+            time.sleep(2 ** (attempt - 1))
+    return error
+
+
+def fetch_clips(
+    clips: List[Dict[str, Any]],
+    dest_dir: str,
+    max_workers: int = MERGE_FETCH_MAX_WORKERS,
+    retries: int = MERGE_FETCH_RETRIES,
+) -> Dict[str, Any]:
+    """
+    Args:
+        clips: [{"scene_number", "video_url"}] na ordem do vídeo final;
+               video_path/video_size/video_sha256 opcionais (asset_resolver)
+
+    Returns:
+        {"fetched": [{"scene_number", "path", "url"}] (mesma ordem),
+         "missing": [{"scene_number", "url", "error"}]}
+    """
+    os.makedirs(dest_dir, exist_ok=True)
+    workers = max(1, min(max_workers, len(clips) or 1))
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=workers)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    def _get(item):
+        i, clip = item
+        url = clip.get("video_url") or ""
+        scene_number = clip.get("scene_number", i + 1)
+        # 🗂️ cópia local registrada (tamanho + sha256) evita o download
+        local = local_copy(url, path=clip.get("video_path"), size=clip.get("video_size"),
+                           sha256=clip.get("video_sha256"))
+        if not local and url:
+            local = _local_source(url)
+        if local:
+            return {"scene_number": scene_number, "path": local, "url": url}, None
+        if not url:
+            return None, {"scene_number": scene_number, "url": url, "error": "sem video_url"}
+        out_path = os.path.join(dest_dir, f"clip_{i:03d}_scene{scene_number:03d}.mp4")
+        error = _fetch_one(session, url, out_path, retries)
+        if error:
+            print(f"   ⚠️ Cena {scene_number}: download falhou ({error})")
+            return None, {"scene_number": scene_number, "url": url, "error": error}
+        return {"scene_number": scene_number, "path": out_path, "url": url}, None
+
+    print(f"   📥 Baixando {len(clips)} clipes ({workers} em paralelo)...")
+    started = time.time()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_get, enumerate(clips)))
+    finally:
+        session.close()
+
+    fetched = [ok for ok, _ in results if ok]
+    missing = [err for _, err in results if err]
+    print(f"   ✅ {len(fetched)}/{len(clips)} clipes em {time.time() - started:.1f}s"
+          + (f" — faltando cenas {[m['scene_number'] for m in missing]}" if missing else ""))
+    return {"fetched": fetched, "missing": missing}
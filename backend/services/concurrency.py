@@ -0,0 +1,174 @@
+"""
+⚙️ ClipVox - Concorrência adaptativa por endpoint (fal.ai)
+
+Um AdaptiveLimiter por endpoint controla quantas requisições ficam em voo:
+  - cresce aditivamente (+1 por janela de conclusões) enquanto a fila e a
+    latência estão saudáveis e o limite atual está de fato sendo usado
+  - recua multiplicativamente em 429/503 ou quando o tempo de fila sobe
+
+O limite atual de cada endpoint aparece em /api/metrics.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+from config import (
+    FAL_QUEUE_WAIT_TARGET_SECONDS,
+    FAL_QUEUE_POSITION_TARGET,
+)
+
+BACKOFF_FACTOR = 0.5
+DECREASE_COOLDOWN_SECONDS = 30.0
+EWMA_ALPHA = 0.3
+
+_THROTTLE_MARKERS = (
+    "429", "too many requests", "rate limit", "rate_limit",
+    "503", "service unavailable", "service busy",
+)
+
+
+class SlotAborted(RuntimeError):
+    """A espera por um slot foi interrompida (ex.: job cancelado)."""
+
+
+def is_throttle_error(error_str: str) -> bool:
+    low = (error_str or "").lower()
+    return any(k in low for k in _THROTTLE_MARKERS)
+
+
+class AdaptiveLimiter:
+    def __init__(self, name: str, initial: int, minimum: int = 1, maximum: int = 8):
+        self.name = name
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(self.maximum, max(self.minimum, initial)))
+        self.in_flight = 0
+        self.completed = 0
+        self.throttled = 0
+        self.queue_wait_ewma: Optional[float] = None
+        self.latency_ewma: Optional[float] = None
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    # ── slots ────────────────────────────────────────────────
+    def acquire(self, timeout: Optional[float] = None,
+                should_abort: Optional[Callable[[], bool]] = None) -> bool:
+        deadline = time.time() + timeout if timeout is not None else None
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                if should_abort and should_abort():
+                    return False
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(timeout=remaining if remaining is not None else 5.0)
+            self.in_flight += 1
+            return True
+
+    def release(self) -> None:
+        with self._cond:
+            self.in_flight = max(0, self.in_flight - 1)
+            self._cond.notify_all()
+
+    def wake(self) -> None:
+        with self._cond:
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, should_abort: Optional[Callable[[], bool]] = None):
+        if not self.acquire(should_abort=should_abort):
+            raise SlotAborted(f"{self.name}: espera por slot abortada")
+        try:
+            yield self
+        finally:
+            self.release()
+
+    # ── sinais ───────────────────────────────────────────────
+    def record_queue_position(self, position: Optional[int]) -> None:
+        if position is not None and position > FAL_QUEUE_POSITION_TARGET:
+            self._decrease(f"fila pos={position}")
+
+    def record_queue_wait(self, seconds: float) -> None:
+        """Tempo entre submit e início do processamento (InProgress)."""
+        with self._cond:
+            previous = self.queue_wait_ewma
+            self.queue_wait_ewma = seconds if previous is None else (
+                EWMA_ALPHA * seconds + (1 - EWMA_ALPHA) * previous
+            )
+        rising = previous is not None and seconds > 2 * max(previous, 1.0)
+        if seconds > FAL_QUEUE_WAIT_TARGET_SECONDS or rising:
+            self._decrease(f"fila {seconds:.0f}s")
+
+    def record_success(self, latency_s: float) -> None:
+        with self._cond:
+            self.completed += 1
+            self.latency_ewma = latency_s if self.latency_ewma is None else (
+                EWMA_ALPHA * latency_s + (1 - EWMA_ALPHA) * self.latency_ewma
+            )
+            healthy = (self.queue_wait_ewma or 0.0) <= FAL_QUEUE_WAIT_TARGET_SECONDS
+            saturated = self.in_flight >= int(self.limit)
+            if healthy and saturated and self.limit < self.maximum:
+                old = int(self.limit)
+                self.limit = min(float(self.maximum), self.limit + 1.0 / self.limit)
+                if int(self.limit) > old:
+                    print(f"   📈 {self.name}: limite {old} → {int(self.limit)}")
+                self._cond.notify_all()
+
+    def record_throttle(self) -> None:
+        with self._cond:
+            self.throttled += 1
+        self._decrease("throttle 429/503")
+
+    def _decrease(self, reason: str) -> None:
+        with self._cond:
+            now = time.time()
+            if now - self._last_decrease < DECREASE_COOLDOWN_SECONDS:
+                return
+            old = int(self.limit)
+            self.limit = max(float(self.minimum), self.limit * BACKOFF_FACTOR)
+            self._last_decrease = now
+            if int(self.limit) != old:
+                print(f"   📉 {self.name}: limite {old} → {int(self.limit)} ({reason})")
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            return {
+                "limit":           int(self.limit),
+                "min":             self.minimum,
+                "max":             self.maximum,
+                "in_flight":       self.in_flight,
+                "completed":       self.completed,
+                "throttled":       self.throttled,
+                "queue_wait_ewma": round(self.queue_wait_ewma, 1) if self.queue_wait_ewma is not None else None,
+                "latency_ewma":    round(self.latency_ewma, 1) if self.latency_ewma is not None else None,
+            }
+
+
+_limiters: Dict[str, AdaptiveLimiter] = {}
+_registry_lock = threading.Lock()
+
+
+def get_limiter(name: str, initial: int = 1, minimum: int = 1, maximum: int = 8) -> AdaptiveLimiter:
+    """Limiter compartilhado do endpoint — os parâmetros valem só na primeira chamada."""
+    with _registry_lock:
+        limiter = _limiters.get(name)
+        if limiter is None:
+            limiter = AdaptiveLimiter(name, initial=initial, minimum=minimum, maximum=maximum)
+            _limiters[name] = limiter
+        return limiter
+
+
+def limiters_snapshot() -> dict:
+    with _registry_lock:
+        items = list(_limiters.items())
+    return {name: limiter.snapshot() for name, limiter in items}
+
+
+def wake_all() -> None:
+    """Acorda quem espera slot em qualquer endpoint (usado no cancelamento)."""
+    with _registry_lock:
+        limiters = list(_limiters.values())
+    for limiter in limiters:
+        limiter.wake()
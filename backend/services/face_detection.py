@@ -0,0 +1,126 @@
+"""
+👤 ClipVox - Pré-checagem local de rosto (CPU, OpenCV)
+
+O lip sync só descobre "no face" (609) depois de fila + processamento remoto.
+Antes de enviar, amostramos alguns frames do clipe Kling e passamos cascatas
+Haar (frontal + perfil, nos dois lados) para pontuar:
+
+  presence   → fração dos frames com rosto
+  face_size  → área média do maior rosto / área do frame
+  frontality → 1.0 frontal, 0.5 perfil
+
+Veredito:
+  "no_face" → nenhum rosto em nenhum frame — falha certa, não envia
+  "weak"    → rosto pequeno/raro — envia, mas sinaliza no clipe
+  "ok"      → envia normalmente
+  "unknown" → OpenCV indisponível ou vídeo ilegível — envia (comportamento antigo)
+"""
+
+import threading
+from typing import Dict, Any
+
+from config import FACE_PRECHECK_SAMPLES
+
+try:
+    import cv2
+except Exception:  # pragma: no cover
+    cv2 = None
+
+ANALYSIS_WIDTH = 640
+MIN_FACE_FRACTION = 0.06   # lado mínimo do rosto em relação ao menor lado do frame
+WEAK_SCORE = 0.25
+
+_local = threading.local()   # CascadeClassifier não é thread-safe
+
+
+def _cascades():
+    if not hasattr(_local, "frontal"):
+        base = cv2.data.haarcascades
+        _local.frontal = cv2.CascadeClassifier(base + "haarcascade_frontalface_default.xml")
+        _local.profile = cv2.CascadeClassifier(base + "haarcascade_profileface.xml")
+    return _local.frontal, _local.profile
+
+
+def _largest_face(gray) -> tuple:
+    """(área relativa do maior rosto, frontalidade) — (0, 0) sem rosto."""
+    frontal, profile = _cascades()
+    h, w = gray.shape[:2]
+    min_side = max(24, int(min(h, w) * MIN_FACE_FRACTION))
+    kwargs = {"scaleFactor": 1.1, "minNeighbors": 5, "minSize": (min_side, min_side)}
+
+    faces = frontal.detectMultiScale(gray, **kwargs)
+    if len(faces):
+        fw, fh = max(((f[2], f[3]) for f in faces), key=lambda s: s[0] * s[1])
+        return (fw * fh) / float(w * h), 1.0
+
+    # perfil: a cascata só conhece um lado, então testa também o frame espelhado
+    for img in (gray, cv2.flip(gray, 1)):
+        faces = profile.detectMultiScale(img, **kwargs)
+        if len(faces):
+            fw, fh = max(((f[2], f[3]) for f in faces), key=lambda s: s[0] * s[1])
+            return (fw * fh) / float(w * h), 0.5
+    return 0.0, 0.0
+
+
+def assess_face_presence(video_path: str, samples: int = FACE_PRECHECK_SAMPLES) -> Dict[str, Any]:
+    """
+    Amostra `samples` frames espaçados do vídeo e pontua presença de rosto.
+
+    Returns:
+        dict com verdict, score, presence, face_size, frontality, frames
+    """
+    if cv2 is None:
+        return {"verdict": "unknown", "reason": "opencv não instalado"}
+    cap = None
+    try:
+        cap = cv2.VideoCapture(video_path)
+        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+        if not cap.isOpened() or total <= 0:
+            return {"verdict": "unknown", "reason": "vídeo ilegível"}
+
+        positions = [int(total * (i + 0.5) / samples) for i in range(samples)]
+        sizes, fronts, read = [], [], 0
+        for pos in positions:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, pos)
+            ok, frame = cap.read()
+            if not ok or frame is None:
+                continue
+            read += 1
+            h, w = frame.shape[:2]
+            if w > ANALYSIS_WIDTH:
+                frame = cv2.resize(frame, (ANALYSIS_WIDTH, int(h * ANALYSIS_WIDTH / w)))
+            gray = cv2.equalizeHist(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+            size, front = _largest_face(gray)
+            if size > 0:
+                sizes.append(size)
+                fronts.append(front)
+
+        if read == 0:
+            return {"verdict": "unknown", "reason": "nenhum frame decodificado"}
+
+        presence   = len(sizes) / read
+        face_size  = sum(sizes) / len(sizes) if sizes else 0.0
+        frontality = sum(fronts) / len(fronts) if fronts else 0.0
+        # rosto ocupando ≥ 2% do frame já é "grande o bastante" para o lip sync
+        score = presence * (0.5 + 0.5 * frontality) * min(1.0, face_size / 0.02)
+
+        if not sizes:
+            verdict = "no_face"
+        elif score < WEAK_SCORE:
+            verdict = "weak"
+        else:
+            verdict = "ok"
+        return {
+            "verdict":    verdict,
+            "score":      round(score, 3),
+            "presence":   round(presence, 3),
+            "face_size":  round(face_size, 4),
+            "frontality": round(frontality, 2),
+            "frames":     read,
+        }
+    except Exception as e:
+        print(f"   ⚠️ Face pre-check error: {e}")
+        return {"verdict": "unknown", "reason": str(e)}
+    finally:
+        if cap is not None:
+            cap.release()
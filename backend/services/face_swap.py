@@ -12,8 +12,17 @@ Troca rostos nas cenas geradas usando PiAPI Faceswap API
 
 import os
 import requests
+import threading
 import time
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+from requests.adapters import HTTPAdapter
+
+from config import FACE_SWAP_MAX_WORKERS, FACE_SWAP_POLL_SECONDS
+from services import inflight_requests
+from services.reference_images import image_to_data_uri
+from services.video_generation import upload_to_r2
 
 
 def face_swap_piapi(
@@ -21,7 +30,12 @@ def face_swap_piapi(
     source_face_path: str,
     output_path: str = None,
     max_retries: int = 2,
-    timeout: int = 90
+    timeout: int = 90,
+    source_face: Optional[str] = None,
+    target_image: Optional[str] = None,
+    session: Optional[requests.Session] = None,
+    poll_interval: float = FACE_SWAP_POLL_SECONDS,
+    job_id: str = "",
 ) -> Optional[str]:
     """
     Faz face swap usando PiAPI Faceswap API
@@ -37,6 +51,11 @@ def face_swap_piapi(
         output_path: Onde salvar resultado (opcional)
         max_retries: Número máximo de tentativas (padrão: 2)
         timeout: Timeout em segundos (padrão: 90s)
+        source_face: rosto já pronto (URL ou data URI) — o batch codifica uma vez só
+        target_image: URL pública da cena — evita base64 da imagem alvo
+        session: requests.Session compartilhada (conexões reaproveitadas)
+        poll_interval: intervalo do polling do resultado
+        job_id: job para cancelamento (/cancel interrompe a espera)
     
     Returns:
         str: Caminho da imagem com face swap, ou None se falhar
@@ -49,10 +68,23 @@ def face_swap_piapi(
         print("⚠️ PIAPI_API_KEY not set, skipping face swap")
         return target_image_path  # Retorna imagem original
     
+    http = session or requests
     try:
         print(f"🎭 Face swap: {os.path.basename(source_face_path)} → {os.path.basename(target_image_path)}")
         print(f"   API: PiAPI Faceswap (professional quality)")
         
+        # URL pública quando existe; senão data URI recomprimida.
+        # O rosto de origem é o mesmo em todas as cenas — o batch passa pronto.
+        if source_face is None:
+            source_face = image_to_data_uri(source_face_path)
+        if target_image is None:
+            target_image = image_to_data_uri(target_image_path)
+        # imagem ausente/ilegível vira None — sem isso a PiAPI devolve um erro opaco
+        if not source_face:
+            raise ValueError(f"rosto de referência ausente ou ilegível: {source_face_path}")
+        if not target_image:
+            raise ValueError(f"imagem da cena ausente ou ilegível: {target_image_path}")
+        
         # ─── RETRY LOGIC ──────────────────────────────────────
         for attempt in range(max_retries):
             try:
@@ -74,27 +106,18 @@ def face_swap_piapi(
                     "Content-Type": "application/json"
                 }
                 
-                # Ler imagens e converter para base64
-                import base64
-                
-                with open(target_image_path, "rb") as f:
-                    target_b64 = base64.b64encode(f.read()).decode('utf-8')
-                
-                with open(source_face_path, "rb") as f:
-                    source_b64 = base64.b64encode(f.read()).decode('utf-8')
-                
                 payload = {
                     "model": "Qubico/image-toolkit",
                     "task_type": "face-swap",
                     "input": {
-                        "target_image": f"data:image/jpeg;base64,{target_b64}",
-                        "swap_image": f"data:image/jpeg;base64,{source_b64}"
+                        "target_image": target_image,
+                        "swap_image": source_face
                     }
                 }
                 
                 print(f"   📤 Submitting task to PiAPI...")
                 
-                response = requests.post(url, json=payload, headers=headers, timeout=30)
+                response = http.post(url, json=payload, headers=headers, timeout=30)
                 
                 if response.status_code != 200:
                     print(f"   ❌ API error: HTTP {response.status_code}")
@@ -126,13 +149,14 @@ def face_swap_piapi(
                 
                 print(f"   ⏳ Waiting for result...")
                 
-                max_polls = 30  # 30 tentativas = ~90s
-                poll_interval = 3  # 3s entre tentativas
+                max_polls = max(1, int(timeout / poll_interval))
                 
                 for poll in range(max_polls):
-                    time.sleep(poll_interval)
+                    if inflight_requests.wait_or_cancelled(job_id, poll_interval):
+                        print(f"   🛑 Face swap cancelado (job cancelado)")
+                        return target_image_path
                     
-                    fetch_response = requests.get(fetch_url, headers=headers, timeout=30)
+                    fetch_response = http.get(fetch_url, headers=headers, timeout=30)
                     
                     if fetch_response.status_code != 200:
                         print(f"   ⚠️ Fetch error: HTTP {fetch_response.status_code}")
@@ -149,8 +173,8 @@ def face_swap_piapi(
                     
                     if status == "processing" or status == "pending":
                         # Ainda processando
-                        if (poll + 1) % 5 == 0:  # A cada 15s
-                            print(f"   ⏳ Still processing... ({poll * poll_interval}s)")
+                        if (poll + 1) % 5 == 0:
+                            print(f"   ⏳ Still processing... ({(poll + 1) * poll_interval:.0f}s)")
                         continue
                     
                     elif status == "succeeded":
@@ -176,7 +200,7 @@ def face_swap_piapi(
                         # ─── STEP 3: Download resultado ──────
                         print(f"   📥 Downloading result...")
                         
-                        img_response = requests.get(image_url, timeout=60)
+                        img_response = http.get(image_url, timeout=60)
                         
                         if img_response.status_code != 200:
                             print(f"   ❌ Download failed: HTTP {img_response.status_code}")
@@ -235,12 +259,31 @@ def face_swap_piapi(
         return target_image_path
 
 
+def _shared_session(pool_size: int) -> requests.Session:
+    """Uma sessão por batch/stream — keep-alive com a PiAPI e o CDN do resultado."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(4, pool_size))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def _source_face_ref(reference_face_path: str, source_face_url: Optional[str]) -> str:
+    """Rosto de origem resolvido UMA vez: URL já publicada ou data URI recomprimida."""
+    if source_face_url and source_face_url.startswith(("http://", "https://")):
+        return source_face_url
+    return image_to_data_uri(reference_face_path)
+
+
 def face_swap_batch(
     scene_images: list,
-    reference_face_path: str
+    reference_face_path: str,
+    max_workers: int = FACE_SWAP_MAX_WORKERS,
+    source_face_url: Optional[str] = None,
+    job_id: str = "",
 ) -> list:
     """
-    Aplica face swap em múltiplas cenas usando PiAPI
+    Aplica face swap em múltiplas cenas usando PiAPI (em paralelo)
     
     ⭐ QUALIDADE: Professional
     💰 CUSTO: $0.02 por imagem
@@ -248,64 +291,138 @@ def face_swap_batch(
     Args:
         scene_images: Lista de caminhos das imagens das cenas
         reference_face_path: Caminho da foto da pessoa
+        max_workers: Swaps simultâneos
+        source_face_url: URL pública do rosto (ex: referência já no R2)
+        job_id: job para cancelamento
     
     Returns:
-        list: Lista de caminhos das imagens com face swap
+        list: Lista de caminhos das imagens com face swap (mesma ordem)
     """
     
     if not reference_face_path or not os.path.exists(reference_face_path):
         print("⚠️ No reference face image, skipping face swap")
         return scene_images
     
+    workers = max(1, min(max_workers, len(scene_images) or 1))
     print(f"\n{'='*60}")
-    print(f"🎭 Applying face swap to {len(scene_images)} scenes...")
+    print(f"🎭 Applying face swap to {len(scene_images)} scenes ({workers} in parallel)...")
     print(f"   Reference face: {os.path.basename(reference_face_path)}")
     print(f"   API: PiAPI Faceswap")
-    print(f"   Quality: ⭐⭐⭐⭐ Professional")
     print(f"   Estimated cost: ${len(scene_images) * 0.02:.2f}")
-    print(f"   Estimated time: {len(scene_images) * 15}s (~{len(scene_images) * 15 / 60:.1f} min)")
     print(f"{'='*60}\n")
     
-    swapped_images = []
-    successful_swaps = 0
-    failed_swaps = 0
-    total_time = 0
+    source_face = _source_face_ref(reference_face_path, source_face_url)
+    session     = _shared_session(workers)
+    start       = time.time()
     
-    for i, scene_path in enumerate(scene_images, 1):
-        print(f"📸 Processing scene {i}/{len(scene_images)}...")
-        
-        start = time.time()
-        swapped_path = face_swap_piapi(
+    def _swap(scene_path: str) -> str:
+        return face_swap_piapi(
             target_image_path=scene_path,
-            source_face_path=reference_face_path
+            source_face_path=reference_face_path,
+            source_face=source_face,
+            session=session,
+            job_id=job_id,
         )
-        elapsed = time.time() - start
-        total_time += elapsed
-        
-        swapped_images.append(swapped_path)
-        
-        if swapped_path != scene_path:
-            successful_swaps += 1
-        else:
-            failed_swaps += 1
-        
-        # Mostrar progresso
-        remaining = len(scene_images) - i
-        avg_time = total_time / i
-        eta = avg_time * remaining
-        print(f"   Progress: {i}/{len(scene_images)} | Avg: {avg_time:.1f}s/scene | ETA: {eta:.0f}s\n")
     
-    avg_time = total_time / len(scene_images) if scene_images else 0
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            swapped_images = list(executor.map(_swap, scene_images))
+    finally:
+        session.close()
+    
+    total_time       = time.time() - start
+    successful_swaps = sum(1 for a, b in zip(scene_images, swapped_images) if a != b)
+    failed_swaps     = len(scene_images) - successful_swaps
     
     print(f"\n{'='*60}")
     print(f"✅ Face swap batch completed!")
     print(f"   Success: {successful_swaps}/{len(scene_images)} scenes")
     if failed_swaps > 0:
         print(f"   Failed: {failed_swaps} scenes (using original)")
-    print(f"   ⏱️ Average time per scene: {avg_time:.1f}s")
     print(f"   ⏱️ Total face swap time: {total_time:.1f}s (~{total_time/60:.1f} min)")
     print(f"   💰 Estimated cost: ${successful_swaps * 0.02:.2f}")
-    print(f"   ⭐ Quality: Professional (PiAPI)")
     print(f"{'='*60}\n")
     
     return swapped_images
+
+
+class FaceSwapStream:
+    """
+    Etapa de face swap em streaming: cada cena entra assim que a imagem fica
+    pronta (on_scene_ready do generate_scenes_batch) e sai para on_swapped —
+    no modo auto, direto para o Kling.
+    """
+
+    def __init__(
+        self,
+        reference_face_path: str,
+        job_id: str = "",
+        source_face_url: Optional[str] = None,
+        max_workers: int = FACE_SWAP_MAX_WORKERS,
+        on_swapped: Optional[Callable[[dict], None]] = None,
+    ):
+        self.reference_face_path = reference_face_path
+        self.job_id = job_id
+        self.on_swapped = on_swapped
+        self.source_face = _source_face_ref(reference_face_path, source_face_url)
+        self.session = _shared_session(max_workers)
+        self._pool = ThreadPoolExecutor(max_workers=max(1, max_workers))
+        self._futures = []
+        self._lock = threading.Lock()
+        self._results: Dict[int, dict] = {}
+
+    def submit(self, scene: dict) -> None:
+        with self._lock:
+            self._futures.append(self._pool.submit(self._run, scene))
+
+    def _swap(self, scene: dict) -> dict:
+        image_path = scene.get("image_path")
+        if (not scene.get("success") or not image_path or not os.path.exists(image_path)
+                or inflight_requests.is_cancelled(self.job_id)):
+            return scene
+        r2_url = scene.get("r2_url")
+        swapped = face_swap_piapi(
+            target_image_path=image_path,
+            source_face_path=self.reference_face_path,
+            source_face=self.source_face,
+            target_image=r2_url if r2_url and r2_url.startswith(("http://", "https://")) else None,
+            session=self.session,
+            job_id=self.job_id,
+        )
+        if not swapped or swapped == image_path:
+            return scene
+        n = scene.get("scene_number", 0)
+        new_r2 = upload_to_r2(swapped, f"jobs/{self.job_id or 'adhoc'}/scene_{n:03d}_faceswap.jpg")
+        return dict(
+            scene,
+            image_path=swapped,
+            image_url=new_r2 or f"/api/files/{os.path.basename(swapped)}",
+            r2_url=new_r2,
+            original_image_url=scene.get("image_url"),
+            face_swapped=True,
+        )
+
+    def _run(self, scene: dict) -> dict:
+        try:
+            result = self._swap(scene)
+        except Exception as e:
+            print(f"   ⚠️ Face swap cena {scene.get('scene_number')} falhou: {e}")
+            result = scene
+        with self._lock:
+            self._results[result.get("scene_number", 0)] = result
+        if self.on_swapped:
+            try:
+                self.on_swapped(result)
+            except Exception as e:
+                print(f"   ⚠️ on_swapped cena {result.get('scene_number')}: {e}")
+        return result
+
+    def wait(self) -> Dict[int, dict]:
+        """Espera todas as cenas enviadas; devolve {scene_number: cena (trocada ou original)}."""
+        with self._lock:
+            futures = list(self._futures)
+        for f in futures:
+            f.result()
+        self._pool.shutdown(wait=True)
+        self.session.close()
+        return dict(self._results)
@@ -0,0 +1,135 @@
+"""
+📺 ClipVox - Empacotamento HLS (fMP4) do vídeo final
+
+O preview baixava o MP4 inteiro antes de tocar — no celular, espera longa.
+Depois do merge, este passo (opcional) gera uma escada HLS com segmentos
+fMP4 e um master playlist no R2; o player escolhe a qualidade pela banda
+e começa a tocar no primeiro segmento:
+
+  360p   → libx264 ~800 kbps
+  720p   → libx264 ~2.8 Mbps (só se a fonte for maior que 720p)
+  source → libx264 na resolução do merge (CRF 20, teto de 8 Mbps)
+
+Tudo num único ffmpeg (split + var_stream_map); o áudio AAC do merge vai em copy.
+Todas as variantes são recodificadas com os mesmos keyframes forçados a cada
+HLS_SEGMENT_SECONDS: os segmentos ficam alinhados entre as qualidades (troca
+de variante sem salto) — em stream copy a fonte cortaria nos GOPs do merge.
+"""
+
+import mimetypes
+import os
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List
+
+from config import R2_BUCKET_NAME, R2_PUBLIC_URL, get_r2_client
+from services.media_probe import probe_media
+
+HLS_SEGMENT_SECONDS = 4
+LADDER = [  # (nome, altura, bitrate de vídeo)
+    ("360p", 360, "800k"),
+    ("720p", 720, "2800k"),
+]
+# teto da variante "source" (CRF): entra no BANDWIDTH do master playlist
+SOURCE_MAXRATE = "8000k"
+CONTENT_TYPES = {
+    ".m3u8": "application/vnd.apple.mpegurl",
+    ".m4s":  "video/iso.segment",
+    ".mp4":  "video/mp4",
+}
+
+
+def _hls_command(source: str, out_dir: str, height: int, has_audio: bool) -> List[str]:
+    rungs = [r for r in LADDER if r[1] < height]
+    n = len(rungs) + 1
+    cmd = ["ffmpeg", "-y", "-v", "error", "-i", source]
+    graph = f"[0:v]split={n}" + "".join(f"[s{i}]" for i in range(n))
+    graph += "".join(f";[s{i}]scale=-2:{h}[v{i}]" for i, (_, h, _) in enumerate(rungs))
+    graph += f";[s{len(rungs)}]null[v{len(rungs)}]"
+    cmd += ["-filter_complex", graph]
+    for i in range(n):
+        cmd += ["-map", f"[v{i}]"] + (["-map", "0:a:0"] if has_audio else [])
+
+    cmd += ["-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p"]
+    for i, (_, _, rate) in enumerate(rungs):
+        cmd += [f"-b:v:{i}", rate, f"-maxrate:v:{i}", rate, f"-bufsize:v:{i}", rate]
+    cmd += [f"-crf:v:{len(rungs)}", "20", f"-maxrate:v:{len(rungs)}", SOURCE_MAXRATE,
+            f"-bufsize:v:{len(rungs)}", SOURCE_MAXRATE]
+    cmd += ["-force_key_frames", f"expr:gte(t,n_forced*{HLS_SEGMENT_SECONDS})"]
+    if has_audio:
+        cmd += ["-c:a", "copy"]
+
+    names = [name for name, _, _ in rungs] + ["source"]
+    stream_map = " ".join(
+        f"v:{i},a:{i},name:{names[i]}" if has_audio else f"v:{i},name:{names[i]}"
+        for i in range(n)
+    )
+    cmd += [
+        "-f", "hls",
+        "-hls_time", str(HLS_SEGMENT_SECONDS),
+        "-hls_playlist_type", "vod",
+        "-hls_segment_type", "fmp4",
+        "-hls_flags", "independent_segments",
+        "-hls_fmp4_init_filename", "init.mp4",
+        "-hls_segment_filename", os.path.join(out_dir, "%v", "seg_%03d.m4s"),
+        "-master_pl_name", "master.m3u8",
+        "-var_stream_map", stream_map,
+        os.path.join(out_dir, "%v", "index.m3u8"),
+    ]
+    return cmd
+
+
+def package_hls(source: str, job_id: str) -> Dict[str, Any]:
+    """
+    Gera a escada HLS do vídeo final e publica no R2 em jobs/{job_id}/hls/.
+
+    Returns:
+        {"success", "playlist_url", "renditions"} ou {"success": False, "error"}
+    """
+    info = probe_media(source)
+    if not info or not info.get("video"):
+        return {"success": False, "error": "vídeo final sem stream de vídeo"}
+    r2 = get_r2_client()
+    if not r2 or not R2_PUBLIC_URL:
+        return {"success": False, "error": "R2 não configurado"}
+
+    height = info["video"].get("height") or 0
+    out_dir = tempfile.mkdtemp(prefix=f"hls_{job_id[:8]}_")
+    try:
+        result = subprocess.run(_hls_command(source, out_dir, height, bool(info.get("audio"))),
+                                capture_output=True, text=True, timeout=900)
+        if result.returncode != 0:
+            print(f"   ❌ HLS ffmpeg erro: {result.stderr[-500:]}")
+            return {"success": False, "error": f"Erro no HLS: {result.stderr[-200:]}"}
+
+        prefix = f"jobs/{job_id}/hls"
+        files = [os.path.join(root, name) for root, _, names in os.walk(out_dir) for name in names]
+
+        def _upload(path: str) -> None:
+            rel = os.path.relpath(path, out_dir).replace(os.sep, "/")
+            ext = os.path.splitext(path)[1].lower()
+            ct = CONTENT_TYPES.get(ext) or mimetypes.guess_type(path)[0] or "application/octet-stream"
+            with open(path, "rb") as f:
+                r2.put_object(Bucket=R2_BUCKET_NAME, Key=f"{prefix}/{rel}", Body=f, ContentType=ct)
+
+        # playlists por último: o master só aparece quando os segmentos já estão lá
+        playlists = [p for p in files if p.endswith(".m3u8")]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(_upload, [p for p in files if not p.endswith(".m3u8")]))
+        for p in sorted(playlists, key=lambda p: p.endswith("master.m3u8")):
+            _upload(p)
+
+        renditions = sorted(d for d in os.listdir(out_dir) if os.path.isdir(os.path.join(out_dir, d)))
+        playlist_url = f"{R2_PUBLIC_URL}/{prefix}/master.m3u8"
+        print(f"   📺 HLS publicado ({', '.join(renditions)}): {playlist_url}")
+        return {"success": True, "playlist_url": playlist_url, "renditions": renditions}
+    except subprocess.TimeoutExpired:
+        return {"success": False, "error": "Timeout no empacotamento HLS"}
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return {"success": False, "error": str(e)}
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
@@ -0,0 +1,218 @@
+"""
+🛰️ ClipVox - Requisições fal.ai em voo (persistidas no job)
+
+Cada submit grava {stage, scene_number, endpoint, request_id} em
+job["inflight_requests"] e salva no Supabase na mesma hora. Depois de um
+restart/redeploy, as etapas reencontram o request_id e voltam a acompanhar a
+requisição original em vez de submeter (e pagar) de novo.
+
+A entrada guarda também um fingerprint dos argumentos: se a cena for
+regenerada com outro prompt/imagem, a requisição antiga não é reaproveitada.
+
+Cancelamento: /cancel fotografa as requisições registradas ANTES de acordar
+os pollers (Event por job) e cancela essa foto na fal.ai. Em job cancelado o
+clear() dos pollers não apaga nada — só o próprio cancel remoto limpa.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import FAL_INFLIGHT_MAX_AGE_SECONDS
+
+try:
+    import fal_client
+except Exception:  # pragma: no cover
+    fal_client = None
+
+_jobs: dict = {}
+_lock = threading.RLock()
+_cancel_events: Dict[str, threading.Event] = {}
+_waiters: Dict[str, int] = {}
+
+
+def bind_jobs(db: dict) -> None:
+    global _jobs
+    _jobs = db
+
+
+def _key(stage: str, scene_number: Optional[int]) -> str:
+    if scene_number is None:
+        return f"{stage}:job"
+    if isinstance(scene_number, (list, tuple)):  # janela de cenas: (primeira, última)
+        return f"{stage}:{scene_number[0]:03d}-{scene_number[-1]:03d}"
+    return f"{stage}:{scene_number:03d}"
+
+
+def _fingerprint(arguments: Dict[str, Any]) -> str:
+    raw = json.dumps(arguments, sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def _persist(job_id: str) -> None:
+    try:
+        from services.job_store import save_job
+        save_job(job_id, _jobs[job_id])
+    except Exception as e:
+        print(f"⚠️ save inflight falhou: {e}")
+
+
+def record(job_id: str, stage: str, scene_number: Optional[int], endpoint: str,
+           request_id: str, arguments: Optional[Dict[str, Any]] = None) -> None:
+    """Registra a requisição recém-submetida e persiste imediatamente."""
+    if not job_id or job_id not in _jobs or not request_id:
+        return
+    with _lock:
+        entries = _jobs[job_id].setdefault("inflight_requests", {})
+        entries[_key(stage, scene_number)] = {
+            "stage":        stage,
+            "scene_number": scene_number,
+            "endpoint":     endpoint,
+            "request_id":   request_id,
+            "fingerprint":  _fingerprint(arguments or {}),
+            "submitted_at": time.time(),
+        }
+        _persist(job_id)
+
+
+def clear(job_id: str, stage: str, scene_number: Optional[int], force: bool = False) -> None:
+    """
+    Remove a entrada depois que o resultado foi armazenado (ou a requisição falhou).
+    Job cancelado mantém a entrada: o poller acordado pelo cancel não pode apagar
+    o request_id antes de cancel_remote_requests cancelá-lo na fal.ai.
+    """
+    if not job_id or job_id not in _jobs:
+        return
+    if not force and is_cancelled(job_id):
+        return
+    with _lock:
+        entries = _jobs[job_id].get("inflight_requests") or {}
+        if entries.pop(_key(stage, scene_number), None) is not None:
+            _persist(job_id)
+
+
+def lookup(job_id: str, stage: str, scene_number: Optional[int]) -> Optional[dict]:
+    if not job_id or job_id not in _jobs:
+        return None
+    with _lock:
+        entry = (_jobs[job_id].get("inflight_requests") or {}).get(_key(stage, scene_number))
+        if not entry:
+            return None
+        if time.time() - entry.get("submitted_at", 0) > FAL_INFLIGHT_MAX_AGE_SECONDS:
+            return None
+        return dict(entry)
+
+
+def pending(job_id: Optional[str] = None) -> List[Tuple[str, dict]]:
+    """Entradas ainda abertas — de um job ou de todos os jobs carregados."""
+    with _lock:
+        ids = [job_id] if job_id else list(_jobs.keys())
+        out = []
+        for jid in ids:
+            for entry in (_jobs.get(jid, {}).get("inflight_requests") or {}).values():
+                if time.time() - entry.get("submitted_at", 0) <= FAL_INFLIGHT_MAX_AGE_SECONDS:
+                    out.append((jid, dict(entry)))
+        return out
+
+
+def get_handle(endpoint: str, request_id: str) -> Any:
+    client = getattr(fal_client, "sync_client", None)
+    if client is not None and hasattr(client, "get_handle"):
+        return client.get_handle(endpoint, request_id)
+    return fal_client.SyncRequestHandle.from_request_id(client._client, endpoint, request_id)
+
+
+def submit_or_reattach(job_id: str, stage: str, scene_number: Optional[int],
+                       endpoint: str, arguments: Dict[str, Any]) -> Tuple[str, Any, bool]:
+    """
+    Reaproveita a requisição já submetida (mesmo endpoint + mesmos argumentos)
+    ou faz um novo submit e o registra.
+
+    Returns:
+        (request_id, handler, reattached)
+    """
+    entry = lookup(job_id, stage, scene_number)
+    if entry and entry["endpoint"] == endpoint and entry["fingerprint"] == _fingerprint(arguments):
+        try:
+            handler = get_handle(endpoint, entry["request_id"])
+            handler.status()
+            print(f"   🔁 Reanexando à requisição fal {entry['request_id']} ({stage} {scene_number})")
+            return entry["request_id"], handler, True
+        except Exception as e:
+            print(f"   ⚠️ Requisição {entry['request_id']} não recuperável ({e}) — novo submit")
+            clear(job_id, stage, scene_number)
+
+    handler = fal_client.submit(endpoint, arguments=arguments)
+    request_id = getattr(handler, "request_id", "")
+    record(job_id, stage, scene_number, endpoint, request_id, arguments)
+    return request_id, handler, False
+
+
+# ══════════════════════════════════════════════════════
+# CANCELAMENTO
+# ══════════════════════════════════════════════════════
+
+def is_cancelled(job_id: str) -> bool:
+    if not job_id:
+        return False
+    event = _cancel_events.get(job_id)
+    return bool(event and event.is_set()) or bool(_jobs.get(job_id, {}).get("cancelled"))
+
+
+def wait_or_cancelled(job_id: str, seconds: float) -> bool:
+    """Substitui o time.sleep dos pollers. Retorna True se o job foi cancelado."""
+    if not job_id:
+        time.sleep(seconds)
+        return False
+    if is_cancelled(job_id):
+        return True
+    # o Event só existe enquanto há poller esperando — o dict não cresce por job
+    with _lock:
+        event = _cancel_events.setdefault(job_id, threading.Event())
+        _waiters[job_id] = _waiters.get(job_id, 0) + 1
+    try:
+        event.wait(seconds)
+    finally:
+        with _lock:
+            _waiters[job_id] -= 1
+            if not _waiters[job_id]:
+                del _waiters[job_id]
+                _cancel_events.pop(job_id, None)
+    return is_cancelled(job_id)
+
+
+def signal_cancel(job_id: str) -> List[dict]:
+    """
+    Fotografa as requisições em voo do job e só então acorda pollers e filas
+    de slots. Devolve a foto para cancel_remote_requests.
+    """
+    snapshot = [entry for _, entry in pending(job_id)]
+    with _lock:
+        event = _cancel_events.get(job_id)
+    if event is not None:
+        event.set()
+    try:
+        from services.concurrency import wake_all
+        wake_all()
+    except Exception:
+        pass
+    return snapshot
+
+
+def cancel_remote_requests(job_id: str, entries: Optional[List[dict]] = None) -> int:
+    """Cancela na fal.ai as requisições enfileiradas/em andamento do job."""
+    if entries is None:
+        entries = [entry for _, entry in pending(job_id)]
+    cancelled = 0
+    for entry in entries:
+        try:
+            get_handle(entry["endpoint"], entry["request_id"]).cancel()
+            cancelled += 1
+            print(f"   🛑 fal cancel {entry['request_id']} ({entry['stage']} {entry['scene_number']})")
+        except Exception as e:
+            # requisição já concluída ou endpoint sem suporte a cancel
+            print(f"   ⚠️ fal cancel {entry['request_id']} falhou: {e}")
+        clear(job_id, entry["stage"], entry["scene_number"], force=True)
+    return cancelled
@@ -26,6 +26,7 @@ from config import (
     R2_PUBLIC_URL,
     get_r2_client,
 )
+from services.media_probe import media_duration
 
 try:
     import fal_client
@@ -71,31 +72,12 @@ def _content_type_for_path(path: str) -> str:
     return mimetypes.guess_type(path)[0] or "application/octet-stream"
 
 
-def _ffprobe_duration(path: str) -> float:
-    out = subprocess.check_output(
-        [
-            "ffprobe", "-v", "error",
-            "-show_entries", "format=duration",
-            "-of", "default=noprint_wrappers=1:nokey=1",
-            path,
-        ],
-        text=True,
-    ).strip()
-    return float(out)
-
-
 def _get_video_duration(video_path: str) -> float:
-    try:
-        return _ffprobe_duration(video_path)
-    except Exception:
-        return 5.0
+    return media_duration(video_path, fallback=5.0)
 
 
 def _get_audio_duration(audio_path: str) -> float:
-    try:
-        return _ffprobe_duration(audio_path)
-    except Exception:
-        return 0.0
+    return media_duration(audio_path, fallback=0.0)
 
 
 def _download_to_local(url: str, out_path: str, timeout: int = 300) -> bool:
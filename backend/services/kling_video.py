@@ -5,9 +5,10 @@ Mantém a interface do serviço antigo, mas usa fal.ai/Kling image-to-video.
 
 import mimetypes
 import os
+import threading
 import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import Optional, Dict, Any, Tuple
+from typing import Optional, Dict, Any, Tuple, Callable
 
 import requests
 
@@ -17,11 +18,16 @@ from config import (
     FAL_REQUEST_TIMEOUT_SECONDS,
     FAL_POLL_INTERVAL_SECONDS,
     FAL_KLING_MAX_WORKERS,
+    FAL_KLING_MAX_CONCURRENCY,
     UPLOAD_DIR,
     R2_BUCKET_NAME,
     R2_PUBLIC_URL,
     get_r2_client,
 )
+from services.reference_images import image_to_data_uri
+from services.concurrency import get_limiter, is_throttle_error, AdaptiveLimiter
+from services import inflight_requests
+from services.asset_resolver import register_asset
 
 try:
     import fal_client
@@ -32,6 +38,14 @@ KLING_DEFAULT_VERSION = "2.1"
 NEGATIVE_PROMPT_DEFAULT = "blur, distort, and low quality"
 
 
+def _kling_limiter() -> AdaptiveLimiter:
+    return get_limiter(
+        FAL_KLING_VIDEO_MODEL,
+        initial=FAL_KLING_MAX_WORKERS,
+        maximum=max(FAL_KLING_MAX_WORKERS, FAL_KLING_MAX_CONCURRENCY),
+    )
+
+
 def _require_fal() -> None:
     if not FAL_KEY:
         raise RuntimeError("FAL_KEY não configurada")
@@ -105,12 +119,6 @@ def rehost_image_imgbb(image_path: str) -> Optional[str]:
     return _upload_file_to_r2(image_path, f"adhoc/rehost/{os.path.basename(image_path)}")
 
 
-def _image_to_base64(image_path: str) -> str:
-    import base64
-    with open(image_path, "rb") as f:
-        return base64.b64encode(f.read()).decode("utf-8")
-
-
 def create_kling_video_task(
     image_url: str,
     prompt: str,
@@ -120,6 +128,7 @@ def create_kling_video_task(
     mode: str = "std",
     model: str = "kling",
     version: str = KLING_DEFAULT_VERSION,
+    job_id: str = "",
 ) -> Tuple[Optional[str], Optional[Any]]:
     args: Dict[str, Any] = {
         "prompt": prompt,
@@ -133,15 +142,19 @@ def create_kling_video_task(
 
     endpoint = FAL_KLING_VIDEO_MODEL
     _require_fal()
-    handler = fal_client.submit(endpoint, arguments=args)
-    request_id = getattr(handler, "request_id", "")
-    print(f"   Task criada (fal) cena {scene_number}: {request_id}")
+    request_id, handler, reattached = inflight_requests.submit_or_reattach(
+        job_id, "video", scene_number, endpoint, args
+    )
+    if not reattached:
+        print(f"   Task criada (fal) cena {scene_number}: {request_id}")
     return request_id, handler
 
 
-def poll_kling_video(handler: Any, scene_number: int, timeout: int = FAL_REQUEST_TIMEOUT_SECONDS) -> Optional[str]:
+def poll_kling_video(handler: Any, scene_number: int, timeout: int = FAL_REQUEST_TIMEOUT_SECONDS,
+                     limiter: Optional[AdaptiveLimiter] = None, job_id: str = "") -> Optional[str]:
     start = time.time()
     last_log = None
+    queue_reported = False
     while time.time() - start < timeout:
         status = handler.status(with_logs=True)
         elapsed = int(time.time() - start)
@@ -149,7 +162,12 @@ def poll_kling_video(handler: Any, scene_number: int, timeout: int = FAL_REQUEST
         if isinstance(status, getattr(fal_client, "Queued", tuple())):
             pos = getattr(status, "position", None)
             print(f"   Cena {scene_number} - queued ({elapsed}s) pos={pos}")
+            if limiter:
+                limiter.record_queue_position(pos)
         elif isinstance(status, getattr(fal_client, "InProgress", tuple())):
+            if limiter and not queue_reported:
+                limiter.record_queue_wait(time.time() - start)
+                queue_reported = True
             logs = getattr(status, "logs", None) or []
             if logs:
                 msg = logs[-1].get("message") or str(logs[-1])
@@ -170,7 +188,9 @@ def poll_kling_video(handler: Any, scene_number: int, timeout: int = FAL_REQUEST
         elif status_name in {"FAILED", "ERROR", "CANCELLED"}:
             print(f"   Cena {scene_number} - failed ({elapsed}s) {status_name}")
             return None
-        time.sleep(FAL_POLL_INTERVAL_SECONDS)
+        if inflight_requests.wait_or_cancelled(job_id, FAL_POLL_INTERVAL_SECONDS):
+            print(f"   🛑 Cena {scene_number} - job cancelado ({elapsed}s)")
+            return None
     print(f"   Timeout ({timeout}s) Cena {scene_number}")
     return None
 
@@ -221,7 +241,8 @@ def generate_video_clip(
         if image_path and os.path.exists(image_path):
             public_url = rehost_image_imgbb(image_path)
         if not public_url and image_path and os.path.exists(image_path):
-            public_url = f"data:image/jpeg;base64,{_image_to_base64(image_path)}"
+            # último recurso: data URI de uma versão recomprimida, nunca o JPEG original
+            public_url = image_to_data_uri(image_path)
 
     if not public_url:
         return {
@@ -235,43 +256,73 @@ def generate_video_clip(
             "error": "Sem imagem pública para gerar o clipe",
         }
 
+    limiter = _kling_limiter()
     for attempt in range(1, max_retries + 1):
+        if inflight_requests.is_cancelled(job_id):
+            print(f"   🛑 Cena {scene_number} - job cancelado, clipe não gerado")
+            return {
+                "success": False,
+                "scene_number": scene_number,
+                "video_url": None,
+                "kling_url": None,
+                "video_path": None,
+                "task_id": None,
+                "version": version,
+                "error": "cancelled",
+                "provider": "fal.ai",
+                "prompt": prompt,
+            }
         print(f"\nScene {scene_number} Attempt {attempt}/{max_retries} (fal.ai)")
         try:
-            task_id, handler = create_kling_video_task(
-                image_url=public_url,
-                prompt=prompt,
-                scene_number=scene_number,
-                aspect_ratio=aspect_ratio,
-                duration=duration,
-                mode=mode,
-                model=model,
-                version=version,
-            )
-            if not task_id or handler is None:
-                time.sleep(10 * attempt)
-                continue
-            kling_url = poll_kling_video(handler, scene_number)
+            kling_url = None
+            with limiter.slot(should_abort=lambda: inflight_requests.is_cancelled(job_id)):
+                submitted_at = time.time()
+                task_id, handler = create_kling_video_task(
+                    image_url=public_url,
+                    prompt=prompt,
+                    scene_number=scene_number,
+                    aspect_ratio=aspect_ratio,
+                    duration=duration,
+                    mode=mode,
+                    model=model,
+                    version=version,
+                    job_id=job_id,
+                )
+                if task_id and handler is not None:
+                    kling_url = poll_kling_video(handler, scene_number, limiter=limiter, job_id=job_id)
+                    if kling_url:
+                        limiter.record_success(time.time() - submitted_at)
             if kling_url:
                 local_path, r2_url = _download_video(kling_url, scene_number, job_id)
+                inflight_requests.clear(job_id, "video", scene_number)
                 final_url = r2_url or kling_url
                 print(f"   🔗 fal video_url salva para lip sync: {kling_url[:80]}")
+                # 🗂️ registra tamanho + sha256: merge/lip sync reaproveitam o arquivo local
+                asset = register_asset(local_path, r2_url, kling_url) if local_path else {}
                 return {
                     "success": True,
                     "scene_number": scene_number,
                     "video_url": final_url,
                     "kling_url": kling_url,
                     "video_path": local_path,
+                    "video_size": asset.get("video_size"),
+                    "video_sha256": asset.get("video_sha256"),
                     "task_id": task_id,
                     "attempt": attempt,
                     "version": version,
                     "mode": mode,
+                    "duration": duration if duration in (5, 10) else 5,
                     "provider": "fal.ai",
                     "prompt": prompt,
                 }
+            # falha/timeout terminal: a próxima tentativa deve submeter de novo.
+            # Exceções (rede) mantêm o registro para reanexar na próxima tentativa.
+            inflight_requests.clear(job_id, "video", scene_number)
         except Exception as e:
             print(f"   ⚠️ fal video attempt {attempt} erro: {e}")
-        time.sleep(10 * attempt)
+            if is_throttle_error(str(e)):
+                limiter.record_throttle()
+        inflight_requests.wait_or_cancelled(job_id, 10 * attempt)
 
     return {
         "success": False,
@@ -300,9 +351,11 @@ def generate_video_clips_batch(
 ) -> list:
     total = len(scenes)
     print(f"\nGenerating {total} video clips via fal.ai / Kling ...")
-    print(f"   Mode: {mode} | {duration}s | {aspect_ratio} | workers={FAL_KLING_MAX_WORKERS}")
+    limiter = _kling_limiter()
+    print(f"   Mode: {mode} | {duration}s | {aspect_ratio} | limite={int(limiter.limit)} (máx {limiter.maximum})")
 
-    max_workers = max(1, min(FAL_KLING_MAX_WORKERS, total))
+    # o pool comporta o teto; o limiter decide quantos ficam em voo de fato
+    max_workers = max(1, min(limiter.maximum, total))
     results: list = []
     if max_workers == 1:
         for scene in scenes:
@@ -348,4 +401,74 @@ def generate_video_clips_batch(
     return sorted(results, key=lambda x: x.get("scene_number", 0))
 
 
+class VideoClipStream:
+    """
+    Modo auto: cada cena entra no Kling assim que a própria imagem fica pronta.
+    Usa um pool próprio limitado pelo limiter adaptativo do Kling, então as etapas
+    de imagem e de vídeo rodam sobrepostas em vez de uma depois da outra.
+    """
+
+    def __init__(
+        self,
+        aspect_ratio: str = "16:9",
+        duration: int = 5,
+        mode: str = "std",
+        version: str = KLING_DEFAULT_VERSION,
+        job_id: str = "",
+        bpm: int = None,
+        max_workers: Optional[int] = None,
+        on_clip_done: Optional[Callable[[dict], None]] = None,
+    ):
+        self.aspect_ratio = aspect_ratio
+        self.duration = duration
+        self.mode = mode
+        self.version = version
+        self.job_id = job_id
+        self.bpm = bpm
+        self.on_clip_done = on_clip_done
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers or _kling_limiter().maximum))
+        self._futures: list = []
+        self._lock = threading.Lock()
+
+    def submit(self, scene: dict) -> bool:
+        """Enfileira o clipe de uma cena com imagem válida. Retorna False se ignorada."""
+        if not scene.get("success") or not scene.get("image_url"):
+            return False
+        print(f"   🔗 Cena {scene.get('scene_number')} → Kling (modo auto)")
+        future = self._executor.submit(self._run, dict(scene))
+        with self._lock:
+            self._futures.append(future)
+        return True
+
+    def _run(self, scene: dict) -> dict:
+        result = generate_video_clip(
+            scene=scene,
+            aspect_ratio=self.aspect_ratio,
+            duration=self.duration,
+            mode=self.mode,
+            version=self.version,
+            job_id=self.job_id,
+            bpm=self.bpm,
+        )
+        if self.on_clip_done:
+            try:
+                self.on_clip_done(result)
+            except Exception as e:
+                print(f"   ⚠️ on_clip_done falhou na cena {result.get('scene_number')}: {e}")
+        return result
+
+    def wait(self) -> list:
+        """Aguarda todos os clipes enfileirados e devolve os resultados ordenados."""
+        with self._lock:
+            futures = list(self._futures)
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                print(f"   ⚠️ Clipe auto falhou: {e}")
+        self._executor.shutdown(wait=True)
+        return sorted(results, key=lambda x: x.get("scene_number", 0))
+
+
 generate_videos_batch = generate_video_clips_batch
@@ -12,6 +12,7 @@ CORREÇÕES aplicadas:
 
 import os
 import time
+import threading
 import requests
 from typing import Optional
 from config import UPLOAD_DIR
@@ -20,7 +21,9 @@ LALAL_API_KEY  = os.getenv("LALAL_API_KEY", "")
 LALAL_API_BASE = "https://www.lalal.ai/api"
 
 
-def extract_vocals(audio_path: str, job_id: str = "") -> Optional[str]:
+def extract_vocals(audio_path: str, job_id: str = "",
+                   cancel_event: Optional[threading.Event] = None,
+                   poll_interval: float = 10) -> Optional[str]:
     """
     Envia o áudio para o LALAL.AI e retorna o caminho do WAV só com vocals.
     Retorna: caminho local do arquivo de vocals, ou None se falhar.
@@ -39,7 +42,7 @@ def extract_vocals(audio_path: str, job_id: str = "") -> Optional[str]:
     if not task_id:
         return None
 
-    vocal_url = _poll_result(task_id)
+    vocal_url = _poll_result(task_id, cancel_event=cancel_event, poll_interval=poll_interval)
     if not vocal_url:
         return None
 
@@ -122,11 +125,18 @@ def _start_split(file_id: str) -> Optional[str]:
         return None
 
 
-def _poll_result(task_id: str, timeout: int = 300) -> Optional[str]:
+def _poll_result(task_id: str, timeout: int = 300,
+                 cancel_event: Optional[threading.Event] = None,
+                 poll_interval: float = 10) -> Optional[str]:
     """Aguarda o processamento e retorna a URL do arquivo de vocals."""
     print(f"   ⏳ Aguardando processamento LALAL.AI...")
-    for elapsed in range(10, timeout + 1, 10):
-        time.sleep(10)
+    cancel_event = cancel_event or threading.Event()
+    start = time.time()
+    while time.time() - start < timeout:
+        if cancel_event.wait(poll_interval):
+            print(f"   🛑 Separação cancelada — parando o polling")
+            return None
+        elapsed = int(time.time() - start)
         try:
             resp = requests.get(
                 f"{LALAL_API_BASE}/check/",
@@ -0,0 +1,108 @@
+"""
+🖥️ ClipVox - Separação de vocals local (CPU, sem rede)
+
+Fallback/rascunho quando o Demucs remoto está lento, fora do ar ou com limite.
+Técnica REPET-SIM + HPSS com máscaras suaves (librosa):
+
+  1. STFT do trecho
+  2. HPSS → a parte percussiva (bateria) é descartada
+  3. REPET-SIM: filtro de vizinhos mais próximos (mediana dos frames mais
+     parecidos) estima o acompanhamento que se repete; o que sobra é voz
+  4. máscara suave (softmask) + banda de voz (80 Hz – 8 kHz) → ISTFT
+
+Processa em blocos de VOCAL_LOCAL_CHUNK_SECONDS com sobreposição e crossfade:
+o filtro de vizinhos é O(frames²) em memória, então a música inteira de uma
+vez não cabe numa instância pequena. Determinístico — mesmo áudio, mesma saída.
+"""
+
+import threading
+from typing import Optional
+
+import numpy as np
+
+SAMPLE_RATE = 22050
+N_FFT = 2048
+HOP_LENGTH = 512
+CHUNK_SECONDS = 30.0
+OVERLAP_SECONDS = 1.0
+MARGIN_VOCALS = 10.0      # quanto a voz precisa se destacar do acompanhamento
+MASK_POWER = 2
+VOICE_BAND_HZ = (80.0, 8000.0)
+
+
+def _separate_chunk(y: np.ndarray, sr: int) -> np.ndarray:
+    import librosa
+
+    stft = librosa.stft(y, n_fft=N_FFT, hop_length=HOP_LENGTH)
+    harmonic, _ = librosa.decompose.hpss(stft, margin=1.0)
+    mag, phase = librosa.magphase(harmonic)
+
+    # recurrence_matrix exige width < (frames - 1) // 2; trecho curto demais
+    # (música curta, último bloco) fica só com o HPSS, sem REPET-SIM
+    max_width = (mag.shape[1] - 1) // 2 - 1
+    if max_width >= 1:
+        width = min(int(librosa.time_to_frames(2.0, sr=sr, hop_length=HOP_LENGTH)), max_width)
+        background = librosa.decompose.nn_filter(mag, aggregate=np.median, metric="cosine",
+                                                 width=max(1, width))
+        background = np.minimum(mag, background)
+        mask = librosa.util.softmask(mag - background, MARGIN_VOCALS * background, power=MASK_POWER)
+    else:
+        mask = np.ones_like(mag)
+    freqs = librosa.fft_frequencies(sr=sr, n_fft=N_FFT)
+    band = (freqs >= VOICE_BAND_HZ[0]) & (freqs <= VOICE_BAND_HZ[1])
+    mask[~band, :] = 0.0
+
+    return librosa.istft(mask * mag * phase, hop_length=HOP_LENGTH, length=len(y))
+
+
+def separate_vocals_local(audio_path: str, out_path: str,
+                          cancel: Optional[threading.Event] = None,
+                          chunk_seconds: float = CHUNK_SECONDS) -> Optional[str]:
+    """
+    Extrai os vocals para out_path (WAV mono 22050 Hz).
+
+    Returns:
+        out_path, ou None se cancelado/sem librosa
+    """
+    try:
+        import librosa
+        import soundfile as sf
+    except ImportError:
+        print("⚠️ librosa/soundfile not available, local separation disabled")
+        return None
+
+    y, sr = librosa.load(audio_path, sr=SAMPLE_RATE, mono=True)
+    chunk   = int(chunk_seconds * sr)
+    overlap = int(OVERLAP_SECONDS * sr)
+    out     = np.zeros_like(y)
+    weight  = np.zeros_like(y)
+    fade    = np.linspace(0.0, 1.0, overlap, endpoint=False) if overlap else np.zeros(0)
+
+    print(f"   🖥️ Separação local: {len(y) / sr:.1f}s em blocos de {chunk_seconds:.0f}s")
+    start = 0
+    while start < len(y):
+        if cancel is not None and cancel.is_set():
+            print("   🛑 Separação local cancelada")
+            return None
+        end = min(len(y), start + chunk + overlap)
+        vocals = _separate_chunk(y[start:end], sr)
+
+        # janela de crossfade: sobe no começo (exceto o 1º bloco), desce no fim (exceto o último)
+        w = np.ones(end - start)
+        n = min(overlap, end - start)
+        if start > 0 and n:
+            w[:n] = fade[:n]
+        if end < len(y) and n:
+            w[-n:] = fade[::-1][-n:]
+        out[start:end]    += vocals * w
+        weight[start:end] += w
+        if end == len(y):
+            break  # o próximo bloco seria só sobreposição, sem amostra nova
+        start += chunk
+
+    out = out / np.maximum(weight, 1e-6)
+    peak = float(np.max(np.abs(out))) if out.size else 0.0
+    if peak > 0:
+        out = out * (0.95 / peak)
+    sf.write(out_path, out.astype(np.float32), sr)
+    return out_path
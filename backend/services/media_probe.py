@@ -0,0 +1,160 @@
+"""
+🔎 ClipVox - Cache de metadados de mídia (ffprobe uma vez por arquivo)
+
+Cada etapa perguntava a duração dos mesmos arquivos de novo — a música inteira
+era sondada uma vez por clipe de lip sync. Aqui cada arquivo/objeto é sondado
+uma única vez (ffprobe -show_format -show_streams) e o resultado fica em memória:
+
+  arquivo local → chave (caminho, mtime, tamanho) — invalida sozinho se mudar
+  URL           → chave URL, com TTL (objetos podem ser sobrescritos no regen)
+
+Arquivos que nós mesmos geramos com parâmetros conhecidos podem ser
+registrados direto (register_media), sem ffprobe nenhum.
+"""
+
+import json
+import os
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List
+
+URL_TTL_SECONDS = 600
+MAX_ENTRIES = 1024
+
+_cache: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+_keyframes: "OrderedDict[tuple, List[float]]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def _is_url(source: str) -> bool:
+    return isinstance(source, str) and source.startswith(("http://", "https://"))
+
+
+def _cache_key(source: str) -> Optional[tuple]:
+    if _is_url(source):
+        return ("url", source)
+    try:
+        st = os.stat(source)
+    except OSError:
+        return None
+    return ("file", os.path.abspath(source), st.st_mtime_ns, st.st_size)
+
+
+def _fps(rate: str) -> Optional[float]:
+    try:
+        num, den = (rate or "0/0").split("/")
+        return round(float(num) / float(den), 3) if float(den) else None
+    except Exception:
+        return None
+
+
+def _parse(data: dict) -> Dict[str, Any]:
+    fmt     = data.get("format") or {}
+    streams = data.get("streams") or []
+    video   = next((s for s in streams if s.get("codec_type") == "video"), None)
+    audio   = next((s for s in streams if s.get("codec_type") == "audio"), None)
+    info: Dict[str, Any] = {
+        "duration": float(fmt.get("duration") or 0.0),
+        "format":   fmt.get("format_name"),
+        "size":     int(fmt.get("size") or 0),
+        "video":    None,
+        "audio":    None,
+    }
+    if video:
+        info["video"] = {
+            "codec":   video.get("codec_name"),
+            "profile": video.get("profile"),
+            "width":   video.get("width"),
+            "height":  video.get("height"),
+            "fps":     _fps(video.get("avg_frame_rate") or video.get("r_frame_rate")),
+            "pix_fmt": video.get("pix_fmt"),
+            "time_base": video.get("time_base"),
+        }
+    if audio:
+        info["audio"] = {
+            "codec":       audio.get("codec_name"),
+            "sample_rate": int(audio.get("sample_rate") or 0),
+            "channels":    audio.get("channels"),
+        }
+    return info
+
+
+def _store(key: tuple, info: Dict[str, Any]) -> None:
+    with _lock:
+        _cache[key] = dict(info, probed_at=time.time())
+        _cache.move_to_end(key)
+        while len(_cache) > MAX_ENTRIES:
+            _cache.popitem(last=False)
+
+
+def probe_media(source: str) -> Optional[Dict[str, Any]]:
+    """
+    Metadados de um arquivo local ou URL.
+
+    Returns:
+        dict com duration, format, size, video{codec,profile,width,height,fps,pix_fmt},
+        audio{codec,sample_rate,channels} — ou None se o ffprobe falhar (não cacheado)
+    """
+    key = _cache_key(source)
+    if key is None:
+        return None
+    with _lock:
+        cached = _cache.get(key)
+        if cached and (key[0] == "file" or time.time() - cached["probed_at"] < URL_TTL_SECONDS):
+            _cache.move_to_end(key)
+            return cached
+    try:
+        out = subprocess.check_output([
+            "ffprobe", "-v", "error", "-show_format", "-show_streams",
+            "-of", "json", source,
+        ], text=True, timeout=60)
+        info = _parse(json.loads(out))
+    except Exception as e:
+        print(f"   ⚠️ ffprobe falhou ({str(source)[:60]}): {e}")
+        return None
+    _store(key, info)
+    return info
+
+
+def media_duration(source: str, fallback: float = 0.0) -> float:
+    info = probe_media(source)
+    return info["duration"] if info and info["duration"] > 0 else fallback
+
+
+def keyframe_times(source: str) -> List[float]:
+    """Instantes (s) dos keyframes do vídeo — só lê pacotes-chave; cacheado como o probe."""
+    key = _cache_key(source)
+    if key is None:
+        return []
+    with _lock:
+        if key in _keyframes:
+            _keyframes.move_to_end(key)
+            return _keyframes[key]
+    out = subprocess.check_output([
+        "ffprobe", "-v", "error", "-select_streams", "v:0",
+        "-skip_frame", "nokey", "-show_entries", "frame=pts_time",
+        "-of", "csv=p=0", source,
+    ], text=True, timeout=120)
+    times = sorted(float(t) for t in out.split() if t.strip() and t.strip() != "N/A")
+    with _lock:
+        _keyframes[key] = times
+        while len(_keyframes) > MAX_ENTRIES:
+            _keyframes.popitem(last=False)
+    return times
+
+
+def register_media(path: str, duration: float, audio: Optional[dict] = None,
+                   video: Optional[dict] = None, format_name: Optional[str] = None) -> None:
+    """Registra metadados de um arquivo que acabamos de gerar (parâmetros conhecidos)."""
+    key = _cache_key(path)
+    if key is None:
+        return
+    _store(key, {
+        "duration": float(duration),
+        "format":   format_name,
+        "size":     key[3] if key[0] == "file" else 0,
+        "video":    video,
+        "audio":    audio,
+    })
@@ -0,0 +1,202 @@
+"""
+♻️ ClipVox - Cache de merge (re-merge incremental)
+
+Depois de um /regen-video ou /regen-lipsync de UMA cena, o /merge refazia
+tudo: baixava e renderizava todos os clipes de novo. Aqui os pedaços já
+renderizados de cada cena ficam guardados por job, indexados por uma
+impressão digital da cena:
+
+  clipe (sha256 ou URL) + duração na timeline + transição de entrada
+  (+ clipe/duração da cena anterior quando há xfade)
+
+No re-merge só as cenas cuja impressão mudou são baixadas e renderizadas;
+o resto vem do cache e tudo é remuxado com a música. Se nada mudou (mesmas
+cenas, mesma música), a saída anterior é devolvida direto.
+
+prune() limita o disco entre jobs: o diretório de pedaços de cada job é
+descartado por idade ou, acima do teto de tamanho, do menos usado ao mais.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from typing import List, Dict, Any, Optional, Set
+
+from services.timeline_render import transition_seconds
+
+
+class MergeCache:
+    """Pedaços renderizados por cena + última saída montada de um job."""
+
+    def __init__(self, job_id: str, root: str):
+        self.dir = os.path.join(root, job_id)
+        os.makedirs(self.dir, exist_ok=True)
+        self._manifest_path = os.path.join(self.dir, "manifest.json")
+        self._lock = threading.Lock()
+        try:
+            with open(self._manifest_path) as f:
+                self.manifest = json.load(f)
+        except Exception:
+            self.manifest = {}
+        self.manifest.setdefault("segments", {})
+
+    # ── impressões digitais ────────────────────────────────────────────────
+    @staticmethod
+    def fingerprint(entries: List[Dict[str, Any]], i: int) -> str:
+        entry = entries[i]
+        prev  = entries[i - 1] if i else None
+        entry_in = transition_seconds(entry, prev)
+        key = {
+            "asset":      entry.get("asset"),
+            "duration":   round(entry["duration"], 3),
+            "transition": entry.get("transition") if entry_in else "cut",
+            "in":         round(entry_in, 3),
+            "first":      i == 0,
+            "format":     "ts",  # pedaços em MPEG-TS com SPS/PPS in-band
+        }
+        if entry_in and prev is not None:
+            key["prev"] = [prev.get("asset"), round(prev["duration"], 3)]
+        return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+    def output_fingerprint(self, entries: List[Dict[str, Any]], audio_key: str) -> str:
+        fps = [self.fingerprint(entries, i) for i in range(len(entries))]
+        return hashlib.sha256(json.dumps([fps, audio_key]).encode()).hexdigest()
+
+    # ── segmentos ──────────────────────────────────────────────────────────
+    def get(self, entries: List[Dict[str, Any]], i: int) -> Optional[List[str]]:
+        parts = self.manifest["segments"].get(self.fingerprint(entries, i))
+        if parts and all(os.path.exists(p) for p in parts):
+            return parts
+        return None
+
+    def needed_scenes(self, entries: List[Dict[str, Any]]) -> Set[int]:
+        """Cenas cujo clipe precisa estar em disco para renderizar o que falta."""
+        needed: Set[int] = set()
+        for i, entry in enumerate(entries):
+            if self.get(entries, i) is not None:
+                continue
+            needed.add(entry["scene_number"])
+            if i and transition_seconds(entry, entries[i - 1]):
+                needed.add(entries[i - 1]["scene_number"])
+        return needed
+
+    def put(self, entries: List[Dict[str, Any]], i: int, parts: List[str],
+            work_dir: str) -> List[str]:
+        """Guarda os pedaços recém-renderizados; devolve os caminhos no cache."""
+        fp = self.fingerprint(entries, i)
+        work_dir = os.path.abspath(work_dir)
+        stored = []
+        for k, part in enumerate(parts):
+            dest = os.path.join(self.dir, f"{fp[:24]}_{k}{os.path.splitext(part)[1] or '.ts'}")
+            if os.path.abspath(part).startswith(work_dir + os.sep):
+                shutil.move(part, dest)
+            else:
+                shutil.copy2(part, dest)  # fora do work_dir: não mexe no original
+            stored.append(dest)
+        with self._lock:
+            self.manifest["segments"][fp] = stored
+        return stored
+
+    # ── saída montada ──────────────────────────────────────────────────────
+    def output(self, fingerprint: str) -> Optional[Dict[str, Any]]:
+        out = self.manifest.get("output") or {}
+        if out.get("fingerprint") != fingerprint:
+            return None
+        if out.get("output_url") or (out.get("local_path") and os.path.exists(out["local_path"])):
+            return out
+        return None
+
+    def save(self, entries: List[Dict[str, Any]], output: Optional[Dict[str, Any]] = None) -> None:
+        """Persiste o manifesto e apaga os pedaços que não fazem mais parte da timeline."""
+        keep = {self.fingerprint(entries, i) for i in range(len(entries))}
+        with self._lock:
+            stale = {fp: parts for fp, parts in self.manifest["segments"].items() if fp not in keep}
+            for fp, parts in stale.items():
+                for p in parts:
+                    try:
+                        os.remove(p)
+                    except OSError:
+                        pass
+                del self.manifest["segments"][fp]
+            if output is not None:
+                self.manifest["output"] = output
+            tmp = self._manifest_path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(self.manifest, f)
+            os.replace(tmp, self._manifest_path)
+
+
+# jobs com merge em andamento neste processo — prune() nunca toca nesses
+_in_use: Dict[str, int] = {}
+_in_use_lock = threading.Lock()
+
+
+def acquire(job_id: str) -> None:
+    with _in_use_lock:
+        _in_use[job_id] = _in_use.get(job_id, 0) + 1
+
+
+def release(job_id: str) -> None:
+    with _in_use_lock:
+        _in_use[job_id] -= 1
+        if not _in_use[job_id]:
+            del _in_use[job_id]
+
+
+def _size(path: str) -> int:
+    total = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def _only_local_output(job_dir: str) -> bool:
+    """A última saída do job só existe em disco (sem R2): o /download depende dela."""
+    try:
+        with open(os.path.join(job_dir, "manifest.json")) as f:
+            out = json.load(f).get("output") or {}
+    except Exception:
+        return False
+    return bool(out.get("local_path") and not out.get("output_url")
+                and os.path.exists(out["local_path"]))
+
+
+def prune(root: str, max_bytes: int, max_age_seconds: float) -> int:
+    """
+    Apaga diretórios de pedaços de outros jobs: primeiro os mais velhos que
+    max_age_seconds, depois os menos usados até caber em max_bytes. Só o
+    cache de segmentos — o final_<job>.mp4 (alvo do /download) fica. Jobs com
+    merge em andamento ou cuja saída só existe localmente não são tocados.
+
+    Returns:
+        quantos jobs foram descartados
+    """
+    if not os.path.isdir(root):
+        return 0
+    usage = []  # (último uso, bytes, job, diretório)
+    for job_id in os.listdir(root):
+        path = os.path.join(root, job_id)
+        if os.path.isdir(path):
+            usage.append((os.path.getmtime(path), _size(path), job_id, path))
+    total = sum(u[1] for u in usage)
+
+    now, dropped = time.time(), 0
+    for used, size, job_id, path in sorted(usage):
+        if now - used <= max_age_seconds and total <= max_bytes:
+            break
+        with _in_use_lock:
+            if job_id in _in_use or _only_local_output(path):
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+        total  -= size
+        dropped += 1
+    if dropped:
+        print(f"   🧹 Cache de merge: {dropped} job(s) descartado(s), {total // (1024 * 1024)}MB em uso")
+    return dropped
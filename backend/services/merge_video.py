@@ -14,8 +14,18 @@ Faz upload para R2 — usa as mesmas env vars do restante do projeto.
 import os
 import subprocess
 import tempfile
-import requests
-from typing import List, Optional
+import threading
+import time
+from queue import Queue, Full
+from typing import List, Optional, Dict, Any
+
+from services.clip_fetcher import fetch_clips
+from services.asset_resolver import file_digest
+from services.media_probe import probe_media
+from services.timeline_render import build_timeline, render_timeline
+from services import merge_cache
+from services.merge_cache import MergeCache
+from config import MERGE_CACHE_MAX_GB, MERGE_CACHE_MAX_AGE_HOURS
 
 # ── Env vars — mesmas usadas em kling_video.py e kling_lipsync.py ───────────
 R2_ACCESS_KEY  = os.getenv("R2_ACCESS_KEY_ID", "")
@@ -27,6 +37,18 @@ R2_PUBLIC_URL  = os.getenv("R2_PUBLIC_URL", "").rstrip("/")
 MERGE_OUTPUT_DIR = os.getenv("MERGE_OUTPUT_DIR", "/tmp/clipvox_merges")
 os.makedirs(MERGE_OUTPUT_DIR, exist_ok=True)
 
+# Trilha AAC pronta por música (sha256 do arquivo) — re-merges não recodificam
+MERGE_AUDIO_DIR = os.path.join(MERGE_OUTPUT_DIR, "audio")
+os.makedirs(MERGE_AUDIO_DIR, exist_ok=True)
+
+# Pedaços renderizados por cena (re-merge incremental) — um diretório por job
+MERGE_CACHE_DIR = os.path.join(MERGE_OUTPUT_DIR, "cache")
+
+# Upload multipart em streaming: partes de 8 MB (mínimo do S3/R2 é 5 MB)
+UPLOAD_PART_SIZE = 8 * 1024 * 1024
+UPLOAD_QUEUE_PARTS = 4  # até 32 MB em memória esperando upload
+STREAM_TIMEOUT_SECONDS = 900  # mux + upload em streaming, prazo único
+
 
 def _get_r2_client():
     """Inicializa e retorna o cliente boto3 para Cloudflare R2."""
@@ -49,6 +71,185 @@ def _get_r2_client():
         return None
 
 
+def _aac_track(audio_path: str) -> Optional[str]:
+    """
+    Trilha AAC pronta para ir no merge com -c copy.
+    Áudio já em AAC é usado como está; o resto é codificado uma vez por música.
+    """
+    info = probe_media(audio_path)
+    if info and (info.get("audio") or {}).get("codec") == "aac":
+        return audio_path
+    track = os.path.join(MERGE_AUDIO_DIR, f"{file_digest(audio_path)[:32]}.m4a")
+    if os.path.exists(track):
+        print(f"   ♻️ Trilha AAC em cache")
+        return track
+    tmp = track + ".part"
+    result = subprocess.run([
+        "ffmpeg", "-y", "-i", audio_path,
+        "-vn", "-c:a", "aac", "-b:a", "192k",
+        "-f", "ipod", tmp,
+    ], capture_output=True, text=True, timeout=300)
+    if result.returncode != 0:
+        print(f"   ⚠️ Codificação AAC falhou: {result.stderr[-200:]}")
+        return None
+    os.replace(tmp, track)
+    return track
+
+
+def _stream_mux(cmd: List[str], output_path: str, client=None, bucket: str = "",
+                key: str = "") -> Dict[str, Any]:
+    """
+    Roda o ffmpeg com saída fMP4 no stdout e, enquanto ele muxa, grava o
+    arquivo local e entrega as partes a uma thread que sobe para o R2
+    (multipart). A fila é limitada e bloqueante: se o upload ficar para trás
+    a leitura espera (o ffmpeg segura no pipe) — memória limitada, mux e
+    upload sobrepostos. Um único prazo (STREAM_TIMEOUT_SECONDS) cobre os dois.
+    Falha de upload não derruba o merge: segue só o arquivo local.
+
+    Returns:
+        {"returncode", "stderr", "uploaded": True se o multipart completou}
+    """
+    upload_id, parts, buf = None, [], bytearray()
+    if client:
+        try:
+            upload_id = client.create_multipart_upload(
+                Bucket=bucket, Key=key, ContentType="video/mp4")["UploadId"]
+        except Exception as e:
+            print(f"   ⚠️ R2 multipart indisponível: {e} — só arquivo local")
+
+    deadline  = time.monotonic() + STREAM_TIMEOUT_SECONDS
+    pending: "Queue[Optional[bytes]]" = Queue(maxsize=UPLOAD_QUEUE_PARTS)
+    failed    = threading.Event()
+    timed_out = threading.Event()
+    queued    = 0  # partes entregues à fila (a lista parts é da thread de upload)
+
+    def _uploader() -> None:
+        while True:
+            data = pending.get()
+            if data is None:
+                return
+            if failed.is_set():
+                continue  # só drena a fila
+            try:
+                resp = client.upload_part(Bucket=bucket, Key=key, UploadId=upload_id,
+                                          PartNumber=len(parts) + 1, Body=data)
+                parts.append({"PartNumber": len(parts) + 1, "ETag": resp["ETag"]})
+            except Exception as e:
+                print(f"   ⚠️ Upload de parte falhou: {e} — seguindo só com arquivo local")
+                failed.set()
+
+    uploader = threading.Thread(target=_uploader, daemon=True) if upload_id else None
+    if uploader:
+        uploader.start()
+
+    def _offer(data: bytes) -> None:
+        nonlocal queued
+        if uploader is None or failed.is_set():
+            return
+        try:
+            pending.put(bytes(data), timeout=max(0.0, deadline - time.monotonic()))
+            queued += 1
+        except Full:
+            timed_out.set()
+            proc.kill()
+
+    def _finish_upload() -> bool:
+        nonlocal upload_id
+        if uploader:
+            try:
+                pending.put(None, timeout=max(0.0, deadline - time.monotonic()))
+                uploader.join(max(0.0, deadline - time.monotonic()))
+            except Full:
+                pass
+            if uploader.is_alive():
+                timed_out.set()
+                failed.set()  # a thread só drena o que sobrar
+        if not upload_id:
+            return False
+        if not failed.is_set():
+            try:
+                client.complete_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id,
+                                                 MultipartUpload={"Parts": parts})
+                return True
+            except Exception as e:
+                print(f"   ⚠️ R2 complete_multipart falhou: {e}")
+        try:
+            client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        except Exception:
+            pass
+        upload_id = None
+        return False
+
+    with tempfile.TemporaryFile() as err, open(output_path, "wb") as local:
+        proc  = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=err)
+        timer = threading.Timer(STREAM_TIMEOUT_SECONDS, lambda: (timed_out.set(), proc.kill()))
+        timer.start()
+        try:
+            for chunk in iter(lambda: proc.stdout.read(1024 * 1024), b""):
+                local.write(chunk)
+                buf += chunk
+                if len(buf) >= UPLOAD_PART_SIZE:
+                    _offer(buf)
+                    buf.clear()
+            returncode = proc.wait()
+        finally:
+            timer.cancel()
+        err.seek(0)
+        stderr = err.read().decode(errors="replace")
+
+    if timed_out.is_set() or returncode != 0:
+        failed.set()
+        _finish_upload()
+        if timed_out.is_set():
+            raise subprocess.TimeoutExpired(cmd, STREAM_TIMEOUT_SECONDS)
+        return {"returncode": returncode, "stderr": stderr, "uploaded": False}
+    if buf or not queued:
+        _offer(buf)  # última parte (pode ser < 5 MB)
+    uploaded = _finish_upload()
+    if timed_out.is_set():
+        raise subprocess.TimeoutExpired(cmd, STREAM_TIMEOUT_SECONDS)
+    return {"returncode": 0, "stderr": stderr, "uploaded": uploaded}
+
+
+def _faststart_copy(source: str, dest: str) -> bool:
+    """Remux (-c copy) do fMP4 para MP4 normal com moov no início — o /download."""
+    tmp = dest + ".part.mp4"
+    result = subprocess.run(["ffmpeg", "-y", "-v", "error", "-i", source, "-c", "copy",
+                             "-movflags", "+faststart", tmp],
+                            capture_output=True, text=True, timeout=300)
+    if result.returncode != 0:
+        print(f"   ⚠️ Remux faststart falhou: {result.stderr[-200:]}")
+        return False
+    os.replace(tmp, dest)
+    return True
+
+
+def _fetch_for_timeline(clips: List[Dict[str, Any]], scene_plan: List[Dict[str, Any]],
+                        cache: MergeCache, tmpdir: str):
+    """
+    Baixa só os clipes das cenas que o cache não cobre. Um clipe que falha
+    muda a timeline (a cena anterior cobre o buraco), então repete até estabilizar.
+
+    Returns:
+        (entries da timeline com path preenchido onde foi preciso, missing)
+    """
+    paths: Dict[int, str] = {}
+    missing: List[Dict[str, Any]] = []
+    lost = set()
+    while True:
+        items = [dict(c, path=paths.get(c["scene_number"])) for c in clips
+                 if c["scene_number"] not in lost]
+        entries = build_timeline(items, scene_plan)
+        needed  = cache.needed_scenes(entries) if entries else set()
+        pending = [c for c in items if c["scene_number"] in needed and c["scene_number"] not in paths]
+        if not pending:
+            return entries, missing
+        fetch = fetch_clips(pending, tmpdir)
+        paths.update({f["scene_number"]: f["path"] for f in fetch["fetched"]})
+        missing += fetch["missing"]
+        lost    |= {m["scene_number"] for m in fetch["missing"]}
+
+
 def merge_clips_with_audio(
     video_urls: List[str],
     audio_path: str,
@@ -56,121 +257,146 @@ def merge_clips_with_audio(
     r2_client=None,
     r2_bucket_name: str = None,
     r2_public_url: str = None,
+    clips: Optional[List[Dict[str, Any]]] = None,
+    scene_plan: Optional[List[Dict[str, Any]]] = None,
 ) -> dict:
     """
     Baixa os clipes, concatena e adiciona o áudio original.
     Tenta upload para R2. Se falhar, salva localmente e retorna path para download.
+
+    clips: [{"scene_number", "video_url", ...}] — preferido a video_urls; permite
+    reportar por cena os clipes que não puderam ser baixados (missing_scenes).
+    scene_plan: [{"scene_number", "start_time", "duration_seconds"}] — cada clipe
+    é cortado na duração da sua cena (timeline_render); sem plano, clipes inteiros.
+    Com plano, o re-merge é incremental (merge_cache): só as cenas alteradas são
+    baixadas e renderizadas; sem nenhuma mudança, devolve a saída anterior.
     """
     tmpdir = tempfile.mkdtemp()
+    if clips is None:
+        clips = [{"scene_number": i + 1, "video_url": url} for i, url in enumerate(video_urls)]
 
+    merge_cache.acquire(job_id)
     try:
-        # ── 1. Baixar todos os clipes ─────────────────────────────────────────
-        clip_paths = []
-        for i, url in enumerate(video_urls):
-            print(f"   📥 Baixando clipe {i+1}/{len(video_urls)}: {url[:60]}")
-            try:
-                r = requests.get(url, timeout=120)
-                if r.status_code != 200:
-                    print(f"   ⚠️ Falha ao baixar clipe {i+1} (HTTP {r.status_code})")
-                    continue
-                clip_path = os.path.join(tmpdir, f"clip_{i:03d}.mp4")
-                with open(clip_path, "wb") as f:
-                    f.write(r.content)
-                clip_paths.append(clip_path)
-                print(f"   ✅ Clipe {i+1} baixado ({len(r.content)//1024}KB)")
-            except Exception as e:
-                print(f"   ⚠️ Erro ao baixar clipe {i+1}: {e}")
+        merge_cache.prune(MERGE_CACHE_DIR, int(MERGE_CACHE_MAX_GB * 1024 ** 3),
+                          MERGE_CACHE_MAX_AGE_HOURS * 3600)
+
+        # ── 1. Timeline com cache: só baixa/renderiza as cenas que mudaram ────
+        cache    = MergeCache(job_id, MERGE_CACHE_DIR) if scene_plan else None
+        entries  = build_timeline(clips, scene_plan) if cache else []
+        out_fp   = None
+        timeline = None
+        missing: List[Dict[str, Any]] = []
+        if entries:
+            audio_key = file_digest(audio_path) if audio_path and os.path.exists(audio_path) else ""
+            out_fp    = cache.output_fingerprint(entries, audio_key)
+            previous  = cache.output(out_fp)
+            if previous:
+                print(f"   ♻️ Nenhuma cena mudou desde o último merge — saída reaproveitada")
+                return dict({k: v for k, v in previous.items() if k != "fingerprint"},
+                            success=True, missing_scenes=[], cached=True)
+            entries, missing = _fetch_for_timeline(clips, scene_plan, cache, tmpdir)
+            if entries:
+                timeline = render_timeline(entries, os.path.join(tmpdir, "timeline"), cache=cache)
+
+        # ── 2. Sem timeline (sem plano ou falha): clipes inteiros ─────────────
+        if timeline:
+            clip_paths = timeline
+        else:
+            # clipe que já falhou no download da timeline não é buscado de novo
+            lost       = {m["scene_number"] for m in missing}
+            fetch      = fetch_clips([c for c in clips if c["scene_number"] not in lost], tmpdir)
+            clip_paths = [c["path"] for c in fetch["fetched"]]
+            missing    = missing + fetch["missing"]
 
         if not clip_paths:
-            return {"success": False, "error": "Nenhum clipe pôde ser baixado"}
+            return {"success": False, "error": "Nenhum clipe pôde ser baixado",
+                    "missing_scenes": missing}
+
+        def _remember(output: Dict[str, Any]) -> Dict[str, Any]:
+            if cache and timeline:
+                # saída só é reaproveitável se todas as cenas entraram
+                cache.save(entries, dict(output, fingerprint=out_fp) if not missing else None)
+            return output
 
-        # ── 2. Arquivo de concatenação ────────────────────────────────────────
         concat_file = os.path.join(tmpdir, "concat.txt")
         with open(concat_file, "w") as f:
             for path in clip_paths:
                 f.write(f"file '{path}'\n")
 
-        # ── 3. Concatenar vídeos ──────────────────────────────────────────────
-        merged_video = os.path.join(tmpdir, "merged_video.mp4")
-        print(f"   🎬 Concatenando {len(clip_paths)} clipes...")
-
-        result = subprocess.run([
-            "ffmpeg", "-y",
-            "-f", "concat", "-safe", "0",
-            "-i", concat_file,
-            "-c", "copy",
-            merged_video,
-        ], capture_output=True, text=True, timeout=180)
-
-        if result.returncode != 0:
-            print(f"   ❌ ffmpeg concat erro: {result.stderr[-500:]}")
-            return {"success": False, "error": f"Erro ao concatenar: {result.stderr[-200:]}"}
-
-        print(f"   ✅ Vídeos concatenados")
-
-        # ── 4. Adicionar áudio ────────────────────────────────────────────────
-        output_path = os.path.join(tmpdir, f"final_{job_id}.mp4")
-        print(f"   🎵 Adicionando áudio: {audio_path}")
-
+        # ── 3. Trilha de áudio já em AAC (cache por música) ───────────────────
+        audio_track = None
         if audio_path and os.path.exists(audio_path):
-            result = subprocess.run([
-                "ffmpeg", "-y",
-                "-i", merged_video,
-                "-i", audio_path,
-                "-map", "0:v:0",
-                "-map", "1:a:0",
-                "-c:v", "copy",
-                "-c:a", "aac", "-b:a", "192k",
-                "-shortest",
-                output_path,
-            ], capture_output=True, text=True, timeout=300)
-
-            if result.returncode != 0:
-                print(f"   ⚠️ ffmpeg audio falhou — usando sem áudio: {result.stderr[-200:]}")
-                output_path = merged_video
-            else:
-                print(f"   ✅ Áudio adicionado")
+            print(f"   🎵 Áudio: {audio_path}")
+            audio_track = _aac_track(audio_path)
         else:
             print(f"   ⚠️ Arquivo de áudio não encontrado — usando sem áudio")
-            output_path = merged_video
+
+        # ── 4. Concat + mux numa única passada (-c copy) → fMP4 no stdout,
+        #       enviado ao R2 em multipart enquanto o ffmpeg ainda escreve ─────
+        output_path = os.path.join(tmpdir, f"final_{job_id}.mp4")
+        client      = r2_client or _get_r2_client()
+        r2_key      = f"jobs/{job_id}/final_video.mp4"
+        bucket      = r2_bucket_name or R2_BUCKET
+        pub_url     = (r2_public_url or R2_PUBLIC_URL).rstrip("/")
+        print(f"   🎬 Concatenando {len(clip_paths)} clipes{' + áudio' if audio_track else ''}"
+              f"{f' → R2 {r2_key} (streaming)' if client else ''}...")
+
+        def _mux(track: Optional[str]):
+            cmd = ["ffmpeg", "-y", "-v", "error", "-f", "concat", "-safe", "0", "-i", concat_file]
+            if track:
+                cmd += ["-i", track, "-map", "0:v:0", "-map", "1:a:0", "-shortest"]
+            # moov vazio no início + fragmentos por keyframe: toca antes de baixar tudo
+            cmd += ["-c", "copy", "-movflags", "frag_keyframe+empty_moov+default_base_moof",
+                    "-f", "mp4", "pipe:1"]
+            return _stream_mux(cmd, output_path, client, bucket, r2_key)
+
+        result = _mux(audio_track)
+        if result["returncode"] != 0 and audio_track:
+            print(f"   ⚠️ ffmpeg mux com áudio falhou — usando sem áudio: {result['stderr'][-200:]}")
+            result = _mux(None)
+        if result["returncode"] != 0:
+            print(f"   ❌ ffmpeg concat erro: {result['stderr'][-500:]}")
+            return {"success": False, "error": f"Erro ao concatenar: {result['stderr'][-200:]}"}
+        print(f"   ✅ Vídeos concatenados{' com áudio' if audio_track else ''}")
 
         file_size = os.path.getsize(output_path)
         print(f"   ✅ Merge finalizado: {file_size//1024}KB")
 
-        # ── 5. Upload para R2 ─────────────────────────────────────────────────
-        client = _get_r2_client()
-        if client:
-            r2_key    = f"jobs/{job_id}/final_video.mp4"
-            bucket    = r2_bucket_name or R2_BUCKET
-            pub_url   = (r2_public_url or R2_PUBLIC_URL).rstrip("/")
-            print(f"   📤 Enviando para R2: {r2_key}")
-            try:
-                with open(output_path, "rb") as f:
-                    client.put_object(
-                        Bucket=bucket,
-                        Key=r2_key,
-                        Body=f.read(),
-                        ContentType="video/mp4",
-                    )
-                public_url = f"{pub_url}/{r2_key}"
-                print(f"   ✅ Upload R2 concluído: {public_url}")
-                return {"success": True, "output_url": public_url, "r2_key": r2_key}
-            except Exception as e:
-                print(f"   ⚠️ Upload R2 falhou: {e} — usando fallback local")
-
-        # ── 6. Fallback local ─────────────────────────────────────────────────
+        # ── 5. Cópia local — /download e o empacotamento HLS leem daqui.
+        #       O R2 fica com o fMP4 (toca progressivo no preview); o arquivo
+        #       local vira MP4 normal com faststart para players/editores ─────
         local_filename = f"final_{job_id}.mp4"
         local_path     = os.path.join(MERGE_OUTPUT_DIR, local_filename)
-        import shutil
-        shutil.copy2(output_path, local_path)
+        if not _faststart_copy(output_path, local_path):
+            import shutil
+            shutil.move(output_path, local_path)
+
+        # ── 6. R2 — normalmente já terminou junto com o mux; se o streaming
+        #       falhou (parte rejeitada, multipart indisponível), sobe o local ─
+        if not result["uploaded"] and client:
+            try:
+                client.upload_file(local_path, bucket, r2_key,
+                                   ExtraArgs={"ContentType": "video/mp4"})
+                result["uploaded"] = True
+            except Exception as e:
+                print(f"   ⚠️ Upload R2 do arquivo local falhou: {e}")
+        if result["uploaded"]:
+            public_url = f"{pub_url}/{r2_key}"
+            print(f"   ✅ Upload R2 concluído: {public_url}")
+            return _remember({"success": True, "output_url": public_url, "r2_key": r2_key,
+                              "local_path": local_path, "filename": local_filename,
+                              "missing_scenes": missing})
+        if client:
+            print(f"   ⚠️ Upload R2 falhou — usando fallback local")
         print(f"   💾 Arquivo salvo localmente: {local_path}")
 
-        return {
+        return _remember({
             "success":    True,
             "output_url": None,
             "local_path": local_path,
             "filename":   local_filename,
-        }
+            "missing_scenes": missing,
+        })
 
     except subprocess.TimeoutExpired:
         return {"success": False, "error": "Timeout no processo de merge"}
@@ -179,6 +405,7 @@ def merge_clips_with_audio(
         traceback.print_exc()
         return {"success": False, "error": str(e)}
     finally:
+        merge_cache.release(job_id)
         import shutil
         try:
             shutil.rmtree(tmpdir, ignore_errors=True)
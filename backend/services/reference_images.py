@@ -0,0 +1,102 @@
+"""
+🖼️ ClipVox - Reference Image Ingest
+Redimensiona e recomprime as fotos de referência UMA vez por job e publica no R2.
+
+As URLs públicas ficam salvas no job (ref_image_urls) e são reutilizadas em todas
+as gerações e regenerações — nenhuma etapa reenvia o mesmo arquivo ao provedor.
+"""
+
+import base64
+import io
+import os
+from typing import List, Optional, Dict
+
+from PIL import Image, ImageOps
+
+from config import (
+    UPLOAD_DIR,
+    REF_IMAGE_MAX_SIDE,
+    REF_IMAGE_JPEG_QUALITY,
+    R2_BUCKET_NAME,
+    R2_PUBLIC_URL,
+    get_r2_client,
+)
+
+MAX_REFERENCE_IMAGES = 3
+
+
+def _compress_jpeg(image_path: str, max_side: int = REF_IMAGE_MAX_SIDE,
+                   quality: int = REF_IMAGE_JPEG_QUALITY) -> bytes:
+    """Aplica rotação EXIF, limita o maior lado e recomprime como JPEG progressivo."""
+    with Image.open(image_path) as img:
+        img = ImageOps.exif_transpose(img)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        img.thumbnail((max_side, max_side), Image.LANCZOS)
+        buf = io.BytesIO()
+        img.save(buf, format="JPEG", quality=quality, optimize=True, progressive=True)
+        return buf.getvalue()
+
+
+def preprocess_reference_image(image_path: str, out_path: str) -> Optional[str]:
+    """Gera a versão reduzida de uma referência. Retorna o caminho salvo ou None."""
+    try:
+        data = _compress_jpeg(image_path)
+        with open(out_path, "wb") as f:
+            f.write(data)
+        orig_kb = os.path.getsize(image_path) // 1024
+        print(f"   🖼️ Referência otimizada: {orig_kb}KB → {len(data)//1024}KB")
+        return out_path
+    except Exception as e:
+        print(f"   ⚠️ Falha ao otimizar referência {os.path.basename(image_path)}: {e}")
+        return None
+
+
+def image_to_data_uri(image_path: str) -> Optional[str]:
+    """Data URI de uma versão recomprimida — usado só quando não há URL pública."""
+    try:
+        data = _compress_jpeg(image_path)
+        return f"data:image/jpeg;base64,{base64.b64encode(data).decode('utf-8')}"
+    except Exception as e:
+        print(f"   ⚠️ Falha ao gerar data URI: {e}")
+        return None
+
+
+def _upload_to_r2(local_path: str, key: str) -> Optional[str]:
+    try:
+        r2_client = get_r2_client()
+        if not r2_client:
+            return None
+        with open(local_path, "rb") as f:
+            r2_client.put_object(Bucket=R2_BUCKET_NAME, Key=key, Body=f, ContentType="image/jpeg")
+        return f"{R2_PUBLIC_URL}/{key}" if R2_PUBLIC_URL else None
+    except Exception as e:
+        print(f"   ⚠️ R2 upload referência falhou: {e}")
+        return None
+
+
+def ingest_reference_images(image_paths: List[str], job_id: str) -> Dict[str, list]:
+    """
+    Etapa de ingest: otimiza e publica até 3 referências.
+
+    Returns:
+        dict com "paths" (arquivos otimizados locais) e "urls" (URLs públicas no R2)
+    """
+    paths = [p for p in (image_paths or []) if p and os.path.exists(p)][:MAX_REFERENCE_IMAGES]
+    prepared: List[str] = []
+    urls: List[str] = []
+    if not paths:
+        return {"paths": prepared, "urls": urls}
+
+    print(f"   🖼️ Ingest de {len(paths)} referência(s) — job {job_id or 'adhoc'}")
+    for i, path in enumerate(paths, start=1):
+        out_path = os.path.join(UPLOAD_DIR, f"{job_id or 'adhoc'}_ref{i}_prepared.jpg")
+        local = preprocess_reference_image(path, out_path) or path
+        prepared.append(local)
+        url = _upload_to_r2(local, f"jobs/{job_id or 'adhoc'}/refs/ref_{i}.jpg")
+        if url:
+            urls.append(url)
+            print(f"   ✅ Ref {i} publicada: {url}")
+        else:
+            print(f"   ⚠️ Ref {i} não publicada")
+    return {"paths": prepared, "urls": urls}
@@ -12,6 +12,7 @@ Fluxo:
 
 import os
 import time
+import threading
 import requests
 from typing import Optional
 from config import UPLOAD_DIR
@@ -51,7 +52,9 @@ def _ensure_mp3(audio_path: str, job_id: str) -> str:
         return audio_path
 
 
-def extract_vocals(audio_path: str, job_id: str = "") -> Optional[str]:
+def extract_vocals(audio_path: str, job_id: str = "",
+                   cancel_event: Optional[threading.Event] = None,
+                   poll_interval: float = 10) -> Optional[str]:
     """
     Envia o áudio para o StemSplit.io e retorna o caminho local do MP3 só com vocals.
     Retorna: caminho local do arquivo de vocals, ou None se falhar.
@@ -80,7 +83,7 @@ def extract_vocals(audio_path: str, job_id: str = "") -> Optional[str]:
         return None
 
     # 4. Aguarda conclusão
-    vocal_url = _poll_result(stem_job_id)
+    vocal_url = _poll_result(stem_job_id, cancel_event=cancel_event, poll_interval=poll_interval)
     if not vocal_url:
         return None
 
@@ -208,12 +211,19 @@ def _create_job(upload_key: str) -> Optional[str]:
         return None
 
 
-def _poll_result(stem_job_id: str, timeout: int = 300) -> Optional[str]:
+def _poll_result(stem_job_id: str, timeout: int = 300,
+                 cancel_event: Optional[threading.Event] = None,
+                 poll_interval: float = 10) -> Optional[str]:
     """Aguarda o processamento e retorna a URL do arquivo de vocals."""
     print(f"   ⏳ Aguardando processamento StemSplit...")
 
-    for elapsed in range(10, timeout + 1, 10):
-        time.sleep(10)
+    cancel_event = cancel_event or threading.Event()
+    start = time.time()
+    while time.time() - start < timeout:
+        if cancel_event.wait(poll_interval):
+            print(f"   🛑 Separação cancelada — parando o polling")
+            return None
+        elapsed = int(time.time() - start)
         try:
             resp = requests.get(
                 f"{STEMSPLIT_API_BASE}/jobs/{stem_job_id}",
@@ -13,24 +13,35 @@ import os
 import time
 import subprocess
 import requests
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple
 
 from config import (
     FAL_KEY,
     FAL_REQUEST_TIMEOUT_SECONDS,
     FAL_POLL_INTERVAL_SECONDS,
+    FAL_LIPSYNC_MAX_WORKERS,
+    FAL_LIPSYNC_MAX_CONCURRENCY,
+    LIPSYNC_FACE_PRECHECK,
+    LIPSYNC_FACE_PRECHECK_SKIP,
+    LIPSYNC_WINDOW_MAX_SECONDS,
     UPLOAD_DIR,
     R2_BUCKET_NAME,
     R2_PUBLIC_URL,
     get_r2_client,
 )
+from services.concurrency import get_limiter, is_throttle_error, AdaptiveLimiter, SlotAborted
+from services import inflight_requests
+from services.vocal_stems import get_vocal_stem
+from services.face_detection import assess_face_presence
+from services.media_probe import probe_media, media_duration, register_media
+from services.timeline_render import render_segment
+from services.asset_resolver import local_copy, register_asset
 
 try:
     import fal_client
 except Exception:
     fal_client = None
 
-DEMUCS_ENDPOINT    = "fal-ai/demucs"
 KLING_LIPSYNC_ENDPOINT = "fal-ai/kling-video/lipsync/audio-to-video"  # $0.014/5s
 
 # Cascata: (endpoint, model_param_or_None)
@@ -56,21 +67,8 @@ def _fal_unwrap(result: Any) -> Dict[str, Any]:
     return result if isinstance(result, dict) else {}
 
 
-def _ffprobe_duration(path: str) -> float:
-    out = subprocess.check_output([
-        "ffprobe", "-v", "error",
-        "-show_entries", "format=duration",
-        "-of", "default=noprint_wrappers=1:nokey=1",
-        path,
-    ], text=True).strip()
-    return float(out)
-
-
 def _get_duration(path: str, fallback: float = 5.0) -> float:
-    try:
-        return _ffprobe_duration(path)
-    except Exception:
-        return fallback
+    return media_duration(path, fallback=fallback)
 
 
 def _download_to_local(url: str, out_path: str, timeout: int = 300) -> bool:
@@ -90,8 +88,9 @@ def _download_to_local(url: str, out_path: str, timeout: int = 300) -> bool:
 
 
 def _ensure_local_video(source: str, job_id: str) -> str:
-    if os.path.exists(str(source)):
-        return str(source)
+    cached = local_copy(str(source))
+    if cached:
+        return cached
     local = os.path.join(UPLOAD_DIR, f"{job_id}_face.mp4")
     if not _download_to_local(source, local, timeout=300):
         raise RuntimeError("Falha ao baixar vídeo para lipsync")
@@ -123,6 +122,25 @@ def _upload_to_r2(local_path: str, key: str) -> Optional[str]:
         return None
 
 
+def _is_owned_url(url: str) -> bool:
+    """Objeto durável no nosso R2 — pode ir por URL, sem download/re-upload."""
+    return bool(R2_PUBLIC_URL) and isinstance(url, str) and url.startswith(R2_PUBLIC_URL + "/")
+
+
+def _persist_output(url: str, local_path: str, key: str) -> Dict[str, Any]:
+    """
+    Persiste a URL efêmera do provedor: baixa uma vez para o disco (o merge
+    reaproveita a cópia local) e publica o mesmo arquivo no R2.
+
+    Returns:
+        {"video_url": URL no R2 ou None, + video_path/video_size/video_sha256}
+    """
+    if not _download_to_local(url, local_path, timeout=600):
+        return {"video_url": None}
+    r2_url = _upload_to_r2(local_path, key)
+    return {"video_url": r2_url, **register_asset(local_path, r2_url, url)}
+
+
 def _check_url(url: str, label: str) -> bool:
     try:
         resp = requests.head(url, timeout=20, allow_redirects=True)
@@ -139,7 +157,17 @@ def _check_url(url: str, label: str) -> bool:
 def _normalize_audio(audio_path: str, job_id: str,
                      duration_cap: Optional[float] = None,
                      suffix: str = "norm") -> str:
-    """MP3 mono 44100 Hz — corta no tamanho do vídeo se duration_cap fornecido."""
+    """
+    MP3 mono 44100 Hz — corta no tamanho do vídeo se duration_cap fornecido.
+    Entrada que já está nesse formato (e cabe no cap) é devolvida como está.
+    """
+    src = probe_media(audio_path)
+    src_audio = (src or {}).get("audio") or {}
+    if (src_audio.get("codec") == "mp3" and src_audio.get("sample_rate") == 44100
+            and src_audio.get("channels") == 1
+            and (not duration_cap or src["duration"] <= duration_cap + 0.05)):
+        return audio_path
+
     out = os.path.join(UPLOAD_DIR, f"{job_id}_{suffix}.mp3")
     cmd = ["ffmpeg", "-y", "-i", audio_path]
     if duration_cap:
@@ -149,74 +177,13 @@ def _normalize_audio(audio_path: str, job_id: str,
     subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
     if not os.path.exists(out) or os.path.getsize(out) < 1024:
         raise RuntimeError("Áudio normalizado inválido")
+    if src and src["duration"] > 0:
+        duration = min(src["duration"], duration_cap) if duration_cap else src["duration"]
+        register_media(out, duration, audio={"codec": "mp3", "sample_rate": 44100, "channels": 1},
+                       format_name="mp3")
     return out
 
 
-# ══════════════════════════════════════════════════════
-# PASSO 1 — DEMUCS: extração de vocals via fal.ai
-# ══════════════════════════════════════════════════════
-
-def _extract_vocals_demucs(audio_url: str, job_id: str) -> Optional[str]:
-    """
-    fal-ai/demucs recebe só audio_url e retorna stems na raiz:
-    data = { "vocals": {"url":"..."}, "drums": {...}, ... }
-    """
-    print(f"   🎵 Demucs: extraindo vocals de {audio_url[:60]}...")
-    try:
-        handler    = fal_client.submit(DEMUCS_ENDPOINT, arguments={"audio_url": audio_url})
-        request_id = getattr(handler, "request_id", "")
-        print(f"   ⏳ Demucs task: {request_id}")
-
-        start    = time.time()
-        timeout  = 300
-        last_log = None
-
-        while time.time() - start < timeout:
-            status      = handler.status(with_logs=True)
-            status_name = getattr(status, "status", status.__class__.__name__).upper()
-            elapsed     = int(time.time() - start)
-
-            if isinstance(status, getattr(fal_client, "Queued", tuple())):
-                print(f"   ⏳ Demucs fila pos={getattr(status,'position','?')} ({elapsed}s)")
-            elif isinstance(status, getattr(fal_client, "InProgress", tuple())):
-                logs = getattr(status, "logs", None) or []
-                if logs:
-                    msg = logs[-1].get("message") or str(logs[-1])
-                    if msg != last_log:
-                        print(f"   ⏳ Demucs: {msg} ({elapsed}s)")
-                        last_log = msg
-                else:
-                    print(f"   ⏳ Demucs processando... ({elapsed}s)")
-            elif isinstance(status, getattr(fal_client, "Completed", tuple())) or status_name == "COMPLETED":
-                payload   = handler.get()
-                data      = _fal_unwrap(payload)
-                vocals    = data.get("vocals") or {}
-                vocal_url = vocals.get("url") if isinstance(vocals, dict) else None
-                if not vocal_url:
-                    stems     = data.get("stems") or {}
-                    vocals_s  = stems.get("vocals") or {}
-                    vocal_url = vocals_s.get("url") if isinstance(vocals_s, dict) else None
-                if not vocal_url:
-                    vocal_url = data.get("vocals_url") or data.get("vocal_url")
-                if vocal_url:
-                    print(f"   ✅ Demucs vocals extraídos: {vocal_url[:80]}")
-                    return vocal_url
-                print(f"   ❌ Demucs sem vocal_url. Keys: {list(data.keys())}")
-                return None
-            elif status_name in {"FAILED", "ERROR", "CANCELLED"}:
-                print(f"   ❌ Demucs falhou: {status_name}")
-                return None
-
-            time.sleep(FAL_POLL_INTERVAL_SECONDS)
-
-        print(f"   ❌ Demucs timeout ({timeout}s)")
-        return None
-
-    except Exception as e:
-        print(f"   ❌ Demucs exception: {e}")
-        return None
-
-
 # ══════════════════════════════════════════════════════
 # PASSO 2 — SYNC LABS com cascata de modelos
 # ══════════════════════════════════════════════════════
@@ -239,108 +206,146 @@ def _is_retryable(error_str: str) -> bool:
     return any(k in low for k in _RETRYABLE_ERRORS)
 
 
+def get_lipsync_limiter() -> AdaptiveLimiter:
+    return get_limiter(
+        KLING_LIPSYNC_ENDPOINT,
+        initial=FAL_LIPSYNC_MAX_WORKERS,
+        maximum=max(FAL_LIPSYNC_MAX_WORKERS, FAL_LIPSYNC_MAX_CONCURRENCY),
+    )
+
+
 def _run_kling_lipsync(video_url: str, audio_url: str,
                        timeout: int = FAL_REQUEST_TIMEOUT_SECONDS,
-                       max_retries: int = 3) -> Dict[str, Any]:
+                       max_retries: int = 3,
+                       job_id: str = "",
+                       scene_number: Optional[int] = None,
+                       stage: str = "lipsync") -> Dict[str, Any]:
     """
     Kling LipSync — fal-ai/kling-video/lipsync/audio-to-video
     Preço: $0.014 por clipe de 5s (~$0.59 para 3.5min)
     Aceita só video_url + audio_url, sem parâmetros extras.
+    stage/scene_number: chave da requisição em voo ("lipsync_window" + (primeira, última) nas janelas).
     """
     last_error = "Kling LipSync falhou"
+    limiter    = get_lipsync_limiter()
+
+    def is_cancelled() -> bool:
+        return inflight_requests.is_cancelled(job_id)
 
     for attempt in range(1, max_retries + 1):
         if attempt > 1:
             wait = 15 * attempt
             print(f"      ↩ retry {attempt}/{max_retries} em {wait}s (Kling LipSync)...")
-            time.sleep(wait)
+            inflight_requests.wait_or_cancelled(job_id, wait)
+        if is_cancelled():
+            return {"success": False, "error": "cancelled"}
 
         try:
-            print(f"   🎤 Kling LipSync: tentativa {attempt}/{max_retries}...")
-            handler    = fal_client.submit(
-                KLING_LIPSYNC_ENDPOINT,
-                arguments={"video_url": video_url, "audio_url": audio_url},
-            )
-            request_id = getattr(handler, "request_id", "")
-            print(f"   ⏳ task: {request_id}")
-
-            start    = time.time()
-            last_log = None
-
-            while time.time() - start < timeout:
+            with limiter.slot(should_abort=is_cancelled):
                 try:
-                    status      = handler.status(with_logs=True)
-                    status_name = getattr(status, "status", status.__class__.__name__).upper()
-                    elapsed     = int(time.time() - start)
-
-                    if isinstance(status, getattr(fal_client, "Queued", tuple())):
-                        print(f"   ⏳ fila pos={getattr(status,'position','?')} ({elapsed}s)")
-                    elif isinstance(status, getattr(fal_client, "InProgress", tuple())):
-                        logs = getattr(status, "logs", None) or []
-                        if logs:
-                            msg = logs[-1].get("message") or str(logs[-1])
-                            if msg != last_log:
-                                print(f"   ⏳ {msg} ({elapsed}s)")
-                                last_log = msg
-                        else:
-                            print(f"   ⏳ processando... ({elapsed}s)")
-                    elif isinstance(status, getattr(fal_client, "Completed", tuple())) or status_name == "COMPLETED":
+                    print(f"   🎤 Kling LipSync: tentativa {attempt}/{max_retries}...")
+                    request_id, handler, _ = inflight_requests.submit_or_reattach(
+                        job_id, stage, scene_number, KLING_LIPSYNC_ENDPOINT,
+                        {"video_url": video_url, "audio_url": audio_url},
+                    )
+                    print(f"   ⏳ task: {request_id}")
+
+                    start    = time.time()
+                    last_log = None
+                    queue_reported = False
+
+                    while time.time() - start < timeout:
                         try:
-                            payload = handler.get()
-                        except Exception as get_err:
-                            err_str = str(get_err)
-                            print(f"   ⚠️ get() erro: {err_str[:120]}")
+                            status      = handler.status(with_logs=True)
+                            status_name = getattr(status, "status", status.__class__.__name__).upper()
+                            elapsed     = int(time.time() - start)
+
+                            if isinstance(status, getattr(fal_client, "Queued", tuple())):
+                                print(f"   ⏳ fila pos={getattr(status,'position','?')} ({elapsed}s)")
+                                limiter.record_queue_position(getattr(status, "position", None))
+                            elif isinstance(status, getattr(fal_client, "InProgress", tuple())):
+                                if not queue_reported:
+                                    limiter.record_queue_wait(time.time() - start)
+                                    queue_reported = True
+                                logs = getattr(status, "logs", None) or []
+                                if logs:
+                                    msg = logs[-1].get("message") or str(logs[-1])
+                                    if msg != last_log:
+                                        print(f"   ⏳ {msg} ({elapsed}s)")
+                                        last_log = msg
+                                else:
+                                    print(f"   ⏳ processando... ({elapsed}s)")
+                            elif isinstance(status, getattr(fal_client, "Completed", tuple())) or status_name == "COMPLETED":
+                                try:
+                                    payload = handler.get()
+                                except Exception as get_err:
+                                    err_str = str(get_err)
+                                    print(f"   ⚠️ get() erro: {err_str[:120]}")
+                                    last_error = err_str
+                                    inflight_requests.clear(job_id, stage, scene_number)
+                                    if _is_retryable(err_str):
+                                        break
+                                    return {"success": False, "error": err_str}
+
+                                data  = _fal_unwrap(payload)
+                                # Kling LipSync retorna { "video": {"url": "..."} }
+                                video = data.get("video") or {}
+                                url   = video.get("url") if isinstance(video, dict) else None
+                                if not url:
+                                    url = data.get("output_url") or data.get("video_url")
+                                if url:
+                                    limiter.record_success(time.time() - start)
+                                    print(f"   ✅ Kling LipSync concluído: {url[:80]}")
+                                    return {"success": True, "video_url": url,
+                                            "task_id": request_id, "model_used": "fal-ai/sync-lipsync/v2"}
+                                inflight_requests.clear(job_id, stage, scene_number)
+                                return {"success": False,
+                                        "error": f"Kling LipSync concluiu sem video.url. Keys: {list(data.keys())}"}
+
+                            elif status_name in {"FAILED", "ERROR", "CANCELLED"}:
+                                err_msg = None
+                                try:
+                                    payload = handler.get()
+                                    data    = _fal_unwrap(payload)
+                                    err_msg = data.get("error") or data.get("message")
+                                except Exception:
+                                    pass
+                                err        = err_msg or f"Kling LipSync: {status_name}"
+                                last_error = err
+                                inflight_requests.clear(job_id, stage, scene_number)
+                                if is_throttle_error(err):
+                                    limiter.record_throttle()
+                                if _is_retryable(err):
+                                    break
+                                return {"success": False, "error": err}
+
+                        except Exception as poll_err:
+                            err_str    = str(poll_err)
                             last_error = err_str
+                            print(f"   ⚠️ polling erro: {err_str[:120]}")
+                            if is_throttle_error(err_str):
+                                limiter.record_throttle()
                             if _is_retryable(err_str):
                                 break
                             return {"success": False, "error": err_str}
 
-                        data  = _fal_unwrap(payload)
-                        # Kling LipSync retorna { "video": {"url": "..."} }
-                        video = data.get("video") or {}
-                        url   = video.get("url") if isinstance(video, dict) else None
-                        if not url:
-                            url = data.get("output_url") or data.get("video_url")
-                        if url:
-                            print(f"   ✅ Kling LipSync concluído: {url[:80]}")
-                            return {"success": True, "video_url": url,
-                                    "task_id": request_id, "model_used": "fal-ai/sync-lipsync/v2"}
-                        return {"success": False,
-                                "error": f"Kling LipSync concluiu sem video.url. Keys: {list(data.keys())}"}
-
-                    elif status_name in {"FAILED", "ERROR", "CANCELLED"}:
-                        err_msg = None
-                        try:
-                            payload = handler.get()
-                            data    = _fal_unwrap(payload)
-                            err_msg = data.get("error") or data.get("message")
-                        except Exception:
-                            pass
-                        err        = err_msg or f"Kling LipSync: {status_name}"
-                        last_error = err
-                        if _is_retryable(err):
-                            break
-                        return {"success": False, "error": err}
-
-                except Exception as poll_err:
-                    err_str    = str(poll_err)
-                    last_error = err_str
-                    print(f"   ⚠️ polling erro: {err_str[:120]}")
-                    if _is_retryable(err_str):
-                        break
-                    return {"success": False, "error": err_str}
+                        if inflight_requests.wait_or_cancelled(job_id, FAL_POLL_INTERVAL_SECONDS):
+                            print(f"   🛑 Kling LipSync: job cancelado")
+                            return {"success": False, "error": "cancelled"}
+                    else:
+                        last_error = f"Kling LipSync timeout ({timeout}s)"
+                        print(f"   ⚠️ {last_error}")
 
-                time.sleep(FAL_POLL_INTERVAL_SECONDS)
-            else:
-                last_error = f"Kling LipSync timeout ({timeout}s)"
-                print(f"   ⚠️ {last_error}")
-
-        except Exception as submit_err:
-            err_str    = str(submit_err)
-            last_error = err_str
-            print(f"   ⚠️ submit erro: {err_str[:120]}")
-            if not _is_retryable(err_str):
-                return {"success": False, "error": err_str}
+                except Exception as submit_err:
+                    err_str    = str(submit_err)
+                    last_error = err_str
+                    print(f"   ⚠️ submit erro: {err_str[:120]}")
+                    if is_throttle_error(err_str):
+                        limiter.record_throttle()
+                    if not _is_retryable(err_str):
+                        return {"success": False, "error": err_str}
+        except SlotAborted:
+            return {"success": False, "error": "cancelled"}
 
     return {"success": False, "error": last_error}
 
@@ -356,86 +361,119 @@ def generate_lipsync(
     model: str = "sync",
     preextracted_vocals: Optional[str] = None,
     origin_task_id: str = "",
+    parent_job_id: str = "",
+    scene_number: Optional[int] = None,
+    audio_slice: Optional[str] = None,
+    face_precheck: bool = LIPSYNC_FACE_PRECHECK,
+    window: Optional[Tuple[int, int]] = None,
 ) -> Dict[str, Any]:
     """
     Pipeline: Demucs (vocals) → Kling LipSync
     Custo: $0.014 por clipe de 5s (~$0.59 para 3.5min)
     Interface idêntica — troca direta no videos.py sem outras mudanças.
+    audio_slice: trecho da cena já fatiado (audio_slicer) — pula stem e normalização.
+    face_precheck: checa rosto localmente (OpenCV) e marca o resultado (face_check);
+                   só deixa de enviar clipes "no_face" com LIPSYNC_FACE_PRECHECK_SKIP.
+    window: (primeira, última) cena quando o clipe é uma janela — a requisição em
+            voo fica em "lipsync_window:<primeira>-<última>", não na chave da cena.
     """
     try:
         _require_fal()
+        if inflight_requests.is_cancelled(parent_job_id):
+            return {"success": False, "error": "cancelled"}
         safe_job_id = job_id or f"sync_{int(time.time())}"
         print(f"\n{'='*60}")
         print(f"🎤 Demucs + Kling LipSync — job {safe_job_id[:12]}")
         print(f"{'='*60}")
 
-        # 1. Vídeo local + duração
-        video_local    = _ensure_local_video(face_source, safe_job_id)
-        video_duration = _get_duration(video_local)
-        print(f"   ⏱️  Vídeo: {video_duration:.2f}s")
-
-        # 2. Áudio local
-        audio_local = _ensure_local_audio(audio_source, safe_job_id)
-        print(f"   🎵 Áudio original: {_get_duration(audio_local):.2f}s")
-
-        # 3. Normalizar + subir áudio completo para Demucs
-        full_audio_norm = _normalize_audio(audio_local, safe_job_id, suffix="full_norm")
-        audio_r2_url    = _upload_to_r2(full_audio_norm, f"audio/{safe_job_id}/full_audio.mp3")
-        if not audio_r2_url:
-            return {"success": False, "error": "Falha ao publicar áudio no R2"}
-        if not _check_url(audio_r2_url, "Áudio para Demucs"):
-            return {"success": False, "error": "Áudio não acessível pelo Demucs"}
-
-        # 4. Demucs — extrai vocals
-        vocals_url      = _extract_vocals_demucs(audio_r2_url, safe_job_id)
-        final_audio_url = audio_r2_url
-
-        if vocals_url:
-            vocals_local = os.path.join(UPLOAD_DIR, f"{safe_job_id}_vocals_raw.mp3")
-            if _download_to_local(vocals_url, vocals_local, timeout=120):
-                vocals_norm   = _normalize_audio(vocals_local, safe_job_id,
-                                                 duration_cap=video_duration,
-                                                 suffix="vocals_norm")
-                vocals_r2_url = _upload_to_r2(vocals_norm, f"audio/{safe_job_id}/vocals.mp3")
-                if vocals_r2_url and _check_url(vocals_r2_url, "Vocals Demucs"):
-                    print(f"   ✅ Vocals isolados prontos — usando para sync")
-                    final_audio_url = vocals_r2_url
-                else:
-                    print(f"   ⚠️ Vocals R2 falhou — usando áudio completo")
-            else:
-                print(f"   ⚠️ Download vocals falhou — usando áudio completo")
+        # 1. Vídeo + duração — clipe que já está no nosso R2 é lido direto pela URL
+        #    (ffprobe/OpenCV só buscam os trechos que precisam); o resto é baixado
+        #    🗂️ cópia local já validada (tamanho + sha256) tem prioridade sobre as duas
+        owned_video    = _is_owned_url(face_source)
+        local_video    = local_copy(face_source)
+        video_ref      = local_video or (face_source if owned_video else
+                                         _ensure_local_video(face_source, safe_job_id))
+        video_duration = _get_duration(video_ref)
+        origin = " (disco)" if local_video else (" (R2, sem download)" if owned_video else "")
+        print(f"   ⏱️  Vídeo: {video_duration:.2f}s{origin}")
+
+        face_check = assess_face_presence(video_ref) if face_precheck else {"verdict": "skipped"}
+        if face_check["verdict"] == "no_face":
+            if LIPSYNC_FACE_PRECHECK_SKIP:
+                print(f"   🚫 Sem rosto nos frames amostrados — lip sync não enviado")
+                return {"success": False, "error": "no face detected (local pre-check)",
+                        "face_check": face_check}
+            # o Haar cascade erra perfil, oclusão e rosto pequeno: marca e envia mesmo assim
+            print(f"   ⚠️ Pré-checagem não achou rosto — enviando mesmo assim (marcado)")
+        if face_check["verdict"] == "weak":
+            print(f"   ⚠️ Rosto fraco (score={face_check['score']}) — enviando mesmo assim")
+
+        if audio_slice and os.path.exists(audio_slice):
+            # trecho alinhado ao start_time da cena, já em MP3 mono 44100 Hz
+            vocals_local = preextracted_vocals
+            clip_audio   = audio_slice
         else:
-            print(f"   ⚠️ Demucs falhou — fallback: áudio completo")
-
-        # 5. URL pública do vídeo — sempre usa R2 para evitar expiração de URLs fal.media
-        # fal.media URLs expiram em minutos; clips processados sequencialmente
-        # ficam esperando e a URL expira antes do Kling tentar acessar
-        video_url = _upload_to_r2(video_local, f"jobs/{safe_job_id}/lipsync_input.mp4")
-        if not video_url:
-            # fallback: tenta usar URL original se R2 falhar
-            if isinstance(face_source, str) and face_source.startswith(("http://", "https://")):
-                video_url = face_source
-                print(f"   ⚠️ R2 falhou — usando URL original (pode expirar)")
+            # 2. Áudio local
+            audio_local = _ensure_local_audio(audio_source, safe_job_id)
+            print(f"   🎵 Áudio original: {_get_duration(audio_local):.2f}s")
+
+            # 3. Stem vocal — Demucs roda uma vez por música (cache por hash do áudio);
+            #    process_lipsync já passa o stem pronto em preextracted_vocals
+            vocals_local = None
+            if preextracted_vocals and os.path.exists(preextracted_vocals):
+                vocals_local = preextracted_vocals
             else:
-                return {"success": False, "error": "Falha ao publicar vídeo no R2"}
-        if not _check_url(video_url, "Vídeo para Kling LipSync"):
-            return {"success": False, "error": "Vídeo não acessível pelo Kling LipSync"}
+                stem = get_vocal_stem(audio_local, cancel_job_id=parent_job_id)
+                vocals_local = stem["local_path"] if stem else None
+            if inflight_requests.is_cancelled(parent_job_id):
+                return {"success": False, "error": "cancelled"}
+            if not vocals_local:
+                print(f"   ⚠️ Sem stem vocal — fallback: áudio completo")
+
+            # 4. Áudio do clipe (vocals ou mix) cortado na duração do vídeo
+            clip_audio      = _normalize_audio(vocals_local or audio_local, safe_job_id,
+                                               duration_cap=video_duration,
+                                               suffix="vocals_norm")
+
+        final_audio_url = _upload_to_r2(clip_audio, f"audio/{safe_job_id}/vocals.mp3")
+        if not final_audio_url:
+            return {"success": False, "error": "Falha ao publicar áudio no R2"}
+        if not _check_url(final_audio_url, "Áudio para Kling LipSync"):
+            return {"success": False, "error": "Áudio não acessível pelo Kling LipSync"}
+
+        # 5. URL pública do vídeo — objeto nosso no R2 vai direto, sem re-upload nem HEAD.
+        # Só URLs efêmeras (fal.media expiram em minutos) ou arquivos locais são publicados.
+        if owned_video:
+            video_url = face_source
+        else:
+            video_url = _upload_to_r2(video_ref, f"jobs/{safe_job_id}/lipsync_input.mp4")
+            if not video_url:
+                # fallback: tenta usar URL original se R2 falhar
+                if isinstance(face_source, str) and face_source.startswith(("http://", "https://")):
+                    video_url = face_source
+                    print(f"   ⚠️ R2 falhou — usando URL original (pode expirar)")
+                else:
+                    return {"success": False, "error": "Falha ao publicar vídeo no R2"}
+            if not _check_url(video_url, "Vídeo para Kling LipSync"):
+                return {"success": False, "error": "Vídeo não acessível pelo Kling LipSync"}
 
         # 6. Kling LipSync
-        result = _run_kling_lipsync(video_url, final_audio_url)
+        inflight_stage, inflight_scene = ("lipsync_window", window) if window else ("lipsync", scene_number)
+        result = _run_kling_lipsync(video_url, final_audio_url, job_id=parent_job_id,
+                                    scene_number=inflight_scene, stage=inflight_stage)
         if not result.get("success"):
             return {"success": False, "error": result.get("error", "Kling LipSync falhou")}
 
         final_video_url = result["video_url"]
 
-        # 7. Salvar no R2
-        local_out = os.path.join(UPLOAD_DIR, f"{safe_job_id}_lipsync.mp4")
-        _download_to_local(final_video_url, local_out, timeout=600)
-        r2_url = None
-        if os.path.exists(local_out):
-            r2_url = _upload_to_r2(local_out, f"lipsync/{safe_job_id}/lipsync.mp4")
+        # 7. Salvar no R2 — a URL do provedor é efêmera; a cópia local fica registrada
+        saved  = _persist_output(final_video_url,
+                                 os.path.join(UPLOAD_DIR, f"{safe_job_id}_lipsync.mp4"),
+                                 f"lipsync/{safe_job_id}/lipsync.mp4")
+        r2_url = saved["video_url"]
+        inflight_requests.clear(parent_job_id, inflight_stage, inflight_scene)
 
-        vocals_used = "demucs_vocals" if vocals_url else "full_audio_fallback"
+        vocals_used = "demucs_vocals" if vocals_local else "full_audio_fallback"
         print(f"   ✅ Lipsync concluído | áudio: {vocals_used} | modelo: {result.get('model_used','?')}")
         print(f"{'='*60}\n")
 
@@ -448,8 +486,178 @@ def generate_lipsync(
             "vocals_source":  vocals_used,
             "model_used":     result.get("model_used", ""),
             "model_endpoint": result.get("model_used", ""),
+            "face_check":     face_check,
+            "video_path":     saved.get("video_path"),
+            "video_size":     saved.get("video_size"),
+            "video_sha256":   saved.get("video_sha256"),
         }
 
     except Exception as e:
         import traceback; traceback.print_exc()
         return {"success": False, "error": str(e)}
+
+
+# ══════════════════════════════════════════════════════
+# JANELAS — várias cenas vocais adjacentes numa requisição
+# ══════════════════════════════════════════════════════
+
+def plan_lipsync_windows(clips: List[dict],
+                         max_seconds: float = LIPSYNC_WINDOW_MAX_SECONDS) -> List[List[dict]]:
+    """
+    Agrupa clipes de cenas consecutivas (scene_number n, n+1, ...) em janelas
+    de até max_seconds. Janelas de um clipe só seguem pelo caminho normal.
+    """
+    windows: List[List[dict]] = []
+    current: List[dict] = []
+    length = 0.0
+    for clip in sorted(clips, key=lambda c: c.get("scene_number", 0)):
+        duration = float(clip.get("duration") or 5)
+        adjacent = current and clip.get("scene_number") == current[-1].get("scene_number", 0) + 1
+        if current and (not adjacent or length + duration > max_seconds):
+            windows.append(current)
+            current, length = [], 0.0
+        current.append(clip)
+        length += duration
+    if current:
+        windows.append(current)
+    return windows
+
+
+def _split_at(path: str, boundaries: List[float], out_pattern: str) -> List[str]:
+    """
+    Corta o vídeo nos limites das cenas com o smart cut do merge
+    (timeline_render.render_segment): GOPs inteiros vão em stream copy e só os
+    GOPs que cruzam cada limite são recodificados. O áudio de cada trecho é
+    cortado do mesmo arquivo e recodificado em AAC (barato, preciso na amostra).
+    """
+    duration = media_duration(path)
+    work_dir = os.path.dirname(out_pattern)
+    edges    = [0.0] + list(boundaries) + [duration]
+    outs     = []
+    for i, (start, end) in enumerate(zip(edges, edges[1:])):
+        seg = render_segment(path, start, end, work_dir, f"split_{i:03d}")
+        list_path = os.path.join(work_dir, f"split_{i:03d}.txt")
+        with open(list_path, "w") as f:
+            for part in seg["parts"]:
+                f.write(f"file '{os.path.abspath(part)}'\n")
+        out = out_pattern % i
+        subprocess.run(["ffmpeg", "-y", "-v", "error", "-f", "concat", "-safe", "0", "-i", list_path,
+                        "-ss", f"{start:.6f}", "-t", f"{end - start:.6f}", "-i", path,
+                        "-map", "0:v:0", "-map", "1:a:0?", "-c:v", "copy",
+                        "-c:a", "aac", "-b:a", "128k", "-movflags", "+faststart", out],
+                       check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        outs.append(out)
+    print(f"   ✂️ Janela dividida em {len(outs)} cenas (só os GOPs dos limites recodificados)")
+    return outs
+
+
+def generate_lipsync_window(
+    clips: List[dict],
+    audio_slices: Dict[int, str],
+    parent_job_id: str,
+    model: str = "sync",
+) -> Optional[Dict[int, Dict[str, Any]]]:
+    """
+    Lip sync de uma janela de cenas adjacentes numa única requisição:
+    concatena os clipes (-c copy) e os trechos de áudio de cada cena,
+    sincroniza uma vez e divide o resultado de volta por cena.
+
+    Returns:
+        {scene_number: resultado no formato de generate_lipsync}
+        ou None — o chamador deve cair para o lip sync por cena
+    """
+    numbers  = [c["scene_number"] for c in clips]
+    win_id   = f"{parent_job_id}_win{numbers[0]:03d}-{numbers[-1]:03d}"
+    work_dir = os.path.join(UPLOAD_DIR, win_id)
+    os.makedirs(work_dir, exist_ok=True)
+    print(f"🪟 Janela lip sync cenas {numbers[0]}–{numbers[-1]} ({len(clips)} clipes)")
+    try:
+        if any(n not in audio_slices for n in numbers):
+            return None
+
+        # 1. Clipes locais + durações reais; cena sem rosto derruba a janela inteira
+        videos, durations = [], []
+        for clip in clips:
+            n = clip["scene_number"]
+            local = local_copy(clip.get("video_url"), path=clip.get("video_path"),
+                               size=clip.get("video_size"), sha256=clip.get("video_sha256"))
+            if not local:
+                local = _ensure_local_video(clip.get("video_url") or clip.get("kling_url"),
+                                            f"{parent_job_id}_scene{n:03d}")
+            if (LIPSYNC_FACE_PRECHECK and LIPSYNC_FACE_PRECHECK_SKIP
+                    and assess_face_presence(local)["verdict"] == "no_face"):
+                print(f"   ⚠️ Cena {n} sem rosto — janela volta para o modo por cena")
+                return None
+            videos.append(local)
+            durations.append(media_duration(local, fallback=float(clip.get("duration") or 5)))
+
+        # 2. Vídeo da janela — clipes Kling do mesmo job têm o mesmo codec/perfil
+        list_path = os.path.join(work_dir, "clips.txt")
+        with open(list_path, "w") as f:
+            for v in videos:
+                f.write(f"file '{os.path.abspath(v)}'\n")
+        window_video = os.path.join(work_dir, "window.mp4")
+        subprocess.run(["ffmpeg", "-y", "-v", "error", "-f", "concat", "-safe", "0",
+                        "-i", list_path, "-c", "copy", window_video],
+                       check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        # 3. Áudio da janela — cada trecho ajustado à duração REAL do seu clipe,
+        #    para o corte posterior cair exatamente nos limites das cenas
+        inputs, graph = [], []
+        for i, (n, d) in enumerate(zip(numbers, durations)):
+            inputs += ["-i", audio_slices[n]]
+            graph.append(f"[{i}:a]apad,atrim=duration={d:.3f},asetpts=PTS-STARTPTS[a{i}]")
+        graph.append("".join(f"[a{i}]" for i in range(len(numbers)))
+                     + f"concat=n={len(numbers)}:v=0:a=1[out]")
+        window_audio = os.path.join(work_dir, "window_audio.mp3")
+        subprocess.run(["ffmpeg", "-y", "-v", "error"] + inputs +
+                       ["-filter_complex", ";".join(graph), "-map", "[out]",
+                        "-ar", "44100", "-ac", "1", "-c:a", "libmp3lame", "-b:a", "128k",
+                        window_audio],
+                       check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        # 4. Uma requisição para a janela inteira
+        result = generate_lipsync(
+            face_source=window_video, audio_source=window_audio, job_id=win_id, model=model,
+            parent_job_id=parent_job_id, window=(numbers[0], numbers[-1]),
+            audio_slice=window_audio, face_precheck=False,
+        )
+        if not result.get("success"):
+            print(f"   ⚠️ Janela falhou ({result.get('error')}) — voltando para o modo por cena")
+            return None
+
+        # 5. Divide de volta por cena
+        synced = local_copy(result["video_url"], path=result.get("video_path"),
+                            size=result.get("video_size"), sha256=result.get("video_sha256"))
+        if not synced:
+            synced = os.path.join(work_dir, "synced.mp4")
+            if not _download_to_local(result["video_url"], synced, timeout=600):
+                return None
+        boundaries, t = [], 0.0
+        for d in durations[:-1]:
+            t += d
+            boundaries.append(t)
+        parts = _split_at(synced, boundaries, os.path.join(work_dir, "scene_%03d.mp4"))
+
+        results: Dict[int, Dict[str, Any]] = {}
+        for n, part in zip(numbers, parts):
+            if not os.path.exists(part) or os.path.getsize(part) < 1024:
+                return None
+            url = _upload_to_r2(part, f"lipsync/{parent_job_id}_scene{n:03d}/lipsync.mp4")
+            if not url:
+                return None
+            results[n] = {
+                "success":      True,
+                "video_url":    url,
+                **register_asset(part, url),
+                "provider_url": result.get("provider_url"),
+                "task_id":      result.get("task_id", ""),
+                "window":       [numbers[0], numbers[-1]],
+                "model_used":   result.get("model_used", ""),
+            }
+        print(f"   ✅ Janela {numbers[0]}–{numbers[-1]}: {len(results)} cenas sincronizadas")
+        return results
+
+    except Exception as e:
+        print(f"   ❌ Janela lip sync falhou: {e}")
+        return None
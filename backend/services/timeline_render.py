@@ -0,0 +1,306 @@
+"""
+🎞️ ClipVox - Render da timeline (in/out por cena)
+
+O merge juntava clipes inteiros de 5s e deixava o -shortest cortar o fim:
+o vídeo escorregava em relação ao plano de cenas e o final da música sumia.
+Aqui cada clipe é cortado na duration_seconds da sua cena, com precisão de
+frame, sem recodificar o vídeo inteiro (smart cut):
+
+  [0 .. último keyframe antes do corte)  → stream copy (GOPs inteiros)
+  [keyframe .. ponto de saída]           → recodifica só esse GOP da borda
+  clipe mais curto que a cena            → o GOP final ganha tpad (congela)
+
+Transições (dissolve/fade/wipe) do plano: o fim da cena anterior entra em
+xfade com o início da próxima e só essa sobreposição é recodificada; a cena
+seguinte continua em stream copy a partir dali. A primeira cena com "fade"
+entra do preto. A trilha é a música contínua — não há acrossfade a fazer.
+
+Os pedaços saem em MPEG-TS (Annex-B) com SPS/PPS in-band: os GOPs copiados
+do provedor e os recodificados pelo x264 nunca têm parameter sets idênticos,
+e um MP4 só guarda um avcC — então cada pedaço leva os seus no bitstream.
+"""
+
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional
+
+from config import MERGE_RENDER_WORKERS
+from services.media_probe import probe_media, keyframe_times
+
+# cada cena é um trabalho independente (um ffmpeg por pedaço); os núcleos são
+# divididos entre os encodes simultâneos em vez de um processo só usar tudo
+CPU_COUNT      = os.cpu_count() or 1
+RENDER_WORKERS = max(1, MERGE_RENDER_WORKERS or CPU_COUNT)
+
+# corte a menos de meio frame de um keyframe/fim do clipe é tratado como exato
+FRAME_TOLERANCE = 0.5
+
+# transition do scene_calculator → sobreposição (s) e efeito do xfade
+TRANSITION_SECONDS = {"dissolve": 0.5, "fade": 0.5, "wipe": 0.4}
+XFADE_NAMES = {"dissolve": "fade", "fade": "fadeblack", "wipe": "wipeleft"}
+
+
+def build_timeline(fetched: List[Dict[str, Any]],
+                   scene_plan: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Casa os clipes baixados com o plano de cenas.
+
+    Cena sem clipe (falha de geração/download) é coberta pelo clipe anterior,
+    para o resto do vídeo continuar alinhado à música.
+
+    Args:
+        fetched: [{"scene_number", "path", "video_sha256"?, "video_url"?}] —
+                 path pode ser None quando a cena vem do cache de merge
+
+    Returns:
+        [{"scene_number", "path", "asset", "duration", ...cena}] na ordem do plano,
+        ou [] se os clipes não batem com o plano (merge segue sem corte)
+    """
+    plan = sorted(scene_plan or [], key=lambda s: s.get("start_time", 0))
+    by_scene = {c["scene_number"]: c for c in fetched}
+    if not plan or any(n not in {s["scene_number"] for s in plan} for n in by_scene):
+        return []
+    entries: List[Dict[str, Any]] = []
+    lead = 0.0
+    for scene in plan:
+        duration = float(scene.get("duration_seconds") or 0)
+        clip = by_scene.get(scene["scene_number"])
+        if clip:
+            entries.append(dict(scene, path=clip.get("path"), duration=duration + lead,
+                                asset=clip.get("video_sha256") or
+                                      f"{clip.get('video_url')}#{clip.get('task_id', '')}"))
+            lead = 0.0
+        elif entries:
+            entries[-1]["duration"] += duration
+        else:
+            lead += duration
+    return entries
+
+
+def encoder_args(video: Dict[str, Any], threads: int = CPU_COUNT) -> List[str]:
+    """
+    libx264 com o perfil/pix_fmt/fps do clipe. SPS/PPS vão in-band em todo
+    IDR (repeat-headers): o concat mistura pedaços do provedor e do x264, cujos
+    parameter sets nunca são idênticos — o decoder tem que ver os de cada pedaço.
+    threads: a fatia de núcleos deste encode (núcleos / encodes simultâneos).
+    """
+    args = ["-c:v", "libx264", "-preset", "veryfast", "-crf", "18",
+            "-pix_fmt", video.get("pix_fmt") or "yuv420p", "-threads", str(max(1, threads)),
+            "-x264-params", "repeat-headers=1"]
+    profile = (video.get("profile") or "").lower()
+    if profile in ("baseline", "main", "high"):
+        args += ["-profile:v", profile]
+    if video.get("fps"):
+        args += ["-r", str(video["fps"])]
+    return args
+
+
+# pedaços da timeline: MPEG-TS (Annex-B), vídeo apenas, sem atraso de mux —
+# cada pedaço carrega seus próprios SPS/PPS e todos têm o mesmo layout de streams
+PIECE_ARGS = ["-an", "-muxdelay", "0", "-muxpreload", "0", "-f", "mpegts"]
+
+
+def _copy_piece(path: str, start: float, duration: Optional[float], out: str) -> None:
+    """Stream copy para TS; h264_mp4toannexb põe os SPS/PPS do clipe in-band."""
+    cmd = ["ffmpeg", "-y", "-v", "error"]
+    if start > 0:
+        cmd += ["-ss", f"{start:.6f}"]
+    cmd += ["-i", path]
+    if duration is not None:
+        cmd += ["-t", f"{duration:.6f}"]
+    cmd += ["-map", "0:v:0", "-c", "copy", "-bsf:v", "h264_mp4toannexb",
+            "-avoid_negative_ts", "make_zero"] + PIECE_ARGS + [out]
+    _run(cmd)
+
+
+def _run(cmd: List[str]) -> None:
+    subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                   timeout=300)
+
+
+def _probe_video(path: str) -> Dict[str, Any]:
+    info = probe_media(path)
+    video = (info or {}).get("video")
+    if not video:
+        raise RuntimeError(f"sem stream de vídeo: {path}")
+    return {"video": video, "duration": info["duration"], "fps": video.get("fps") or 24.0}
+
+
+def _encode(path: str, start: float, end: float, meta: Dict[str, Any], out: str,
+            extra_filter: str = "", threads: int = CPU_COUNT) -> None:
+    """Recodifica [start, end] do clipe; além do fim do clipe, congela o último frame."""
+    frame   = 1.0 / meta["fps"]
+    seek    = min(start, max(0.0, meta["duration"] - frame))
+    filters = []
+    if seek < start:
+        filters.append(f"trim=start={start - seek:.6f},setpts=PTS-STARTPTS")
+    pad = end - meta["duration"]
+    if pad > 0:
+        filters.append(f"tpad=stop_mode=clone:stop_duration={pad + frame:.6f}")
+    if extra_filter:
+        filters.append(extra_filter)
+    cmd = ["ffmpeg", "-y", "-v", "error", "-ss", f"{seek:.6f}", "-i", path, "-map", "0:v:0"]
+    if filters:
+        cmd += ["-vf", ",".join(filters)]
+    cmd += ["-t", f"{end - start:.6f}"] + encoder_args(meta["video"], threads) + PIECE_ARGS + [out]
+    _run(cmd)
+
+
+def render_segment(path: str, start: float, end: float, out_dir: str, tag: str,
+                   extra_filter: str = "", threads: int = CPU_COUNT) -> Dict[str, Any]:
+    """
+    Corta `path` em [start, end] com precisão de frame.
+    GOPs inteiros dentro do trecho vão em stream copy; só as bordas recodificam.
+    Todo pedaço sai em TS só com vídeo (até o clipe inteiro é remuxado).
+
+    Returns:
+        {"parts": [caminhos .ts para o concat], "copied": s, "encoded": s}
+    """
+    meta  = _probe_video(path)
+    fps   = meta["fps"]
+    tol   = FRAME_TOLERANCE / fps
+    start = round(start * fps) / fps
+    end   = round(end * fps) / fps
+    if end - start <= tol:
+        return {"parts": [], "copied": 0.0, "encoded": 0.0}
+
+    copyable = meta["video"].get("codec") == "h264" and not extra_filter
+    if copyable and start <= tol and abs(meta["duration"] - end) <= tol:
+        whole = os.path.join(out_dir, f"{tag}_copy.ts")
+        _copy_piece(path, 0.0, None, whole)
+        return {"parts": [whole], "copied": end, "encoded": 0.0}
+
+    keys  = keyframe_times(path) if copyable else []
+    k_in  = min([k for k in keys if k >= start - tol] or [float("inf")])
+    k_out = max([k for k in keys if k <= min(end, meta["duration"]) + tol] or [float("-inf")])
+    if abs(k_in - start) <= tol:
+        k_in = start
+    if abs(k_out - end) <= tol:
+        k_out = end
+
+    parts: List[str] = []
+    if k_in >= k_out:
+        out = os.path.join(out_dir, f"{tag}_enc.ts")
+        _encode(path, start, end, meta, out, extra_filter, threads)
+        return {"parts": [out], "copied": 0.0, "encoded": end - start}
+
+    if k_in > start:
+        head = os.path.join(out_dir, f"{tag}_head.ts")
+        _encode(path, start, k_in, meta, head, threads=threads)
+        parts.append(head)
+    body = os.path.join(out_dir, f"{tag}_copy.ts")
+    _copy_piece(path, k_in, k_out - k_in, body)
+    parts.append(body)
+    if end > k_out:
+        tail = os.path.join(out_dir, f"{tag}_tail.ts")
+        _encode(path, k_out, end, meta, tail, threads=threads)
+        parts.append(tail)
+    return {"parts": parts, "copied": k_out - k_in, "encoded": (k_in - start) + (end - k_out)}
+
+
+def transition_seconds(entry: Dict[str, Any], previous: Optional[Dict[str, Any]]) -> float:
+    """Duração da sobreposição na entrada desta cena (0 = corte seco)."""
+    seconds = TRANSITION_SECONDS.get(entry.get("transition") or "cut", 0.0)
+    if not seconds:
+        return 0.0
+    limit = entry["duration"] / 3
+    if previous is not None:
+        limit = min(limit, previous["duration"] / 3)
+    return seconds if seconds <= limit else max(0.0, limit)
+
+
+def render_transition(prev: Dict[str, Any], nxt: Dict[str, Any], seconds: float,
+                      out: str, threads: int = CPU_COUNT) -> None:
+    """
+    Só a sobreposição: fim da cena anterior [d, d+T] (congelado se o clipe acabar)
+    entra em xfade com o início da próxima [0, T]. A duração total não muda.
+    """
+    a    = _probe_video(prev["path"])
+    fps  = a["fps"]
+    v    = a["video"]
+    d    = prev["duration"]
+    seek = max(0.0, min(d, a["duration"]) - 1.0)
+    pad  = max(0.0, d + seconds - a["duration"]) + 1.0 / fps
+    norm = f"scale={v.get('width')}:{v.get('height')},fps={fps},settb=AVTB"
+    graph = (
+        f"[0:v]tpad=stop_mode=clone:stop_duration={pad:.6f},"
+        f"trim=start={d - seek:.6f}:duration={seconds:.6f},setpts=PTS-STARTPTS,{norm}[a];"
+        f"[1:v]trim=duration={seconds:.6f},setpts=PTS-STARTPTS,{norm}[b];"
+        f"[a][b]xfade=transition={XFADE_NAMES[nxt['transition']]}:duration={seconds:.6f}:offset=0[v]"
+    )
+    _run(["ffmpeg", "-y", "-v", "error", "-ss", f"{seek:.6f}", "-i", prev["path"],
+          "-i", nxt["path"], "-filter_complex", graph, "-map", "[v]",
+          "-t", f"{seconds:.6f}"] + encoder_args(v, threads) + PIECE_ARGS + [out])
+
+
+def _render_entry(entries: List[Dict[str, Any]], i: int, work_dir: str,
+                  threads: int = CPU_COUNT) -> Dict[str, Any]:
+    """Pedaços de uma cena: transição de entrada (se houver) + corpo da cena."""
+    entry = entries[i]
+    tag   = f"seg_{i:03d}_scene{entry['scene_number']:03d}"
+    entry_in = transition_seconds(entry, entries[i - 1] if i else None)
+    parts: List[str] = []
+    encoded = 0.0
+    if entry_in and i == 0:
+        # primeira cena: fade in do preto
+        seg = render_segment(entry["path"], 0.0, entry_in, work_dir, f"{tag}_in",
+                             extra_filter=f"fade=t=in:st=0:d={entry_in:.6f}", threads=threads)
+        parts += seg["parts"]
+        encoded += seg["encoded"]
+    elif entry_in:
+        out = os.path.join(work_dir, f"{tag}_xfade.ts")
+        render_transition(entries[i - 1], entry, entry_in, out, threads)
+        parts.append(out)
+        encoded += entry_in
+    seg = render_segment(entry["path"], entry_in, entry["duration"], work_dir, tag,
+                         threads=threads)
+    return {"parts": parts + seg["parts"], "copied": seg["copied"],
+            "encoded": encoded + seg["encoded"], "transition": bool(entry_in)}
+
+
+def render_timeline(entries: List[Dict[str, Any]], work_dir: str,
+                    max_workers: int = RENDER_WORKERS, cache=None) -> Optional[List[str]]:
+    """
+    Gera os pedaços de todas as cenas na ordem da timeline, com as transições
+    planejadas (dissolve/fade/wipe) recodificadas só na sobreposição.
+
+    As cenas são renderizadas em paralelo (um ffmpeg por pedaço, pool do
+    tamanho dos núcleos); o concat em -c copy do merge junta na ordem.
+    cache: MergeCache do job — cenas com a mesma impressão digital não re-renderizam.
+
+    Returns:
+        caminhos prontos para o concat demuxer, ou None em falha
+        (o merge volta para os clipes inteiros)
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    # os núcleos se dividem entre os encodes que rodam de fato: cenas do cache não contam
+    todo    = [i for i in range(len(entries)) if cache is None or cache.get(entries, i) is None]
+    workers = max(1, min(max_workers, len(todo) or 1))
+    threads = max(1, CPU_COUNT // workers)
+
+    def _one(i: int) -> Dict[str, Any]:
+        if cache is not None:
+            parts = cache.get(entries, i)
+            if parts:
+                return {"parts": parts, "copied": 0.0, "encoded": 0.0,
+                        "transition": False, "cached": True}
+        result = _render_entry(entries, i, work_dir, threads)
+        if cache is not None:
+            result["parts"] = cache.put(entries, i, result["parts"], work_dir)
+        return result
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            rendered = list(executor.map(_one, range(len(entries))))
+    except Exception as e:
+        detail = getattr(e, "stderr", None) or e
+        print(f"   ⚠️ Timeline falhou — usando clipes inteiros: {str(detail)[-200:]}")
+        return None
+    paths = [p for r in rendered for p in r["parts"]]
+    cached = sum(1 for r in rendered if r.get("cached"))
+    print(f"   ✂️ Timeline: {len(entries)} cenas ({cached} do cache), "
+          f"{sum(r['transition'] for r in rendered)} "
+          f"transições ({workers} em paralelo, {threads} thread(s) cada) | {sum(r['copied'] for r in rendered):.1f}s "
+          f"copiados, {sum(r['encoded'] for r in rendered):.1f}s recodificados")
+    return paths
@@ -9,7 +9,8 @@ Mantém a interface atual do backend para não quebrar o restante do sistema.
 import mimetypes
 import os
 import time
-from typing import Optional, List, Dict, Any
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional, List, Dict, Any, Callable
 from urllib.parse import urlparse
 
 import requests
@@ -21,12 +22,15 @@ from config import (
     FAL_NANO_BANANA_EDIT_MODEL,
     FAL_REQUEST_TIMEOUT_SECONDS,
     FAL_POLL_INTERVAL_SECONDS,
+    FAL_IMAGE_MAX_WORKERS,
     UPLOAD_DIR,
     VISUAL_STYLES,
     R2_BUCKET_NAME,
     R2_PUBLIC_URL,
     get_r2_client,
 )
+from services.reference_images import ingest_reference_images, preprocess_reference_image
+from services import inflight_requests
 
 try:
     import fal_client
@@ -54,12 +58,15 @@ def _fal_unwrap(result: Any) -> Dict[str, Any]:
     return result if isinstance(result, dict) else {}
 
 
-def _fal_submit_and_wait(endpoint: str, arguments: Dict[str, Any], timeout_s: int = FAL_REQUEST_TIMEOUT_SECONDS) -> Dict[str, Any]:
+def _fal_submit_and_wait(endpoint: str, arguments: Dict[str, Any], timeout_s: int = FAL_REQUEST_TIMEOUT_SECONDS,
+                         job_id: str = "", scene_number: Optional[int] = None) -> Dict[str, Any]:
     _require_fal()
     start = time.time()
-    handler = fal_client.submit(endpoint, arguments=arguments)
-    request_id = getattr(handler, "request_id", "")
-    print(f"   ✅ fal task criada: {request_id} | endpoint={endpoint}")
+    request_id, handler, reattached = inflight_requests.submit_or_reattach(
+        job_id, "image", scene_number, endpoint, arguments
+    )
+    if not reattached:
+        print(f"   ✅ fal task criada: {request_id} | endpoint={endpoint}")
     last_log = None
 
     while time.time() - start < timeout_s:
@@ -85,7 +92,8 @@ def _fal_submit_and_wait(endpoint: str, arguments: Dict[str, Any], timeout_s: in
         elif status_name in {"FAILED", "ERROR", "CANCELLED"}:
             raise RuntimeError(f"fal request {request_id} terminou com status {status_name}")
 
-        time.sleep(FAL_POLL_INTERVAL_SECONDS)
+        if inflight_requests.wait_or_cancelled(job_id, FAL_POLL_INTERVAL_SECONDS):
+            raise RuntimeError(f"fal request {request_id} cancelled (job cancelado)")
 
     raise TimeoutError(f"fal timeout ({timeout_s}s) endpoint={endpoint} request_id={request_id}")
 
@@ -132,6 +140,8 @@ def _download_file(url: str, out_path: str, timeout: int = 180) -> bool:
 
 
 def _ensure_public_url(local_path: str, job_id: str, tag: str) -> Optional[str]:
+    prepared = os.path.join(UPLOAD_DIR, f"{job_id or 'adhoc'}_{tag}_prepared.jpg")
+    local_path = preprocess_reference_image(local_path, prepared) or local_path
     ext = os.path.splitext(local_path)[1].lower() or ".jpg"
     key = f"jobs/{job_id or 'adhoc'}/refs/{tag}{ext}"
     return upload_to_r2(local_path, key)
@@ -155,6 +165,7 @@ def _generate_fal_image(
     aspect_ratio: str,
     resolution: str,
     reference_image_urls: Optional[List[str]] = None,
+    job_id: str = "",
 ) -> Optional[str]:
     styled_prompt = f"{_style_prefix(style)}. {prompt}"
     endpoint = FAL_NANO_BANANA_EDIT_MODEL if reference_image_urls else FAL_NANO_BANANA_MODEL
@@ -174,7 +185,7 @@ def _generate_fal_image(
         print("   🎭 fal Nano Banana text-to-image")
 
     try:
-        res = _fal_submit_and_wait(endpoint, args)
+        res = _fal_submit_and_wait(endpoint, args, job_id=job_id, scene_number=scene_number)
         data = res.get("result", {})
         images = data.get("images") or []
         if images and images[0].get("url"):
@@ -261,13 +272,17 @@ def generate_scene_image(
         aspect_ratio=aspect_ratio,
         resolution=resolution,
         reference_image_urls=ref_urls if ref_urls else None,
+        job_id=job_id,
     )
     if not img_url:
         print("   ⚠️ fal Nano Banana falhou — usando placeholder")
+        inflight_requests.clear(job_id, "image", scene_number)
         return _generate_placeholder_image(scene_number, prompt)
 
     mode = "fal-nano-banana-edit" if ref_urls else "fal-nano-banana-text2image"
-    return _download_and_upload(img_url, scene_number, job_id, aspect_ratio, resolution, mode, prompt)
+    result = _download_and_upload(img_url, scene_number, job_id, aspect_ratio, resolution, mode, prompt)
+    inflight_requests.clear(job_id, "image", scene_number)
+    return result
 
 
 def generate_scenes_batch(
@@ -277,7 +292,9 @@ def generate_scenes_batch(
     resolution: str = "720p",
     reference_image_path: str = None,
     reference_image_paths: Optional[list] = None,
-    job_id: str = ""
+    job_id: str = "",
+    reference_image_urls: Optional[list] = None,
+    on_scene_ready: Optional[Callable[[dict], None]] = None,
 ) -> list:
     results = []
     successful_count = 0
@@ -287,32 +304,27 @@ def generate_scenes_batch(
     print(f"   Aspect Ratio: {aspect_ratio}")
     print(f"   Resolution:   {resolution}")
 
-    all_ref_paths = reference_image_paths or []
-    if not all_ref_paths and reference_image_path:
-        all_ref_paths = [reference_image_path]
-    all_ref_paths = [p for p in all_ref_paths if p and os.path.exists(p)]
-
-    cached_ref_urls: List[str] = []
-    if all_ref_paths:
-        print(f"   🎭 {len(all_ref_paths)} imagem(ns) de referência")
-        for i, path in enumerate(all_ref_paths[:3]):
-            url = _ensure_public_url(path, job_id or 'adhoc', f"ref_{i+1}")
-            if url:
-                cached_ref_urls.append(url)
-                print(f"   ✅ Ref {i+1} cached via R2")
-            else:
-                print(f"   ⚠️ Ref {i+1} falhou")
-        if not cached_ref_urls:
-            print("   ⚠️ Nenhuma referência pública disponível — usando text-to-image")
-
-    for scene in scenes:
+    # URLs já publicadas no ingest do job têm prioridade — nada é reenviado
+    cached_ref_urls: List[str] = list(reference_image_urls or [])[:3]
+    if cached_ref_urls:
+        print(f"   🎭 {len(cached_ref_urls)} referência(s) já publicada(s) no ingest")
+    else:
+        all_ref_paths = reference_image_paths or []
+        if not all_ref_paths and reference_image_path:
+            all_ref_paths = [reference_image_path]
+        all_ref_paths = [p for p in all_ref_paths if p and os.path.exists(p)]
+        if all_ref_paths:
+            print(f"   🎭 {len(all_ref_paths)} imagem(ns) de referência")
+            cached_ref_urls = ingest_reference_images(all_ref_paths, job_id)["urls"]
+            if not cached_ref_urls:
+                print("   ⚠️ Nenhuma referência pública disponível — usando text-to-image")
+
+    def _run_scene(scene: dict) -> dict:
         state = jobs_cache.get(job_id, {}) if job_id else {}
         if state.get("cancelled"):
             print(f"🛑 Geração cancelada — cena {scene['scene_number']}")
-            results.append(_generate_placeholder_image(scene["scene_number"], scene.get("prompt", "")))
-            continue
-
-        result = generate_scene_image(
+            return _generate_placeholder_image(scene["scene_number"], scene.get("prompt", ""))
+        return generate_scene_image(
             prompt=scene["prompt"],
             scene_number=scene["scene_number"],
             style=style,
@@ -322,20 +334,42 @@ def generate_scenes_batch(
             reference_imgbb_urls=cached_ref_urls if cached_ref_urls else None,
             job_id=job_id,
         )
+
+    def _collect(result: dict) -> None:
+        nonlocal successful_count
         if result["success"]:
             successful_count += 1
         results.append(result)
 
+        # modo auto: a cena segue para a próxima etapa assim que a imagem fica pronta
+        if on_scene_ready:
+            try:
+                on_scene_ready(result)
+            except Exception as exc:
+                print(f"⚠️ on_scene_ready falhou na cena {result.get('scene_number')}: {exc}")
+
         if job_id and len(results) % 5 == 0:
             try:
                 from services.job_store import save_job
                 job = jobs_cache.get(job_id, {})
                 # mantém prompts já prontos no estado do job
-                job["scene_images"] = results
+                job["scene_images"] = sorted(results, key=lambda r: r.get("scene_number", 0))
                 save_job(job_id, job)
             except Exception as exc:
                 print(f"⚠️ Save cenas falhou: {exc}")
 
+    image_workers = max(1, min(FAL_IMAGE_MAX_WORKERS, len(scenes)))
+    if image_workers == 1:
+        for scene in scenes:
+            _collect(_run_scene(scene))
+    else:
+        print(f"   Workers:      {image_workers}")
+        with ThreadPoolExecutor(max_workers=image_workers) as executor:
+            futures = [executor.submit(_run_scene, scene) for scene in scenes]
+            for future in as_completed(futures):
+                _collect(future.result())
+        results.sort(key=lambda r: r.get("scene_number", 0))
+
     print(f"✅ Generated {successful_count}/{len(scenes)} scenes successfully")
     return results
 
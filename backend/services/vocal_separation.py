@@ -0,0 +1,335 @@
+"""
+🎚️ ClipVox - Separação de vocals plugável, com hedge entre provedores
+
+Cada provedor é uma função registrada:
+
+    run(audio_path, work_id, cancel: threading.Event) -> caminho local dos vocals | None
+
+e deve parar de esperar (e cancelar o remoto, se a API permitir) quando
+`cancel` for setado. Provedores: demucs (fal.ai), stemsplit, lalal e local
+(CPU, sem rede — último da cadeia quando VOCAL_LOCAL_FALLBACK).
+
+Execução com hedge (separate_vocals):
+  - começa pelo primeiro provedor disponível na ordem de VOCAL_SEPARATION_PROVIDERS
+  - se ele passar do seu p90 de latência (histórico de sucessos), o próximo
+    entra em paralelo; se falhar, o próximo entra na hora
+  - o primeiro resultado vence e os demais são cancelados
+"""
+
+import os
+import subprocess
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional, Any
+
+import requests
+
+from config import (
+    FAL_KEY,
+    FAL_POLL_INTERVAL_SECONDS,
+    UPLOAD_DIR,
+    R2_BUCKET_NAME,
+    R2_PUBLIC_URL,
+    VOCAL_SEPARATION_PROVIDERS,
+    VOCAL_HEDGE_DEFAULT_SECONDS,
+    VOCAL_SEPARATION_POLL_SECONDS,
+    VOCAL_LOCAL_FALLBACK,
+    get_r2_client,
+)
+from services import inflight_requests
+from services import lalal_vocals, stemsplit_vocals
+from services.local_separation import separate_vocals_local
+
+try:
+    import fal_client
+except Exception:  # pragma: no cover
+    fal_client = None
+
+DEMUCS_ENDPOINT = "fal-ai/demucs"
+DEMUCS_TIMEOUT_SECONDS = 300
+SEPARATION_DIR = os.path.join(UPLOAD_DIR, "stems")
+os.makedirs(SEPARATION_DIR, exist_ok=True)
+
+HEDGE_MIN_SAMPLES = 5
+
+_providers: Dict[str, Dict[str, Callable]] = {}
+_latencies: Dict[str, deque] = {}
+_stats_lock = threading.Lock()
+
+
+# ══════════════════════════════════════════════════════
+# REGISTRO
+# ══════════════════════════════════════════════════════
+
+def register_provider(name: str, run: Callable[[str, str, threading.Event], Optional[str]],
+                      available: Callable[[], bool] = lambda: True) -> None:
+    _providers[name] = {"run": run, "available": available}
+
+
+def available_providers(order: Optional[List[str]] = None) -> List[str]:
+    if order is None:
+        order = list(VOCAL_SEPARATION_PROVIDERS)
+        if VOCAL_LOCAL_FALLBACK and "local" not in order:
+            order.append("local")
+    return [n for n in order if n in _providers and _providers[n]["available"]()]
+
+
+def _record_latency(name: str, seconds: float) -> None:
+    with _stats_lock:
+        _latencies.setdefault(name, deque(maxlen=50)).append(seconds)
+
+
+def hedge_delay(name: str) -> float:
+    """p90 da latência de sucesso do provedor — padrão enquanto há poucas amostras."""
+    with _stats_lock:
+        samples = sorted(_latencies.get(name) or [])
+    if len(samples) < HEDGE_MIN_SAMPLES:
+        return VOCAL_HEDGE_DEFAULT_SECONDS
+    return samples[min(len(samples) - 1, int(0.9 * len(samples)))]
+
+
+def separation_stats() -> Dict[str, Any]:
+    with _stats_lock:
+        names = {n: len(d) for n, d in _latencies.items()}
+    return {n: {"samples": count, "hedge_after": hedge_delay(n)} for n, count in names.items()}
+
+
+# ══════════════════════════════════════════════════════
+# EXECUÇÃO COM HEDGE
+# ══════════════════════════════════════════════════════
+
+def separate_vocals(audio_path: str, work_id: str, cancel_job_id: str = "",
+                    order: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+    """
+    Returns:
+        {"path": vocals locais, "provider": nome, "seconds": latência} — ou None
+    """
+    queue = available_providers(order)
+    if not queue:
+        print("   ⚠️ Nenhum provedor de separação de vocals configurado")
+        return None
+
+    done     = threading.Event()
+    lock     = threading.Lock()
+    running: Dict[str, Dict[str, Any]] = {}
+    outcome: Dict[str, Any] = {}
+
+    def _worker(name: str, cancel: threading.Event):
+        started = time.time()
+        try:
+            path = _providers[name]["run"](audio_path, f"{work_id}_{name}", cancel)
+        except Exception as e:
+            print(f"   ❌ Separação {name} exception: {e}")
+            path = None
+        elapsed = time.time() - started
+        with lock:
+            running[name]["finished"] = True
+            if path and not cancel.is_set() and not outcome:
+                outcome.update(path=path, provider=name, seconds=round(elapsed, 1))
+                _record_latency(name, elapsed)
+        done.set()
+
+    def _start(name: str):
+        cancel = threading.Event()
+        running[name] = {"cancel": cancel, "started": time.time(), "finished": False}
+        print(f"   🎚️ Separação: iniciando {name} (hedge em {hedge_delay(name):.0f}s)")
+        threading.Thread(target=_worker, args=(name, cancel), daemon=True).start()
+
+    with lock:
+        _start(queue.pop(0))
+    while True:
+        done.wait(1.0)
+        with lock:
+            done.clear()
+            if outcome:
+                break
+            active = [n for n, r in running.items() if not r["finished"]]
+            if inflight_requests.is_cancelled(cancel_job_id):
+                break
+            if not active and not queue:
+                break
+            last = list(running)[-1]
+            slow = time.time() - running[last]["started"] > hedge_delay(last)
+            if queue and (not active or slow):
+                if active:
+                    print(f"   ⏱️ {last} passou do p90 — hedge com {queue[0]}")
+                _start(queue.pop(0))
+
+    with lock:
+        for name, r in running.items():
+            if not r["finished"] and name != outcome.get("provider"):
+                r["cancel"].set()
+    if outcome:
+        print(f"   ✅ Vocals via {outcome['provider']} em {outcome['seconds']}s")
+        return dict(outcome)
+    print("   ❌ Todos os provedores de separação falharam")
+    return None
+
+
+# ══════════════════════════════════════════════════════
+# PROVEDOR: DEMUCS (fal.ai)
+# ══════════════════════════════════════════════════════
+
+def _fal_unwrap(result: Any) -> Dict[str, Any]:
+    if isinstance(result, dict) and isinstance(result.get("data"), dict):
+        return result["data"]
+    return result if isinstance(result, dict) else {}
+
+
+def _download(url: str, out_path: str, timeout: int = 120) -> bool:
+    try:
+        with requests.get(url, timeout=timeout, stream=True) as resp:
+            if resp.status_code != 200:
+                return False
+            tmp = out_path + ".part"
+            with open(tmp, "wb") as f:
+                for chunk in resp.iter_content(chunk_size=65536):
+                    if chunk:
+                        f.write(chunk)
+        os.replace(tmp, out_path)
+        return True
+    except Exception as e:
+        print(f"   ⚠️ Download vocals falhou: {e}")
+        return False
+
+
+def _upload_to_r2(local_path: str, key: str, content_type: str = "audio/mpeg") -> Optional[str]:
+    try:
+        r2 = get_r2_client()
+        if not r2:
+            return None
+        with open(local_path, "rb") as f:
+            r2.put_object(Bucket=R2_BUCKET_NAME, Key=key, Body=f, ContentType=content_type)
+        return f"{R2_PUBLIC_URL}/{key}" if R2_PUBLIC_URL else None
+    except Exception as e:
+        print(f"   ⚠️ R2 upload error: {e}")
+        return None
+
+
+def _normalize_full_audio(audio_path: str, out_path: str) -> str:
+    """MP3 mono 44100 Hz da música inteira — entrada do Demucs."""
+    cmd = ["ffmpeg", "-y", "-i", audio_path, "-vn", "-ar", "44100", "-ac", "1",
+           "-c:a", "libmp3lame", "-b:a", "128k", out_path]
+    subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    if not os.path.exists(out_path) or os.path.getsize(out_path) < 1024:
+        raise RuntimeError("Áudio normalizado inválido")
+    return out_path
+
+
+def _extract_vocals_demucs(audio_url: str, cancel: threading.Event) -> Optional[str]:
+    """
+    fal-ai/demucs recebe só audio_url e retorna stems na raiz:
+    data = { "vocals": {"url":"..."}, "drums": {...}, ... }
+    """
+    print(f"   🎵 Demucs: extraindo vocals de {audio_url[:60]}...")
+    try:
+        handler    = fal_client.submit(DEMUCS_ENDPOINT, arguments={"audio_url": audio_url})
+        request_id = getattr(handler, "request_id", "")
+        print(f"   ⏳ Demucs task: {request_id}")
+
+        start    = time.time()
+        last_log = None
+
+        while time.time() - start < DEMUCS_TIMEOUT_SECONDS:
+            status      = handler.status(with_logs=True)
+            status_name = getattr(status, "status", status.__class__.__name__).upper()
+            elapsed     = int(time.time() - start)
+
+            if isinstance(status, getattr(fal_client, "Queued", tuple())):
+                print(f"   ⏳ Demucs fila pos={getattr(status,'position','?')} ({elapsed}s)")
+            elif isinstance(status, getattr(fal_client, "InProgress", tuple())):
+                logs = getattr(status, "logs", None) or []
+                if logs:
+                    msg = logs[-1].get("message") or str(logs[-1])
+                    if msg != last_log:
+                        print(f"   ⏳ Demucs: {msg} ({elapsed}s)")
+                        last_log = msg
+                else:
+                    print(f"   ⏳ Demucs processando... ({elapsed}s)")
+            elif isinstance(status, getattr(fal_client, "Completed", tuple())) or status_name == "COMPLETED":
+                data      = _fal_unwrap(handler.get())
+                vocals    = data.get("vocals") or {}
+                vocal_url = vocals.get("url") if isinstance(vocals, dict) else None
+                if not vocal_url:
+                    stems     = data.get("stems") or {}
+                    vocals_s  = stems.get("vocals") or {}
+                    vocal_url = vocals_s.get("url") if isinstance(vocals_s, dict) else None
+                if not vocal_url:
+                    vocal_url = data.get("vocals_url") or data.get("vocal_url")
+                if vocal_url:
+                    print(f"   ✅ Demucs vocals extraídos: {vocal_url[:80]}")
+                    return vocal_url
+                print(f"   ❌ Demucs sem vocal_url. Keys: {list(data.keys())}")
+                return None
+            elif status_name in {"FAILED", "ERROR", "CANCELLED"}:
+                print(f"   ❌ Demucs falhou: {status_name}")
+                return None
+
+            if cancel.wait(FAL_POLL_INTERVAL_SECONDS):
+                print(f"   🛑 Demucs cancelado")
+                try:
+                    handler.cancel()
+                except Exception:
+                    pass
+                return None
+
+        print(f"   ❌ Demucs timeout ({DEMUCS_TIMEOUT_SECONDS}s)")
+        return None
+
+    except Exception as e:
+        print(f"   ❌ Demucs exception: {e}")
+        return None
+
+
+def _run_demucs(audio_path: str, work_id: str, cancel: threading.Event) -> Optional[str]:
+    full_norm = _normalize_full_audio(audio_path, os.path.join(SEPARATION_DIR, f"{work_id}_full.mp3"))
+    audio_url = _upload_to_r2(full_norm, f"audio/stems/{work_id}/full_audio.mp3")
+    if not audio_url:
+        print("   ⚠️ Falha ao publicar áudio para o Demucs")
+        return None
+    vocals_url = _extract_vocals_demucs(audio_url, cancel)
+    if not vocals_url or cancel.is_set():
+        return None
+    local = os.path.join(SEPARATION_DIR, f"{work_id}_vocals.mp3")
+    return local if _download(vocals_url, local) else None
+
+
+# ══════════════════════════════════════════════════════
+# PROVEDORES: STEMSPLIT / LALAL (APIs próprias)
+# ══════════════════════════════════════════════════════
+
+def _run_stemsplit(audio_path: str, work_id: str, cancel: threading.Event) -> Optional[str]:
+    return stemsplit_vocals.extract_vocals(audio_path, work_id, cancel_event=cancel,
+                                           poll_interval=VOCAL_SEPARATION_POLL_SECONDS)
+
+
+def _run_lalal(audio_path: str, work_id: str, cancel: threading.Event) -> Optional[str]:
+    return lalal_vocals.extract_vocals(audio_path, work_id, cancel_event=cancel,
+                                       poll_interval=VOCAL_SEPARATION_POLL_SECONDS)
+
+
+register_provider("demucs", _run_demucs, available=lambda: bool(FAL_KEY) and fal_client is not None)
+register_provider("stemsplit", _run_stemsplit, available=lambda: bool(stemsplit_vocals.STEMSPLIT_API_KEY))
+register_provider("lalal", _run_lalal, available=lambda: bool(lalal_vocals.LALAL_API_KEY))
+
+
+# ══════════════════════════════════════════════════════
+# PROVEDOR: LOCAL (CPU)
+# ══════════════════════════════════════════════════════
+
+def _librosa_available() -> bool:
+    try:
+        import librosa  # noqa: F401
+        import soundfile  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _run_local(audio_path: str, work_id: str, cancel: threading.Event) -> Optional[str]:
+    return separate_vocals_local(audio_path, os.path.join(SEPARATION_DIR, f"{work_id}_vocals.wav"),
+                                 cancel=cancel)
+
+
+register_provider("local", _run_local, available=_librosa_available)
@@ -0,0 +1,166 @@
+"""
+🎙️ ClipVox - Cache de stems vocais (separação uma vez por música)
+
+Antes, cada clipe normalizava a música inteira, subia no R2 e rodava um Demucs
+completo — 40 clipes = 40 separações idênticas. Agora o stem vocal é extraído
+UMA vez e guardado por hash do conteúdo do áudio:
+
+  1. memória   → {hash: stem}
+  2. disco     → UPLOAD_DIR/stems/<hash>_vocals.mp3
+  3. R2        → audio/stems/<hash>/vocals.mp3 (sobrevive a restarts)
+  4. separação → só se nenhum dos anteriores existir (vocal_separation:
+                 provedores com hedge — o vencedor é o que fica no cache)
+
+Chamadas concorrentes para o mesmo áudio esperam a primeira separação.
+
+quality="draft" usa só a separação local (CPU) e tem cache próprio; um stem
+local que venceu no modo "best" (remotos falharam) também vai para o cache de
+rascunho, para a próxima chamada tentar os remotos de novo.
+"""
+
+import hashlib
+import os
+import shutil
+import subprocess
+import threading
+from typing import Optional, Dict, Any
+
+import requests
+
+from config import (
+    UPLOAD_DIR,
+    R2_BUCKET_NAME,
+    R2_PUBLIC_URL,
+    VOCAL_SEPARATION_QUALITY,
+    get_r2_client,
+)
+from services.vocal_separation import separate_vocals
+
+STEM_CACHE_DIR = os.path.join(UPLOAD_DIR, "stems")
+os.makedirs(STEM_CACHE_DIR, exist_ok=True)
+
+_stems: Dict[str, Dict[str, Any]] = {}
+_hashes: Dict[tuple, str] = {}
+_locks: Dict[str, threading.Lock] = {}
+_registry_lock = threading.Lock()
+
+
+def audio_content_hash(path: str) -> str:
+    """sha256 do arquivo — memorizado por (path, mtime, size)."""
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_mtime, st.st_size)
+    with _registry_lock:
+        if key in _hashes:
+            return _hashes[key]
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    digest = h.hexdigest()[:32]
+    with _registry_lock:
+        _hashes[key] = digest
+    return digest
+
+
+def _lock_for(audio_hash: str) -> threading.Lock:
+    with _registry_lock:
+        lock = _locks.get(audio_hash)
+        if lock is None:
+            lock = threading.Lock()
+            _locks[audio_hash] = lock
+        return lock
+
+
+def _download(url: str, out_path: str, timeout: int = 120) -> bool:
+    try:
+        with requests.get(url, timeout=timeout, stream=True) as resp:
+            if resp.status_code != 200:
+                return False
+            tmp = out_path + ".part"
+            with open(tmp, "wb") as f:
+                for chunk in resp.iter_content(chunk_size=65536):
+                    if chunk:
+                        f.write(chunk)
+        os.replace(tmp, out_path)
+        return True
+    except Exception as e:
+        print(f"   ⚠️ Download stem falhou: {e}")
+        return False
+
+
+def _upload_to_r2(local_path: str, key: str, content_type: str = "audio/mpeg") -> Optional[str]:
+    try:
+        r2 = get_r2_client()
+        if not r2:
+            return None
+        with open(local_path, "rb") as f:
+            r2.put_object(Bucket=R2_BUCKET_NAME, Key=key, Body=f, ContentType=content_type)
+        return f"{R2_PUBLIC_URL}/{key}" if R2_PUBLIC_URL else None
+    except Exception as e:
+        print(f"   ⚠️ R2 upload stem error: {e}")
+        return None
+
+
+def _store_as_mp3(src: str, dest: str) -> bool:
+    """Guarda o stem vencedor no cache — MP3 mono 44100 Hz (LALAL devolve WAV)."""
+    if src.lower().endswith(".mp3"):
+        shutil.move(src, dest)
+    else:
+        cmd = ["ffmpeg", "-y", "-i", src, "-vn", "-ar", "44100", "-ac", "1",
+               "-c:a", "libmp3lame", "-b:a", "128k", dest]
+        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return os.path.exists(dest) and os.path.getsize(dest) > 1024
+
+
+def get_vocal_stem(audio_path: str, cancel_job_id: str = "",
+                   quality: str = VOCAL_SEPARATION_QUALITY) -> Optional[Dict[str, Any]]:
+    """
+    Stem vocal da música, extraído uma única vez por conteúdo de áudio.
+
+    Args:
+        quality: "best" (provedores com hedge) ou "draft" (só separação local)
+
+    Returns:
+        dict com "hash", "local_path", "url" (R2), "source" e "quality"
+        — ou None se a separação falhar
+    """
+    if not audio_path or not os.path.exists(audio_path):
+        return None
+    audio_hash = audio_content_hash(audio_path)
+    draft      = quality == "draft"
+    cache_key  = f"{audio_hash}_draft" if draft else audio_hash
+
+    with _lock_for(cache_key):
+        cached = _stems.get(cache_key)
+        if cached and os.path.exists(cached["local_path"]):
+            return cached
+
+        local  = os.path.join(STEM_CACHE_DIR, f"{cache_key}_vocals.mp3")
+        r2_key = f"audio/stems/{cache_key}/vocals.mp3"
+        url    = f"{R2_PUBLIC_URL}/{r2_key}" if R2_PUBLIC_URL else None
+        source = "disk"
+
+        if not os.path.exists(local) and url and _download(url, local, timeout=60):
+            source = "r2"
+        if not os.path.exists(local):
+            print(f"🎙️ Separando vocals (uma vez, {quality}) — áudio {audio_hash[:12]}")
+            separated = separate_vocals(audio_path, cache_key, cancel_job_id=cancel_job_id,
+                                        order=["local"] if draft else None)
+            if not separated:
+                return None
+            source = separated["provider"]
+            if source == "local" and not draft:
+                # fallback local não ocupa o cache "best" — a próxima chamada tenta os remotos
+                cache_key = f"{audio_hash}_draft"
+                local     = os.path.join(STEM_CACHE_DIR, f"{cache_key}_vocals.mp3")
+                r2_key    = f"audio/stems/{cache_key}/vocals.mp3"
+                url       = f"{R2_PUBLIC_URL}/{r2_key}" if R2_PUBLIC_URL else None
+            if not _store_as_mp3(separated["path"], local):
+                return None
+            url = _upload_to_r2(local, r2_key) or url
+
+        stem = {"hash": audio_hash, "local_path": local, "url": url, "source": source,
+                "quality": "draft" if cache_key.endswith("_draft") else "best"}
+        _stems[cache_key] = stem
+        print(f"   ✅ Stem vocal pronto ({source}): {local}")
+        return stem